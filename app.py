@@ -1,16 +1,12 @@
-from shiny import App, render, reactive, ui
+import asyncio
+import json
+
+from shiny import App, render, reactive, req, ui
 from shiny.types import FileInfo
-from shinywidgets import output_widget, render_widget, render_plotly
 
 import faicons as fa
-import pandas as pd
-import numpy as np
-# from datetime import datetime, timedelta
-
-import plotly.express as px
-# import plotly.graph_objects as go
 
-import helpers as hp
+import startup
 
 # from forex_python.converter import CurrencyRates
 # import requests
@@ -18,107 +14,305 @@ import helpers as hp
 ICONS = {
     'wallet': fa.icon_svg('wallet'),
     'currency_eur': fa.icon_svg('euro-sign'),
-    'currency_gbp': fa.icon_svg('sterling-sign')
+    'currency_gbp': fa.icon_svg('sterling-sign'),
+    'currency_usd': fa.icon_svg('dollar-sign'),
+    'currency_jpy': fa.icon_svg('yen-sign'),
+    'currency_chf': fa.icon_svg('franc-sign'),
+    'currency_inr': fa.icon_svg('indian-rupee-sign'),
+    'currency_other': fa.icon_svg('money-bill'),
 }
 
-MONTHS = hp.MONTHS
+## pandas, plotly, shinywidgets and the helpers are imported by the startup worker, then the
+## ledger is loaded: the server accepts connections as soon as shiny is imported
+ledger = None
+RESULTS = None
+## current ledger frame (None while loading), set on every new version so the outputs of all the sessions are invalidated
+finance = reactive.Value(None)
+## batches written by the store: the outputs read from data.db (sqlite storage) are refreshed once the changes are in it
+written = reactive.Value(0)
+## why the ledger could not be loaded (None while loading or once loaded), shown by every session
+load_error = reactive.Value(None)
+## bumped whenever new rules are saved, by any session: the rule hit counts of every session are computed again
+rules_version = reactive.Value(0)
 
-finance = reactive.Value()
-finance.set(hp.import_data())
+def load_ledger():
+    global ledger, RESULTS
+    import helpers as hp
+    import store
 
+    ## one ledger per process: every session reads it and commits its changes to it
+    ## it keeps the monthly aggregates behind the charts and the row ids by (account, year) up to date
+    loaded = store.LedgerStore(
+        hp.import_data(),
+        convert=hp.eur_amounts,
+        save=hp.save_changes,
+        compact=hp.compact_storage,
+        lock=reactive.lock,
+        flush=reactive.flush,
+        totals=hp.daily_totals(),
+        load=hp.load_partitions if hp.STORAGE_MODE == 'partitioned' else None,
+        budget=hp.PARTITION_BUDGET,
+    )
+    loaded.subscribe(lambda version: finance.set(loaded.data))
+    loaded.subscribe_saved(lambda: written.set(written.get() + 1))
+    ## derived datasets shared by all the outputs and sessions, keyed by (name, data version, filters)
+    RESULTS = hp.LRU(maxsize=256)
+    ledger = loaded
 
-app_ui = ui.page_navbar(
-    ui.nav_panel(
-        'Plots',
-        ui.layout_columns(
-            ui.row(
-                ui.column(3,ui.output_ui('summary_boxes')),
-                ui.column(
-                    9,
-                    ui.card(
-                        ui.card_header(ui.HTML('<h1>Monthly Balance</h1>')),
-                        ui.row(
-                            ui.column(4, ui.output_ui('select_account'),),
-                            ui.column(4, ui.output_ui('select_year'),),
+LOADING = startup.run('ledger', load_ledger)
+publisher = None
+## report generation of the process (reports.py), one at a time for all the sessions
+reporting = None
+
+async def publish_ledger():
+    ## hand the ledger over to the sessions once the worker has loaded it
+    try:
+        await asyncio.wrap_future(LOADING)
+        error = None if ledger.data is not None else 'see the server log'
+    except Exception as e:
+        print(f'Oops, something went wrong while loading the ledger\nException: {e}')
+        error = str(e)
+    async with reactive.lock():
+        if error is None:
+            finance.set(ledger.data)
+        else:
+            load_error.set(error)
+        await reactive.flush()
+
+
+def app_ui(request):
+    ## built on request: the first page waits for the heavy modules, not for the ledger
+    startup.wait_modules()
+    from shinywidgets import output_widget
+    import diagnostics
+    import forecast
+    import helpers as hp
+
+    return ui.page_navbar(
+        ui.nav_panel(
+            'Plots',
+            ui.layout_columns(
+                ui.row(
+                    ui.column(3,ui.output_ui('summary_boxes')),
+                    ui.column(
+                        9,
+                        ui.card(
+                            ui.card_header(ui.HTML('<h1>Monthly Balance</h1>')),
+                            ui.row(
+                                ui.column(4, ui.output_ui('select_account'),),
+                                ui.column(4, ui.output_ui('select_year'),),
+                            ),
+                            output_widget('plot_monthly_balance'),
+                            output_widget('plot_monthly_in_out'),
+                            full_screen=True
                         ),
-                        output_widget('plot_monthly_balance'),
-                        output_widget('plot_monthly_in_out'),
-                        full_screen=True
-                    ),
-                    ui.card(
-                        ui.card_header(ui.HTML('<h1>Category percentage</h1>')), 
-                        ui.row(
-                            ui.column(4, ui.output_ui('select_year_2')),
-                            ui.column(4, ui.output_ui('select_month')),
+                        ui.card(
+                            ui.card_header(ui.HTML('<h1>Daily Balance</h1>')),
+                            ui.row(
+                                ui.column(4, ui.output_ui('select_daily_account')),
+                                ui.column(8, ui.output_ui('select_daily_range')),
+                            ),
+                            output_widget('plot_daily_balance'),
+                            full_screen=True
                         ),
-                        ui.row(
-                            ui.column(
-                                6,
-                                output_widget('pcg_category_plot'),
-                                full_screen=True
+                        ui.card(
+                            ui.card_header(ui.HTML('<h1>Projection</h1>')),
+                            ui.row(
+                                ui.column(4, ui.output_ui('select_forecast_account')),
+                                ui.column(4, ui.input_slider('forecast_years', 'Years:', min=1, max=30, value=10)),
+                                ui.column(4, ui.input_numeric('forecast_paths', 'Simulated paths:', value=10_000, min=100, max=forecast.MAX_PATHS, step=1_000)),
+                            ),
+                            output_widget('plot_forecast'),
+                            full_screen=True
+                        ),
+                        ui.card(
+                            ui.card_header(ui.HTML('<h1>Category percentage</h1>')), 
+                            ui.row(
+                                ui.column(4, ui.output_ui('select_year_2')),
+                                ui.column(4, ui.output_ui('select_month')),
+                            ),
+                            ui.row(
+                                ui.column(
+                                    6,
+                                    output_widget('pcg_category_plot'),
+                                    full_screen=True
+                                ),
+                                ui.column(
+                                    6,
+                                    ui.output_data_frame('category_table')
+                                )
                             ),
-                            ui.column(
-                                6,
-                                ui.output_data_frame('category_table')
-                            )
                         ),
                     ),
-                ),
-            )
+                )
                 
-            # col_widths=(3,9)
+                # col_widths=(3,9)
+            ),
         ),
-    ),
-    ui.nav_panel(
-        'Data',
-        ui.layout_columns(
-            ui.row(
-                ui.column(
-                    3,
-                    ui.row(
-                        ui.output_ui('table_year_filter'),
-                        ui.output_ui('table_account_filter'),
+        ui.nav_panel(
+            'Data',
+            ui.layout_columns(
+                ui.row(
+                    ui.column(
+                        3,
+                        ui.row(
+                            ui.input_text('table_search', 'Search descriptions:', placeholder='e.g., coop'),
+                            ui.output_ui('table_year_filter'),
+                            ui.output_ui('table_account_filter'),
+                            ui.output_ui('table_category_filter'),
+                        ),
+                        ui.row(
+                            ui.column(6, ui.input_numeric('table_amount_min', 'Amount from:', value=None, min=0)),
+                            ui.column(6, ui.input_numeric('table_amount_max', 'to:', value=None, min=0)),
+                        ),
+                        ui.markdown('Add | Delete | Edit | Import'),
+                        ui.row(
+                            ui.column(3, ui.tooltip(ui.output_ui('add_btn'),'Add', placement='top')),
+                            ui.column(3, ui.tooltip(ui.output_ui('delete_btn'),'Delete', placement='top')),
+                            ui.column(3, ui.tooltip(ui.output_ui('edit_btn'), 'Edit', placement='top')),
+                            ui.column(3, ui.tooltip(ui.output_ui('import_btn'), 'Import statement', placement='top')),
+                        ),
+                        ui.markdown('Rules | Reports'),
+                        ui.row(
+                            ui.column(3, ui.tooltip(ui.output_ui('rules_btn'), 'Rules', placement='top')),
+                            ui.column(3, ui.tooltip(ui.output_ui('reports_btn'), 'Generate reports', placement='top')),
+                        )
                     ),
-                    ui.markdown('Add | Delete | Edit'),
-                    ui.markdown('Modify the table only on UNFILTERED data'),## to fix and remove
-                    ui.row(
-                        ui.column(4, ui.tooltip(ui.output_ui('add_btn'),'Add', placement='top')),
-                        ui.column(4, ui.tooltip(ui.output_ui('delete_btn'),'Delete', placement='top')),
-                        ui.column(4, ui.tooltip(ui.output_ui('edit_btn'), 'Edit', placement='top')),
+                    ui.column(
+                        9,
+                        ui.row(
+                            ui.column(3, ui.input_select('table_sort', 'Sort by:', choices=hp.TABLE_COLUMNS, selected='date')),
+                            ui.column(2, ui.input_switch('table_desc', 'Descending', value=True)),
+                            ui.column(2, ui.input_select('table_page_size', 'Rows per page:', choices=hp.TABLE_PAGE_SIZES, selected=100)),
+                            ui.column(5, ui.output_ui('table_pager')),
+                        ),
+                        ui.output_data_frame('data_grid'),
                     )
-                ),
-                ui.column(
-                    9,
-                    ui.output_data_frame('data_grid'),
                 )
             )
-        )
-    ),
+        ),
+
+        ## only with FINANCE_DIAGNOSTICS=1
+        *([ui.nav_panel(
+            'Diagnostics',
+            ui.row(
+                ui.column(3, ui.input_select('diagnostics_name', 'Profile the next run of:', choices=[])),
+                ui.column(2, ui.input_action_button('diagnostics_profile', 'Profile', class_='btn btn-secondary')),
+                ui.column(2, ui.download_button('diagnostics_dump', 'Download json')),
+            ),
+            ui.output_data_frame('diagnostics_table'),
+            ui.output_text_verbatim('diagnostics_profiles'),
+        )] if diagnostics.ENABLED else []),
 
-    title='Personal Finance',
-    fillable=True
-)
+        header=ui.output_ui('loading_state'),
+        title='Personal Finance',
+        fillable=True
+    )
 
 def server(input, output, session):
+    global publisher
+    startup.wait_modules()
+    import numpy as np
+    import pandas as pd
+    import plotly.express as px
+    import plotly.graph_objects as go
+    from shinywidgets import render_widget
+    import diagnostics
+    import forecast
+    import helpers as hp
+    import rules
+
+    MONTHS = hp.MONTHS
+    if publisher is None:
+        publisher = asyncio.ensure_future(publish_ledger())
 
     @render.ui
+    def loading_state():
+        if finance.get() is not None:
+            return None
+        ## set once the loading is over, the sessions already waiting are told too
+        if load_error.get() is not None:
+            return ui.div(f'Could not load the ledger: {load_error.get()}', class_='alert alert-danger')
+        return ui.div(ui.span(class_='spinner-border spinner-border-sm me-2'), 'Loading the ledger...', class_='alert alert-info')
+
+    def saved(error):
+        ## the store's writer reports back once the change of this session is on disk
+        if error is None:
+            ui.notification_show('File saved', type='message', session=session)
+        else:
+            ui.notification_show(f'Error while trying to save to file: {error}', type='error', session=session)
+
+    @reactive.calc
+    @diagnostics.instrument(kind='calc')
+    def data_version():
+        ## nothing is computed until the ledger is loaded
+        req(finance.get() is not None)
+        return ledger.version
+
+    @reactive.calc
+    @diagnostics.instrument(kind='calc')
+    def accounts():
+        ## from the monthly aggregates: they cover the whole history, even the years not in memory
+        return RESULTS.get(('accounts', data_version()), lambda: ledger.cube.accounts())
+
+    @reactive.calc
+    @diagnostics.instrument(kind='calc')
+    def years():
+        return RESULTS.get(('years', data_version()), lambda: ledger.cube.years())
+
+    @reactive.calc
+    @diagnostics.instrument(kind='calc')
+    def account_years():
+        account = input.select_account_()
+        return RESULTS.get(('account_years', data_version(), account), lambda: ledger.cube.years(account))
+
+    @reactive.calc
+    @diagnostics.instrument(kind='calc')
+    def months():
+        year = int(input.select_year_2_())
+        return RESULTS.get(('months', data_version(), year), lambda: ledger.cube.months(year))
+
+    @reactive.calc
+    @diagnostics.instrument(kind='calc')
+    def account_months():
+        ## monthly in/out and closing balance of the selected account
+        account = input.select_account_()
+        if hp.STORAGE_MODE == 'sqlite':
+            ## aggregated by SQLite: data.db has the changes once they are written
+            data_version()
+            return RESULTS.get(('sqlite_account_months', written(), account), lambda: hp.sqlite_account_months(account))
+        return RESULTS.get(('account_months', data_version(), account), lambda: ledger.cube.account_months(account))
+
+    @reactive.calc
+    @diagnostics.instrument(kind='calc')
+    def category_months():
+        ## category percentages of every month of the selected year
+        year = int(input.select_year_2_())
+        if hp.STORAGE_MODE == 'sqlite':
+            data_version()
+            return RESULTS.get(('sqlite_monthly_category', written(), year), lambda: hp.sqlite_monthly_category(year))
+        return RESULTS.get(('monthly_category', data_version(), year), lambda: hp.monthly_category(ledger.cube, year))
+
+    @render.ui
+    @diagnostics.instrument()
     def summary_boxes():
-        data = finance.get()
+        data_version()
 
         boxes_acc = []
         boxes_values = []
         boxes_curr = []
 
-        balances = hp.calculate_account_balance(data)
-        total_wealth = f'{hp.calculate_total_wealth(data):,.2f}'
+        ## closing balances of the store's running balances, total wealth at today's rates
+        balances, total = RESULTS.get(('balances', data_version()), lambda: hp.index_balances(ledger.balances))
+        total_wealth = f'{total:,.2f}'
         boxes_acc.append('Total Wealth')
         boxes_values.append(total_wealth)
-        boxes_curr.append('EUR')
+        boxes_curr.append(hp.BASE_CURRENCY)
 
-        for i in range(len(balances)):
-            boxes_acc.append(balances[i][2].upper())
-            boxes_values.append(f'{balances[i][1]:,.2f}')
-            boxes_curr.append(balances[i][0])
+        for account, currency, balance in balances.itertuples():
+            boxes_acc.append(account.upper())
+            boxes_values.append(f'{balance:,.2f}')
+            boxes_curr.append(currency)
         
         boxes = []
         for row in range(len(boxes_acc)):
@@ -126,142 +320,304 @@ def server(input, output, session):
                 ui.value_box(
                     title=boxes_acc[row],
                     value=boxes_values[row],
-                    showcase=ICONS['currency_eur'] if boxes_curr[row] == 'EUR' else ICONS['currency_gbp']
+                    showcase=ICONS.get(f'currency_{boxes_curr[row].lower()}', ICONS['currency_other'])
                 )                 
             )
 
         return boxes
 
     @render.ui
+    @diagnostics.instrument()
     def select_account():
-        data = finance.get()
         return ui.input_select(
             'select_account_',
             'Filter by account:',
-            choices=[acc for acc in data.account.unique()],
+            choices=accounts(),
             selected='sella'
         )
 
     @render.ui
+    @diagnostics.instrument()
     def select_year():
-        data = finance.get()
-        account = input.select_account_()
-        data = data[data.account == account]
         return ui.input_select(
             'select_year_',
             'Filter by year:',
-            choices=[int(yr) for yr in data.date.dt.year.unique()],
-            selected=max(data.year)
+            choices=account_years(),
+            selected=max(account_years())
         )
     
     @render.ui
+    @diagnostics.instrument()
     def select_year_2():
-        data = finance.get()
-        # account = input.select_account_()
-        # data = data[data.account == account]
         return ui.input_select(
             'select_year_2_',
             'Filter by year:',
-            choices=[int(yr) for yr in data.date.dt.year.unique()],
-            selected=max(data.year)
+            choices=years(),
+            selected=max(years())
         )
     
     @render.ui
+    @diagnostics.instrument()
     def select_month():
-        data = finance.get()
-        data = data[data.year == int(input.select_year_2_())]
-        # print(data.iloc[-1].month)
-        months = [int(month) for month in sorted(data.date.dt.month.unique())]
         return ui.input_select(
             'select_month_',
             'Filter by month:',
-            choices= months,
-            selected=max(months)
+            choices=months(),
+            selected=max(months())
         )
     
+    ## the figures are built once per session on a placeholder row (keeping the px styling), then
+    ## the effects below only patch their trace data and title: selector changes send the new
+    ## points to the browser, not a whole new figure
+    def monthly_figure(y, y_title):
+        placeholder = pd.DataFrame({'month': [1], y: [0.0]})
+        fig = go.FigureWidget(px.bar(data_frame=placeholder, x='month', y=y))
+        fig.update_xaxes(title=None, labelalias=dict(zip([1,2,3,4,5,6,7,8,9,10,11,12], MONTHS)))
+        fig.update_yaxes(title=y_title)
+        fig.update_layout(showlegend=False)
+        return fig
+
+    @reactive.calc
+    @diagnostics.instrument(kind='calc')
+    def account_year_months():
+        data = account_months()
+        return data[data.year == int(input.select_year_())]
+
     @render_widget
+    @diagnostics.instrument()
     def plot_monthly_balance():
-        data = finance.get()
-        data = data[data.account == input.select_account_()]
-        data = data.sort_values(['date'])
-        data['in_out'] = data['in'] - data['out']
-        data['balance'] = round(data.in_out.cumsum(), 2)
+        return monthly_figure('balance', 'Balance')
 
-        data = data.groupby(['year', 'month', 'account', 'currency']).agg({'in':'sum', 'out':'sum', 'in_out':'sum', 'balance':'last'}).reset_index()
-
-        balance_df = data[data.year == int(input.select_year_())]
+    @reactive.effect
+    @diagnostics.instrument('plot_monthly_balance_update', kind='effect')
+    def _():
+        fig = plot_monthly_balance.widget
+        balance_df = account_year_months()
         title = f'Monthly balance | {input.select_account_().upper()} | {input.select_year_()}'
 
-        fig = px.bar(
-            data_frame=balance_df,
-            x='month',
-            y='balance',
-            title=title
-        )
-
-        fig.update_xaxes(title=None, labelalias=dict(zip([1,2,3,4,5,6,7,8,9,10,11,12], MONTHS)))
-        fig.update_yaxes(title='Balance')
+        with fig.batch_update():
+            fig.data[0].x = balance_df.month.to_numpy()
+            fig.data[0].y = balance_df.balance.to_numpy()
+            fig.layout.title.text = title
 
-        return fig
-    
     @render_widget
+    @diagnostics.instrument()
     def plot_monthly_in_out():
-        data = finance.get()
-        data = data[data.account == input.select_account_()]
-        data = data.sort_values(['date'])
-        data['in_out'] = data['in'] - data['out']
-        data['balance'] = round(data.in_out.cumsum(), 2)
+        return monthly_figure('in_out', 'Net Savings')
 
+    @reactive.effect
+    @diagnostics.instrument('plot_monthly_in_out_update', kind='effect')
+    def _():
+        fig = plot_monthly_in_out.widget
+        balance_df = account_year_months()
+        title = f'Net Savings | {input.select_account_().upper()} | {input.select_year_()}'
 
-        data = data.groupby(['year', 'month', 'account', 'currency']).agg({'in':'sum', 'out':'sum', 'in_out':'sum', 'balance':'last'}).reset_index()
+        with fig.batch_update():
+            fig.data[0].x = balance_df.month.to_numpy()
+            fig.data[0].y = balance_df.in_out.to_numpy()
+            fig.data[0].marker.color = np.where(balance_df.in_out <= 0, 'red', 'green')
+            fig.layout.title.text = title
 
-        balance_df = data[data.year == int(input.select_year_())]
-        balance_df['color'] = balance_df.in_out.apply(lambda x: 'red' if x <= 0 else 'green')
-        title = f'Net Savings | {input.select_account_().upper()} | {input.select_year_()}'
+    @render.ui
+    @diagnostics.instrument()
+    def select_daily_account():
+        return ui.input_select(
+            'select_daily_account_',
+            'Account:',
+            choices={'': 'Total wealth', **{account: account for account in accounts()}},
+            selected=''
+        )
 
-        fig = px.bar(
-            data_frame=balance_df,
-            x='month',
-            y='in_out',
-            color='color',
-            color_discrete_map={'red':'red', 'green':'green'},
-            title=title
+    @render.ui
+    @diagnostics.instrument()
+    def select_daily_range():
+        ## not re-rendered on every change of the ledger, only once it is loaded
+        req(finance.get() is not None)
+        with reactive.isolate():
+            start, end = hp.daily_balance_range(ledger.balances)
+            first = ledger.balances.first_day()
+        return ui.input_date_range(
+            'select_daily_range_',
+            'Dates:',
+            start=start,
+            end=end,
+            min=None if first is None else pd.Timestamp(first).date(),
+            format='dd/mm/yyyy',
+            weekstart=1
         )
 
-        fig.update_xaxes(title=None, labelalias=dict(zip([1,2,3,4,5,6,7,8,9,10,11,12], MONTHS)))
-        fig.update_yaxes(title='Net Savings')
-        fig.update_layout(showlegend=False)
+    @reactive.calc
+    @diagnostics.instrument(kind='calc')
+    def daily_balance():
+        ## one point per day of any range, each a binary search in the running balances
+        account = input.select_daily_account_() or None
+        start, end = input.select_daily_range_()
+        req(start is not None and end is not None and start <= end)
+        return RESULTS.get(
+            ('daily_balance', data_version(), account, start, end),
+            lambda: ledger.balances.daily(account, start, end)
+        )
 
+    @render_widget
+    @diagnostics.instrument()
+    def plot_daily_balance():
+        placeholder = pd.DataFrame({'date': [pd.Timestamp.today().normalize()], 'balance': [0.0]})
+        fig = go.FigureWidget(px.line(data_frame=placeholder, x='date', y='balance', line_shape='hv'))
+        fig.update_xaxes(title=None)
+        fig.update_yaxes(title='Balance')
+        fig.update_layout(showlegend=False)
         return fig
 
+    @reactive.effect
+    @diagnostics.instrument('plot_daily_balance_update', kind='effect')
+    def _():
+        fig = plot_daily_balance.widget
+        df = daily_balance()
+        account = input.select_daily_account_()
+        start, end = input.select_daily_range_()
+        label = f'{account.upper()} ({ledger.balances.currencies.get(account, "")})' if account else f'Total wealth ({hp.BASE_CURRENCY})'
+        title = f'Daily balance | {label} | {start:%d/%m/%Y} - {end:%d/%m/%Y}'
+
+        with fig.batch_update():
+            ## dates as text: the widget sends datetime64 arrays as integer nanoseconds
+            fig.data[0].x = df.date.dt.strftime('%Y-%m-%d').to_numpy()
+            fig.data[0].y = df.balance.to_numpy()
+            fig.layout.title.text = title
+
+    @render.ui
+    @diagnostics.instrument()
+    def select_forecast_account():
+        return ui.input_select(
+            'select_forecast_account_',
+            'Account:',
+            choices={'': 'Total wealth', **{account: account for account in accounts()}},
+            selected=''
+        )
+
+    @reactive.calc
+    @diagnostics.instrument(kind='calc')
+    def forecast_key():
+        ## everything the projection depends on, it is computed once per key
+        paths = input.forecast_paths()
+        req(paths)
+        paths = int(min(max(paths, 100), forecast.MAX_PATHS))
+        account = input.select_forecast_account_() or None
+        return ('forecast', data_version(), hp.RATES.version, account, int(input.forecast_years()), paths)
+
+    @reactive.extended_task
+    async def forecast_task(key, cells, closing, rates):
+        ## simulated in a worker thread: the other outputs (and sessions) are not held up meanwhile
+        _, _, _, account, years, paths = key
+        try:
+            return key, await asyncio.to_thread(forecast.project, cells, closing, rates, account, years, paths), None
+        except Exception as e:
+            return key, None, e
+
+    ## (key, percentile bands) of the projection on screen
+    projection = reactive.Value(None)
+
+    @reactive.effect
+    @diagnostics.instrument('forecast_start', kind='effect')
+    def _():
+        key = forecast_key()
+        if key in RESULTS:
+            projection.set((key, RESULTS.get(key, lambda: None)))
+            return
+        ## the worker gets copies, the ledger keeps changing meanwhile
+        with ledger.lock:
+            cells = ledger.cube.cells.copy()
+            closing = ledger.balances.closing()
+        rates = dict(zip(closing.index, hp.RATES.latest(closing.currency.to_numpy())))
+        forecast_task.invoke(key, cells, closing, rates)
+
+    @reactive.effect
+    @diagnostics.instrument('forecast_done', kind='effect')
+    def _():
+        key, bands, error = forecast_task.result()
+        if error is not None:
+            ui.notification_show(f'Oops, something went wrong with the projection: {error}', type='error')
+            return
+        RESULTS.get(key, lambda: bands)
+        ## a result for parameters changed meanwhile is kept for later, not shown
+        with reactive.isolate():
+            if key == forecast_key():
+                projection.set((key, bands))
+
+    ## traces of the projection: each lower band is filled up to the upper one before it (5-95 and
+    ## 25-75), the median on top
+    FORECAST_TRACES = [('p95', None), ('p5', 'tonexty'), ('p75', None), ('p25', 'tonexty'), ('p50', None)]
+
     @render_widget
-    def pcg_category_plot():
-        data = finance.get()
-        df = hp.calculate_monthly_category(data, input.select_year_2_())
-        df = df[df.month==int(input.select_month_())]
+    @diagnostics.instrument()
+    def plot_forecast():
+        dates = [pd.Timestamp.today().normalize()]
+        fig = go.FigureWidget()
+        for column, fill in FORECAST_TRACES:
+            fig.add_scatter(
+                x=dates, y=[0.0], name=column, mode='lines', fill=fill,
+                line={'width': 2 if column == 'p50' else 0, 'color': '#636efa'},
+                fillcolor='rgba(99, 110, 250, 0.2)' if column == 'p5' else 'rgba(99, 110, 250, 0.35)'
+            )
+        fig.update_xaxes(title=None)
+        fig.update_yaxes(title='Balance')
+        fig.update_layout(showlegend=False)
+        return fig
 
-        title = f'Percentage of total in/out by category | {MONTHS[int(input.select_month_())-1].capitalize()}, {input.select_year_2_()}'
+    @reactive.effect
+    @diagnostics.instrument('plot_forecast_update', kind='effect')
+    def _():
+        fig = plot_forecast.widget
+        req(projection() is not None)
+        (_, _, _, account, years, paths), bands = projection()
+        label = f'{account.upper()} ({ledger.balances.currencies.get(account, "")})' if account else f'Total wealth ({hp.BASE_CURRENCY})'
+        title = f'Projection | {label} | {years} years, {paths:,} paths, percentiles {forecast.PERCENTILES[0]}-{forecast.PERCENTILES[-1]}'
 
-        df['color'] = np.where(df.pcg_in_out < 0, 'red', 'green')
-        df = df[(df.pcg_in_out != 0)].sort_values(by='pcg_in_out', ascending=False)
-        fig = px.bar(
-            data_frame=df,
+        dates = bands.date.dt.strftime('%Y-%m-%d').to_numpy()
+        with fig.batch_update():
+            for trace, (column, _) in zip(fig.data, FORECAST_TRACES):
+                trace.x = dates
+                trace.y = bands[column].to_numpy()
+            fig.layout.title.text = title
+
+    @render_widget
+    @diagnostics.instrument()
+    def pcg_category_plot():
+        placeholder = pd.DataFrame({'category': [''], 'pcg_in': [0.0], 'pcg_out': [0.0]})
+        fig = go.FigureWidget(px.bar(
+            data_frame=placeholder,
             x=['pcg_in','pcg_out'],#'pcg_in_out',
             y='category',
             # barmode='stack',
             text_auto='.2%',
-        )
+        ))
 
-        fig.update_layout(xaxis_tickformat='.0%', title=title, xaxis_title='', yaxis_title='')
-        # fig.update_traces(marker_color=df.color)#df[(df.pcg_in_out != 0)].color)
+        fig.update_layout(xaxis_tickformat='.0%', xaxis_title='', yaxis_title='')
         fig.update_layout(showlegend=False)
 
         return fig
-    
+
+    @reactive.effect
+    @diagnostics.instrument('pcg_category_plot_update', kind='effect')
+    def _():
+        fig = pcg_category_plot.widget
+        df = category_months()
+        df = df[df.month==int(input.select_month_())]
+
+        title = f'Percentage of total in/out by category | {MONTHS[int(input.select_month_())-1].capitalize()}, {input.select_year_2_()}'
+
+        df = df[(df.pcg_in_out != 0)].sort_values(by='pcg_in_out', ascending=False)
+        categories = df.category.astype('object').to_numpy()
+        with fig.batch_update():
+            ## one trace per column of the wide bar chart
+            for trace, col in zip(fig.data, ['pcg_in', 'pcg_out']):
+                trace.x = df[col].to_numpy()
+                trace.y = categories
+            fig.layout.title.text = title
+
     @render.data_frame
+    @diagnostics.instrument()
     def category_table():
-        data = finance.get()
-        df = hp.calculate_monthly_category(data, input.select_year_2_())
+        df = category_months()
         df = df[df.month==int(input.select_month_())]
         df = df.drop(['year','month'], axis=1)
         df['pcg_in_out'] = round(df.pcg_in_out * 100,2)
@@ -274,31 +630,42 @@ def server(input, output, session):
         )
 
     @render.ui
+    @diagnostics.instrument()
     def table_year_filter():
-        data = finance.get()
-        data['date'] = pd.to_datetime(data.date, dayfirst=True, errors='raise', format='%d/%m/%Y')
-        years = [int(yr) for yr in data.date.dt.year.unique()]
-        years.append('All')
+        ## the latest year by default: 'All' loads (and keeps in memory) every year of a partitioned ledger.
+        ## re-rendered on every new version (loading a year is one), the year chosen is kept
+        choices = [str(year) for year in years()] + ['All']
+        with reactive.isolate():
+            year = input.table_year_filter_() if input.table_year_filter_.is_set() else None
         return ui.input_select(
             id='table_year_filter_',
             label='Filter by year:',
-            choices=years,#[int(yr) for yr in data.date.dt.year.unique()],
-            selected='All'#max(data.date.dt.year)
+            choices=choices,
+            selected=year if year in choices else choices[0]
         )
     
     @render.ui
+    @diagnostics.instrument()
     def table_account_filter():
-        data = finance.get()
-        accounts = [a for a in data.account.unique()]
-        accounts.append('All')
         return ui.input_select(
             id='table_account_filter_',
             label='Filter by account:',
-            choices=accounts,
+            choices=accounts() + ['All'],
             selected='All'#data.iloc[-1].account
         )
 
     @render.ui
+    @diagnostics.instrument()
+    def table_category_filter():
+        return ui.input_select(
+            id='table_category_filter_',
+            label='Filter by category:',
+            choices=RESULTS.get(('categories', data_version()), lambda: ledger.cube.category_names()) + ['All'],
+            selected='All'
+        )
+
+    @render.ui
+    @diagnostics.instrument()
     def add_btn():
         return ui.input_action_button(
             id='add_btn_',
@@ -309,16 +676,18 @@ def server(input, output, session):
     
     @reactive.effect
     @reactive.event(input.add_btn_)
+    @diagnostics.instrument('add_btn_', kind='effect')
     def _():
         # data = finance.get()
+        form = hp.add_transaction_inputs()
         add_form = ui.modal(
-            hp.ADD_TRANSACTION['date'],
-            hp.ADD_TRANSACTION['account'],
-            hp.ADD_TRANSACTION['category'],
-            hp.ADD_TRANSACTION['description'],
-            hp.ADD_TRANSACTION['currency'],
-            hp.ADD_TRANSACTION['in'],
-            hp.ADD_TRANSACTION['out'],
+            form['date'],
+            form['account'],
+            form['category'],
+            form['description'],
+            form['currency'],
+            form['in'],
+            form['out'],
             ui.div(
                 ui.input_action_button('add_submit', 'Submit', class_='btn btn-primary'),
                 class_='d-flex justify-content-end'
@@ -331,22 +700,179 @@ def server(input, output, session):
 
     @reactive.effect
     @reactive.event(input.add_submit)
+    @diagnostics.instrument('add_submit', kind='effect')
     def _():
-        data = finance.get()
         try:
-            new_row = pd.DataFrame([{k:input[f'add_{k}']() for k in hp.ADD_TRANSACTION.keys()}])
-            new_row = new_row.reindex(columns=data.columns)
+            new_row = pd.DataFrame([{k:input[f'add_{k}']() for k in hp.ADD_TRANSACTION_FIELDS}])
             new_row['date'] = pd.to_datetime(new_row.date, dayfirst=True, errors='raise', format='%d/%m/%Y')
-            updated_data = pd.concat([data, new_row], ignore_index=True)
-            updated_data = updated_data.sort_values(by='date', ascending=False)
-
-            finance.set(updated_data)
+            new_row = ledger.add(hp.auto_categorize(new_row), on_saved=saved)
             ui.notification_show(f'Added new transaction for account {new_row.iloc[0].account.upper()}, thank you!', type='message')
-            hp.save_data_to_file(updated_data)
         except Exception as e:
             ui.notification_show(f'Oops, something went wrong: {e}', type='error')
 
     @render.ui
+    @diagnostics.instrument()
+    def import_btn():
+        return ui.input_action_button(
+            id='import_btn_',
+            label='',
+            class_='btn btn-info',
+            icon=fa.icon_svg('file-import')
+        )
+
+    @reactive.effect
+    @reactive.event(input.import_btn_)
+    @diagnostics.instrument('import_btn_', kind='effect')
+    def _():
+        import_form = ui.modal(
+            ui.input_file('import_file', 'Bank statement (csv, ofx, qfx, qif):', accept=['.csv', '.ofx', '.qfx', '.qif']),
+            ui.input_select('import_account', 'Account:', choices=hp.ACCOUNTS),
+            ui.input_select('import_currency', 'Currency:', choices=hp.CURRENCIES),
+            ui.div(
+                ui.input_action_button('import_submit', 'Import', class_='btn btn-primary'),
+                class_='d-flex justify-content-end'
+            ),
+            title='Import bank statement',
+            easy_close=True,
+            footer=None
+        )
+        ui.modal_show(import_form)
+
+    @reactive.effect
+    @reactive.event(input.import_submit)
+    @diagnostics.instrument('import_submit', kind='effect')
+    def _():
+        files = input.import_file()
+        if not files:
+            ui.notification_show('Please choose a statement file to import', type='error')
+            return
+        try:
+            ## the whole statement is one batch: one cube/index update and one journal write
+            new_rows, read = ledger.import_statement(
+                files[0]['datapath'], input.import_account(), input.import_currency(), name=files[0]['name'], on_saved=saved
+            )
+            ui.modal_remove()
+            if new_rows is None:
+                ui.notification_show(f'Nothing to import, all {read} transactions are already in the ledger', type='warning')
+                return
+            ui.notification_show(f'Imported {len(new_rows)} transactions, skipped {read - len(new_rows)} duplicates', type='message')
+        except Exception as e:
+            ui.notification_show(f'Oops, something went wrong: {e}', type='error')
+
+    @render.ui
+    @diagnostics.instrument()
+    def rules_btn():
+        return ui.input_action_button(
+            id='rules_btn_',
+            label='',
+            class_='btn btn-secondary',
+            icon=fa.icon_svg('wand-magic-sparkles')
+        )
+
+    @reactive.effect
+    @reactive.event(input.rules_btn_)
+    @diagnostics.instrument('rules_btn_', kind='effect')
+    def _():
+        rules_form = ui.modal(
+            ui.markdown(
+                'One rule per object, the first rule that applies gives the category: `pattern` (regular expression, '
+                'searched in the description), `category`, and optionally `name`, `account`, `sign` (`in`/`out`), `min`/`max` (amount)'
+            ),
+            ui.input_text_area('rules_text', '', value=json.dumps(hp.RULES.rules, indent=2), rows=14, width='100%'),
+            ui.output_data_frame('rules_hits'),
+            ui.div(
+                ui.input_action_button('rules_submit', 'Save and re-categorize', class_='btn btn-primary'),
+                class_='d-flex justify-content-end'
+            ),
+            title='Categorization rules',
+            size='l',
+            easy_close=True,
+            footer=None
+        )
+        ui.modal_show(rules_form)
+
+    @render.data_frame
+    @diagnostics.instrument()
+    def rules_hits():
+        ## rows of the ledger every rule matches
+        return render.DataTable(
+            RESULTS.get(('rule_hits', data_version(), rules_version()), lambda: hp.rule_hits(finance.get())),
+            width='100%'
+        )
+
+    @reactive.effect
+    @reactive.event(input.rules_submit)
+    @diagnostics.instrument('rules_submit', kind='effect')
+    def _():
+        try:
+            new_rules = rules.RuleSet(json.loads(input.rules_text() or '[]'))
+        except Exception as e:
+            ui.notification_show(f'Invalid rules: {e}', type='error')
+            return
+        try:
+            ## the whole history (partitioned storage: every year) is categorized again in one batch,
+            ## by the new rules before they are saved: a rule set that fails here is not kept
+            ledger.load_years(years())
+            rows, _ = hp.recategorize(ledger.data, new_rules)
+        except Exception as e:
+            ui.notification_show(f'Invalid rules: {e}', type='error')
+            return
+        try:
+            rules.save(new_rules, hp.RULES_FILE)
+            hp.RULES = new_rules
+            rules_version.set(rules_version.get() + 1)
+            if len(rows):
+                ledger.edit(rows, on_saved=saved)
+            ui.notification_show(f'Rules saved, {len(rows)} transactions re-categorized', type='message')
+        except Exception as e:
+            ui.notification_show(f'Oops, something went wrong: {e}', type='error')
+
+    @render.ui
+    @diagnostics.instrument()
+    def reports_btn():
+        return ui.input_action_button(
+            id='reports_btn_',
+            label='',
+            class_='btn btn-secondary',
+            icon=fa.icon_svg('file-export')
+        )
+
+    @reactive.effect
+    @reactive.event(input.reports_btn_)
+    @diagnostics.instrument('reports_btn_', kind='effect')
+    def _():
+        global reporting
+        req(finance.get() is not None)
+        if reporting is not None and not reporting.done():
+            ui.notification_show('The reports are already being generated', type='warning')
+            return
+        import reports
+
+        ## the workers get a copy of the monthly aggregates, the ledger keeps changing meanwhile
+        with ledger.lock:
+            cells = ledger.cube.cells.copy()
+        progress = ui.Progress(min=0, max=1)
+        progress.set(0, message='Generating the reports')
+        loop = asyncio.get_running_loop()
+
+        def step(done, total):
+            ## called by the thread waiting on the process pool
+            loop.call_soon_threadsafe(lambda: progress.set(done / total, detail=f'{done} of {total}'))
+
+        async def run():
+            try:
+                done, failed = await asyncio.to_thread(reports.generate, cells, progress=step)
+                message = f'{len(done)} reports written to {reports.OUTPUT_DIR}' + (f', {len(failed)} failed (see the server log)' if failed else '')
+                ui.notification_show(message, type='warning' if failed else 'message', duration=None, session=session)
+            except Exception as e:
+                ui.notification_show(f'Oops, something went wrong while generating the reports: {e}', type='error', session=session)
+            finally:
+                progress.close()
+
+        reporting = asyncio.ensure_future(run())
+
+    @render.ui
+    @diagnostics.instrument()
     def delete_btn():
         return ui.input_action_button(
             id='delete_btn_',
@@ -357,6 +883,7 @@ def server(input, output, session):
     
     @reactive.effect
     @reactive.event(input.delete_btn_)
+    @diagnostics.instrument('delete_btn_', kind='effect')
     def _():
         ## get the index of the selected row(s)
         selected_rows = data_grid.cell_selection()['rows']
@@ -364,16 +891,11 @@ def server(input, output, session):
             ui.notification_show('Please select one or more rows to be deleted', type='error')
             return
         
-        ## Get the filtered dataframe view
-        filtered_df = data_grid.data_view()
-
-        ## Map the selected row indices from the filtered view to the original dataframe indices
-        selected_original_indices = filtered_df.iloc[[int(r) for r in selected_rows]].index.tolist()
+        ## Map the selected rows of the page to the original dataframe indices
+        selected_original_indices = data_grid.data_view(selected=True).index.tolist()
 
-        ## Get the original dataframe and remove the selected rows using their original indices
-        updated_data = finance.get().drop(selected_original_indices)
-        finance.set(updated_data)
-        hp.save_data_to_file(updated_data)
+        ## remove the selected rows from the shared ledger using their original indices
+        ledger.delete(selected_original_indices, on_saved=saved)
         ui.notification_show(f'Removing the following row(s): {[id for id in selected_original_indices]}', type='message')
         
         # ## get the index of the selected row(s)
@@ -391,7 +913,13 @@ def server(input, output, session):
         # else:
         #     ui.notification_show(f'Please select one or more rows to be deleted', type='error')
 
+    ## row being edited in the modal, as it was when the modal opened
+    editing = reactive.Value(None)
+    ## ids of the rows of the bulk edit modal
+    bulk_ids = reactive.Value(None)
+
     @render.ui
+    @diagnostics.instrument()
     def edit_btn():
         return ui.input_action_button(
             id='edit_btn_',
@@ -402,20 +930,41 @@ def server(input, output, session):
 
     @reactive.effect
     @reactive.event(input.edit_btn_)
+    @diagnostics.instrument('edit_btn_', kind='effect')
     def _():
         selected_rows = data_grid.cell_selection()['rows']
-        if len(selected_rows) != 1:
-            ui.notification_show('Please select at least one and only one row for editing', type='error')
+        if not selected_rows:
+            ui.notification_show('Please select one or more rows for editing', type='error')
             return
-        
+
+        if len(selected_rows) > 1:
+            ## several rows: only the fields that are filled in are changed, on all of them at once
+            bulk_ids.set(data_grid.data_view(selected=True).index)
+            form = hp.bulk_edit_inputs()
+            ui.modal_show(ui.modal(
+                ui.markdown(f'Editing **{len(selected_rows)}** transactions, empty fields keep each row\'s value'),
+                form['date'],
+                form['date_value'],
+                *[form[field] for field in hp.BULK_EDIT_FIELDS],
+                ui.div(
+                    ui.input_action_button('bulk_submit', 'Submit', class_='btn btn-primary'),
+                    class_='d-flex justify-content-end'
+                ),
+                title='Edit transactions',
+                easy_close=True,
+                footer=None
+            ))
+            return
+
+        form = hp.add_transaction_inputs()
         edit_form = ui.modal(
-            hp.ADD_TRANSACTION['date'],
-            hp.ADD_TRANSACTION['account'],
-            hp.ADD_TRANSACTION['category'],
-            hp.ADD_TRANSACTION['description'],
-            hp.ADD_TRANSACTION['currency'],
-            hp.ADD_TRANSACTION['in'],
-            hp.ADD_TRANSACTION['out'],
+            form['date'],
+            form['account'],
+            form['category'],
+            form['description'],
+            form['currency'],
+            form['in'],
+            form['out'],
             ui.div(
                 ui.input_action_button('edit_submit', 'Submit', class_='btn btn-primary'),
                 class_='d-flex justify-content-end'
@@ -430,26 +979,27 @@ def server(input, output, session):
         # original_df = data_grid.data()
         # row_to_edit = original_df[original_df.index.isin(id_in_selected_row)]
         
-        ## Get the filtered dataframe view and map to original index
-        filtered_df = data_grid.data_view()
-        original_index = filtered_df.iloc[int(selected_rows[0])].name
+        ## Map the selected row of the page to the original index
+        original_index = data_grid.data_view(selected=True).index[0]
 
         ## Get the original row data using the mapped index
         original_df = finance.get()
         row_to_edit = original_df.loc[[original_index]]
+        editing.set(row_to_edit)
 
         ui.update_date('add_date', value=row_to_edit.date.iloc[0])
         ui.update_select('add_account', selected=row_to_edit.account.iloc[0])
         ui.update_select('add_category', selected=row_to_edit.category.iloc[0])
         ui.update_text('add_description', value=row_to_edit.description.iloc[0])
         ui.update_radio_buttons('add_currency', selected=row_to_edit.currency.iloc[0])
-        ui.update_numeric('add_in', value=row_to_edit['in'].iloc[0])
-        ui.update_numeric('add_out', value=row_to_edit['out'].iloc[0])
+        ui.update_numeric('add_in', value=row_to_edit['in'].iloc[0] / 100)
+        ui.update_numeric('add_out', value=row_to_edit['out'].iloc[0] / 100)
 
         ui.modal_show(edit_form)
 
     @reactive.effect
     @reactive.event(input.edit_submit)
+    @diagnostics.instrument('edit_submit', kind='effect')
     def _():
         ui.modal_remove()
         # selected_row = data_grid.cell_selection()['rows']
@@ -458,54 +1008,193 @@ def server(input, output, session):
         # original_df = data_grid.data()
         # row_to_edit = original_df[original_df.index.isin(id_in_selected_row)]
 
-        selected_rows = data_grid.cell_selection()['rows']
-        filtered_df = data_grid.data_view()
-        original_index = filtered_df.iloc[int(selected_rows[0])].name
+        ## the row of the modal, not the one selected now: the grid may have changed meanwhile
+        row_to_edit = editing.get()
+        editing.set(None)
+        if row_to_edit is None:
+            return
+        if not hp.unchanged(ledger.data, row_to_edit):
+            ui.notification_show('This transaction has been changed or deleted meanwhile, nothing was updated', type='error')
+            return
+        original_index = row_to_edit.index[0]
 
         ## Update specific row using original index
-        updated_row = pd.DataFrame([{k:input[f'add_{k}']() for k in hp.ADD_TRANSACTION.keys()}])
-        original_df = finance.get()
-        updated_row = updated_row.reindex(columns=original_df.columns)
-        updated_row.index = [original_index]
+        updated_row = pd.DataFrame([{k:input[f'add_{k}']() for k in hp.ADD_TRANSACTION_FIELDS}])
 
         try:
-            # updated_row = pd.DataFrame([{k:input[f'add_{k}']() for k in hp.ADD_TRANSACTION.keys()}])
+            # updated_row = pd.DataFrame([{k:input[f'add_{k}']() for k in hp.ADD_TRANSACTION_FIELDS}])
             # updated_row = updated_row.reindex(columns=original_df.columns)
             # updated_row.set_index(row_to_edit.index, inplace=True)
-            original_df.update(updated_row)
-            tmp = original_df.copy()
-            tmp['year'] = original_df.date.dt.year
-            tmp['month'] = original_df.date.dt.month
-            finance.set(tmp)
+            updated_row['date'] = pd.to_datetime(updated_row.date)
+            updated_row.index = [original_index]
+            ledger.edit(hp.auto_categorize(updated_row), on_saved=saved)
 
-            hp.save_data_to_file(original_df)
             # ui.notification_show(f'Updated entry for {row_to_edit.iloc[0].account.upper()}, thank you!', type='message')
             ui.notification_show(f'Updated entry, thank you!', type='message')   
         except Exception as e:
             ui.notification_show(f'Oops, something went wrong. Retry!\n{e}', type='error')
 
+    @reactive.effect
+    @reactive.event(input.bulk_submit)
+    @diagnostics.instrument('bulk_submit', kind='effect')
+    def _():
+        ui.modal_remove()
+        ## the rows of the modal, not the ones selected now: the grid may have changed meanwhile,
+        ## the rows deleted since it opened are left out
+        ids = bulk_ids.get()
+        bulk_ids.set(None)
+        if ids is None:
+            return
+        ids = ids[ids.isin(ledger.data.index)]
+        if not len(ids):
+            ui.notification_show('These transactions have been deleted meanwhile, nothing was updated', type='error')
+            return
+        values = {field: input[f'bulk_{field}']() for field in hp.BULK_EDIT_FIELDS}
+        values['date'] = input.bulk_date() if input.bulk_set_date() else None
+
+        try:
+            ## one batch: one version, one cube/index update and one write for all the rows
+            rows = hp.bulk_edit_rows(ledger.data, ids, values)
+            ledger.edit(rows, on_saved=saved)
+            ui.notification_show(f'Updated {len(rows)} entries, thank you!', type='message')
+        except Exception as e:
+            ui.notification_show(f'Oops, something went wrong. Retry!\n{e}', type='error')
+
+    @reactive.effect(priority=1)
+    @diagnostics.instrument('table_load_years', kind='effect')
+    def _():
+        ## partitioned storage: the rows of the years shown are loaded before the table is computed,
+        ## a new version then refreshes it (nothing to do when the whole ledger is in memory)
+        year = input.table_year_filter_()
+        with reactive.isolate():
+            ## the filter is only shown once the ledger is loaded, a value sent before is ignored
+            data_version()
+            ledger.load_years(years() if year == 'All' else [year])
+
+    @reactive.calc
+    @diagnostics.instrument(kind='calc')
+    def search_ids():
+        ## sorted ids of the rows whose description matches, from the store's inverted index
+        ## (None when the search box is empty)
+        query = input.table_search().strip().lower()
+        return RESULTS.get(('search', data_version(), query), lambda: ledger.search.ids(query))
+
+    @reactive.calc
+    @diagnostics.instrument(kind='calc')
+    def table_view():
+        ## filtered and sorted row positions, shared by all the pages of the same view
+        account = input.table_account_filter_()
+        year = input.table_year_filter_()
+        category = input.table_category_filter_()
+        amount = (input.table_amount_min(), input.table_amount_max())
+        sort = input.table_sort()
+        ascending = not input.table_desc()
+        ids = search_ids()
+        return RESULTS.get(
+            ('table_view', data_version(), account, year, category, amount, input.table_search(), sort, ascending),
+            lambda: hp.table_positions(finance.get(), ledger.index, account, year, sort, ascending, category, amount, ids)
+        )
+
+    table_page = reactive.Value(0)
+
+    @reactive.effect
+    @reactive.event(
+        input.table_account_filter_, input.table_year_filter_, input.table_category_filter_, input.table_amount_min,
+        input.table_amount_max, input.table_search, input.table_sort, input.table_desc, input.table_page_size
+    )
+    @diagnostics.instrument('table_page_reset', kind='effect')
+    def _():
+        table_page.set(0)
+
+    @reactive.calc
+    @diagnostics.instrument(kind='calc')
+    def table_pages():
+        return max(1, -(-len(table_view()) // int(input.table_page_size())))
+
+    @reactive.effect
+    @reactive.event(input.table_prev)
+    @diagnostics.instrument('table_prev', kind='effect')
+    def _():
+        table_page.set(max(0, table_page.get() - 1))
+
+    @reactive.effect
+    @reactive.event(input.table_next)
+    @diagnostics.instrument('table_next', kind='effect')
+    def _():
+        table_page.set(min(table_pages() - 1, table_page.get() + 1))
+
+    @render.ui
+    @diagnostics.instrument()
+    def table_pager():
+        page = min(table_page.get(), table_pages() - 1)
+        size = int(input.table_page_size())
+        rows = len(table_view())
+        return ui.div(
+            ui.input_action_button('table_prev', '', icon=fa.icon_svg('chevron-left'), class_='btn btn-light'),
+            ui.span(f'{min(rows, page * size + 1):,}-{min(rows, (page + 1) * size):,} of {rows:,}', class_='mx-2'),
+            ui.input_action_button('table_next', '', icon=fa.icon_svg('chevron-right'), class_='btn btn-light'),
+            class_='d-flex align-items-center h-100'
+        )
+
     @render.data_frame
+    @diagnostics.instrument()
     def data_grid():
-        df = finance.get()
-        data = df.copy()
-        data = data.drop(['month','year'], axis=1)
-        # ## filter by account
-        # data = data if input.table_account_filter_()=='All' else data[data.account == input.table_account_filter_()]
-        # ## filter by year
-        # data = data if input.table_year_filter_()=='All' else data[data.date.dt.year == int(input.table_year_filter_())]
-
-        ## Apply filters while preserving original indices
-        if input.table_account_filter_() != 'All':
-            data = data[data.account == input.table_account_filter_()]
-        if input.table_year_filter_() != 'All':
-            data = data[data.date.dt.year == int(input.table_year_filter_())]
-        
-        data['date'] = pd.to_datetime(data.date, dayfirst=True, errors='raise', format='%d/%m/%Y')#data.date.dt.strftime('%d/%m/%Y')
+        ## only the rows of the current page are serialized, the index keeps the original row ids
+        page = min(table_page.get(), table_pages() - 1)
+        size = int(input.table_page_size())
+        positions = table_view()[page * size:(page + 1) * size]
+        data = hp.to_file(finance.get().iloc[positions][hp.TABLE_COLUMNS])
+
         return render.DataGrid(
-            data,#.sort_values(by='date', ascending=False),
+            data,
             width='fit-content',
             selection_mode='rows'
         )
 
 
-app = App(app_ui, server)
\ No newline at end of file
+    if diagnostics.ENABLED:
+
+        @render.data_frame
+        def diagnostics_table():
+            ## refreshed every few seconds, stats are collected from all the sessions
+            reactive.invalidate_later(3)
+            data = diagnostics.summary()
+            data['histogram'] = data.get('histogram', pd.Series(dtype='object')).astype(str)
+            return render.DataGrid(data.round(2), width='100%')
+
+        known = []
+
+        @reactive.effect
+        def _():
+            ## new outputs/effects show up as they run for the first time
+            reactive.invalidate_later(3)
+            names = sorted(diagnostics.STATS)
+            if names != known:
+                known[:] = names
+                ui.update_select('diagnostics_name', choices=names)
+
+        @reactive.effect
+        @reactive.event(input.diagnostics_profile)
+        def _():
+            diagnostics.profile_next(input.diagnostics_name())
+            ui.notification_show(f'The next run of {input.diagnostics_name()} will be profiled', type='message')
+
+        @render.text
+        def diagnostics_profiles():
+            reactive.invalidate_later(3)
+            return '\n\n'.join(f'== {name} ==\n{profile}' for name, profile in diagnostics.PROFILES.items())
+
+        @render.download(filename='diagnostics.json')
+        def diagnostics_dump():
+            yield diagnostics.dump()
+
+
+app = App(app_ui, server)
+
+@app.on_shutdown
+def _():
+    ## write the changes still waiting in the store and let a running compaction finish
+    if ledger is not None:
+        import helpers as hp
+        ledger.close()
+        hp.JOURNAL.wait()
\ No newline at end of file
@@ -0,0 +1,131 @@
+import numpy as np
+import pandas as pd
+
+
+DAY = np.timedelta64(1, 'D')
+
+
+def _daily(data):
+    ## net cents and row count of every (account, day), days sorted, and the currency of every account
+    ## data are ledger rows, or day totals that carry their row count
+    if data is None or not len(data):
+        return {}
+    frame = pd.DataFrame({
+        'account': data.account.astype('object').to_numpy(),
+        'currency': data.currency.astype('object').to_numpy(),
+        'day': data.date.to_numpy(dtype='datetime64[D]'),
+        'net': (data['in'] - data['out']).to_numpy(dtype='int64'),
+        'rows': data['rows'].to_numpy(dtype='int64') if 'rows' in data else 1,
+    })
+    daily = {}
+    for account, group in frame.groupby('account', sort=False):
+        sums = group.groupby('day')[['net', 'rows']].sum()
+        daily[account] = (sums.index.to_numpy(dtype='datetime64[D]'), sums.net.to_numpy(), sums.rows.to_numpy(), group.currency.iloc[-1])
+    return daily
+
+
+class BalanceIndex:
+    ## running balance of every account after each day with transactions (prefix sums in cents)
+    ## the balance on any date and the net flow between two dates are binary searches
+    ## rate(currencies, dates) converts to the base currency for the total wealth
+
+    def __init__(self, data, rate):
+        self.rate = rate
+        self.rebuild(data)
+
+    def rebuild(self, data):
+        ## rows: transactions of every day, a day (or an account) without any left is dropped
+        self.days, self.cum, self.currencies, self.rows = {}, {}, {}, {}
+        for account, (days, net, rows, currency) in _daily(data).items():
+            self.days[account] = days
+            self.cum[account] = np.cumsum(net)
+            self.currencies[account] = currency
+            self.rows[account] = rows
+
+    def apply(self, added=None, removed=None):
+        ## only the touched accounts change: new days are inserted, the deltas are added to the
+        ## running balance from their day on
+        deltas = {}
+        for sign, data in ((1, added), (-1, removed)):
+            for account, (days, net, rows, currency) in _daily(data).items():
+                deltas.setdefault(account, []).append((days, sign * net, sign * rows))
+                if sign > 0:
+                    self.currencies[account] = currency
+
+        for account, parts in deltas.items():
+            delta_days = np.concatenate([days for days, _, _ in parts])
+            delta_net = np.concatenate([net for _, net, _ in parts])
+            delta_rows = np.concatenate([rows for _, _, rows in parts])
+            days = self.days.get(account, np.array([], dtype='datetime64[D]'))
+            cum = self.cum.get(account, np.array([], dtype='int64'))
+            rows = self.rows.get(account, np.array([], dtype='int64'))
+
+            new_days = np.setdiff1d(delta_days, days)
+            if len(new_days):
+                pos = np.searchsorted(days, new_days)
+                before = np.where(pos > 0, cum[np.clip(pos - 1, 0, None)] if len(cum) else 0, 0)
+                days = np.insert(days, pos, new_days)
+                cum = np.insert(cum, pos, before)
+                rows = np.insert(rows, pos, 0)
+
+            at = np.searchsorted(days, delta_days)
+            steps = np.zeros(len(days) + 1, dtype='int64')
+            np.add.at(steps, at, delta_net)
+            cum = cum + np.cumsum(steps)[:-1]
+            rows = rows.copy()
+            np.add.at(rows, at, delta_rows)
+
+            ## a day left without transactions has the balance of the day before, it is dropped
+            keep = rows > 0
+            if not keep.any():
+                for attr in (self.days, self.cum, self.currencies, self.rows):
+                    attr.pop(account, None)
+            else:
+                self.days[account], self.cum[account], self.rows[account] = days[keep], cum[keep], rows[keep]
+
+    def accounts(self):
+        ## most recently active first, by name on the same day (whatever order they were added in)
+        return sorted(sorted(self.days), key=lambda account: self.days[account][-1], reverse=True)
+
+    def first_day(self):
+        return min((days[0] for days in self.days.values()), default=None)
+
+    def balance(self, account, dates):
+        ## balance (currency units) of the account at the end of each date
+        dates = np.asarray(dates, dtype='datetime64[D]')
+        days = self.days.get(account)
+        if days is None:
+            return np.zeros(len(dates))
+        pos = np.searchsorted(days, dates, side='right') - 1
+        return np.where(pos >= 0, self.cum[account][np.clip(pos, 0, None)], 0) / 100
+
+    def net_flow(self, account, start, end):
+        ## in - out of the account from start to end, both included
+        start, end = np.datetime64(start, 'D'), np.datetime64(end, 'D')
+        return float(self.balance(account, [end])[0] - self.balance(account, [start - DAY])[0])
+
+    def total(self, dates):
+        ## wealth in the base currency at the end of each date, at that date's rates
+        dates = np.asarray(dates, dtype='datetime64[D]')
+        total = np.zeros(len(dates))
+        for account, currency in self.currencies.items():
+            rate = self.rate(np.full(len(dates), currency, dtype=object), dates.astype('datetime64[ns]'))
+            total += np.nan_to_num(self.balance(account, dates) * rate)
+        return total
+
+    def daily(self, account, start, end):
+        ## one row per day of the range, account None is the total wealth
+        dates = np.arange(np.datetime64(start, 'D'), np.datetime64(end, 'D') + DAY, DAY)
+        values = self.total(dates) if account is None else self.balance(account, dates)
+        return pd.DataFrame({'date': dates.astype('datetime64[ns]'), 'balance': values})
+
+    def closing(self):
+        ## latest balance of every account, indexed by account (like helpers.account_balances)
+        accounts = self.accounts()
+        return pd.DataFrame(
+            {
+                'currency': [self.currencies[account] for account in accounts],
+                'balance': [self.cum[account][-1] / 100 for account in accounts],
+            },
+            index=accounts
+        )
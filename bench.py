@@ -0,0 +1,353 @@
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import balances
+import cube
+import forecast
+import helpers as hp
+import indexes
+import search
+import storage
+
+
+## also time the pre-optimization implementations kept below (slow on large ledgers)
+RUN_LEGACY = True
+
+def ledger_currencies(accounts, currencies=None):
+    ## account -> currency: a dict as given, a list assigned to the accounts in turn, or by default
+    ## the currency code the account name ends with (revolut_GBP), the base currency otherwise
+    if isinstance(currencies, dict):
+        return currencies
+    if currencies:
+        return {account: currencies[i % len(currencies)] for i, account in enumerate(accounts)}
+    return {
+        account: account.rsplit('_', 1)[-1] if account.rsplit('_', 1)[-1] in hp.CURRENCIES else hp.BASE_CURRENCY
+        for account in accounts
+    }
+
+def make_ledger(n, seed=0, accounts=None, currencies=None, income=None, expenses=None, start='2015-01-01', years=10):
+    ## random transactions in the data.csv schema, dates written the way the app writes them
+    ## same n and seed (and configuration) always give the same ledger; accounts and categories
+    ## default to the app's
+    accounts = accounts or hp.ACCOUNTS
+    income_categories = income or hp.CATEGORY_INCOME
+    expense_categories = expenses or hp.CATEGORY_EXPENSES
+    rng = np.random.default_rng(seed)
+    dates = pd.Timestamp(start) + pd.to_timedelta(rng.integers(0, years * 365, n), unit='D')
+    account = np.array(accounts)[rng.integers(0, len(accounts), n)]
+    is_income = rng.random(n) < 0.2
+    categories = np.where(
+        is_income,
+        np.array(income_categories)[rng.integers(0, len(income_categories), n)],
+        np.array(expense_categories)[rng.integers(0, len(expense_categories), n)],
+    )
+    amounts = np.round(rng.lognormal(3, 1.2, n), 2)
+    ## half of the dates typed in by hand (dd/mm/yyyy), half saved back by pandas (yyyy-mm-dd)
+    date_str = np.where(rng.random(n) < 0.5, dates.strftime('%d/%m/%Y'), dates.strftime('%Y-%m-%d'))
+    return pd.DataFrame({
+        'date': date_str,
+        'account': account,
+        'category': categories,
+        'description': np.char.add('transaction ', rng.integers(0, 5000, n).astype(str)),
+        'currency': pd.Series(account).map(ledger_currencies(accounts, currencies)).to_numpy(),
+        'in': np.where(is_income, amounts, 0.0),
+        'out': np.where(is_income, 0.0, amounts),
+    })
+
+def load_ledger(n):
+    ## what import_data returns for a synthetic ledger of n rows
+    data = make_ledger(n)
+    data['date'] = storage.parse_dates(data.date)
+    data = hp.to_ledger(data)
+    return data.sort_values(by='date', ascending=False)
+
+def legacy_monthly_category(data, year):
+    ## calculate_monthly_category before the vectorized conversion, row by row apply run twice
+    def exchange_in_out(df):
+        if df.currency == 'GBP':
+            rate = 1.19
+        else:
+            rate = 1
+
+        df['in'] = df['in'] * rate
+        df['out'] = df['out'] * rate
+
+        return df
+
+    cat_df = data[(data.apply(exchange_in_out, axis=1).year==int(year)) & (data.apply(exchange_in_out, axis=1).account != 'generali_SAV')].groupby(['year','month','category']).agg({'in':'sum', 'out':'sum'}).reset_index()
+    return hp.category_shares(cat_df)
+
+def timed(fn, repeat=3, setup=None):
+    ## best of repeat runs; setup() returns the arguments of fn and is not timed
+    ## (e.g. a fresh copy of the ledger, so the per-frame caches are not hit)
+    best = float('inf')
+    for _ in range(repeat):
+        args = setup() if setup else ()
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+## name -> rows -> {'seconds', 'peak_mb'} of the runs that are measured, for --save/--compare
+RESULTS = {}
+
+def measure(name, n, fn, repeat=3, setup=None):
+    ## best time of repeat runs, then one more run under tracemalloc for the peak memory
+    ## (numpy and pandas allocations are traced too)
+    seconds = timed(fn, repeat, setup)
+    args = setup() if setup else ()
+    tracemalloc.start()
+    fn(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    RESULTS.setdefault(name, {})[str(n)] = {'seconds': seconds, 'peak_mb': peak / 2**20}
+    print(f'{name:<40} {n:>9,} rows | {seconds * 1000:10.2f}ms | peak {peak / 2**20:8.1f}MB')
+
+def use_data_file(path, mode='journal'):
+    hp.DATA_FILE = path
+    hp.JOURNAL = storage.Journal(path)
+    hp.STORAGE_MODE = mode
+    hp.DATABASE_FILE = path.with_suffix('.db')
+    hp._database = None
+    hp.PARTITIONS_DIR = path.parent / 'ledger'
+    hp._partitions = None
+
+def bench_startup(n):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / 'data.csv'
+        make_ledger(n).to_csv(path, index=False)
+        use_data_file(path)
+
+        def cold():
+            storage.cache_path(path).unlink(missing_ok=True)
+            hp.import_data()
+
+        cold_time = timed(cold)
+        warm_time = timed(hp.import_data)
+        print(f'import_data {n:>9,} rows | cold {cold_time:8.3f}s | warm {warm_time:8.3f}s | x{cold_time / warm_time:.1f}')
+
+def bench_monthly_category(n):
+    data = load_ledger(n)
+    year = int(data.year.max())
+
+    new_time = timed(lambda: hp.calculate_monthly_category(data, year))
+    line = f'calculate_monthly_category {n:>9,} rows | vectorized {new_time:8.3f}s'
+    if RUN_LEGACY:
+        legacy_time = timed(lambda: legacy_monthly_category(data, year), repeat=1)
+        line += f' | row apply {legacy_time:8.3f}s | x{legacy_time / new_time:.0f}'
+    print(line)
+
+def bench_memory(n):
+    ## the ledger as import_data used to keep it (object strings, float amounts, int32 year/month)
+    ## against the compact one
+    data = make_ledger(n)
+    data['date'] = storage.parse_dates(data.date)
+    plain = data.assign(year=data.date.dt.year, month=data.date.dt.month)
+    compact = hp.to_ledger(data)
+
+    plain_size = plain.memory_usage(deep=True).sum()
+    compact_size = compact.memory_usage(deep=True).sum()
+    print(
+        f'ledger memory {n:>9,} rows | plain {plain_size / n:6.1f} B/row | compact {compact_size / n:6.1f} B/row'
+        f' | x{plain_size / compact_size:.1f}'
+    )
+
+def bench_import(n):
+    ## statement of n rows of one account, part of them already in the ledger: read + dedup + merge + journal append
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / 'data.csv'
+        make_ledger(n, seed=1).to_csv(path, index=False)
+        use_data_file(path)
+        data = hp.import_data()
+
+        ## a statement is one account's: its rows in the ledger, then as many new ones
+        account = hp.ACCOUNTS[0]
+        ledger = make_ledger(n, seed=1)
+        ledger = ledger[ledger.account == account]
+        statement = pd.concat([ledger.head(n // 2), make_ledger(n - min(n // 2, len(ledger)), seed=2, accounts=[account])])
+        statement = statement.assign(date=storage.parse_dates(statement.date).dt.strftime('%Y-%m-%d'))
+        statement.to_csv(Path(tmp) / 'statement.csv', index=False)
+
+        def run():
+            updated, new, read = hp.import_statement(data, Path(tmp) / 'statement.csv', account=account)
+            hp.JOURNAL.append(added=hp.to_file(new))
+
+        import_time = timed(run, repeat=1)
+        print(f'import statement {n:>9,} rows | {import_time:8.3f}s | {n / import_time:,.0f} rows/s')
+
+def bench_backends(n):
+    ## journal (csv snapshot + journal, aggregates in pandas) against sqlite (row level writes,
+    ## aggregates in SQL) and partitioned (latest year + day totals of all the years, one year
+    ## rewritten per edit): startup with the monthly cube, one saved edit, monthly balance and categories
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / 'data.csv'
+        make_ledger(n).to_csv(path, index=False)
+        for mode in ['journal', 'sqlite', 'partitioned']:
+            use_data_file(path, mode)
+            start = time.perf_counter()
+            hp.import_data()
+            migrate_time = time.perf_counter() - start
+
+            def startup():
+                data = hp.import_data()
+                totals = hp.daily_totals()
+                return data, cube.MonthlyCube(data if totals is None else totals, convert=hp.eur_amounts)
+
+            startup_time = timed(startup)
+            data, monthly = startup()
+            year = int(data.year.max())
+            row = data.iloc[[0]].assign(out=data.out.iloc[0] + 1)
+            save_time = timed(lambda: hp.save_changes(data, edited=row))
+            if mode == 'sqlite':
+                balance_time = timed(lambda: hp.sqlite_account_months(hp.ACCOUNTS[0]))
+                category_time = timed(lambda: hp.sqlite_monthly_category(year))
+            elif mode == 'partitioned':
+                balance_time = timed(lambda: monthly.account_months(hp.ACCOUNTS[0]))
+                category_time = timed(lambda: hp.monthly_category(monthly, year))
+            else:
+                balance_time = timed(lambda: cube.MonthlyCube(data, convert=hp.eur_amounts).account_months(hp.ACCOUNTS[0]))
+                category_time = timed(lambda: hp.calculate_monthly_category(data, year))
+            print(
+                f'{mode:>11} {n:>9,} rows | first load {migrate_time:8.3f}s | startup {startup_time:8.3f}s | save edit {save_time * 1000:8.2f}ms'
+                f' | monthly balance {balance_time * 1000:8.2f}ms | categories {category_time * 1000:8.2f}ms'
+            )
+
+def bench_suite(n):
+    ## the helpers and the data pipeline behind every output of app.server, run headless
+    ## on a synthetic ledger (no Shiny session, no per-version result cache)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / 'data.csv'
+        make_ledger(n).to_csv(path, index=False)
+        use_data_file(path)
+        hp.import_data()
+
+        measure('import_data', n, hp.import_data)
+        data = hp.import_data()
+        fresh = lambda: (data.copy(),)
+        year = int(data.year.max())
+        account = hp.ACCOUNTS[0]
+        measure('save_data_to_file', n, hp.save_data_to_file, repeat=1, setup=fresh)
+        measure('calculate_account_balance', n, hp.calculate_account_balance, setup=fresh)
+        measure('calculate_total_wealth', n, hp.calculate_total_wealth, setup=fresh)
+        measure('calculate_monthly_category', n, lambda d: hp.calculate_monthly_category(d, year), setup=fresh)
+
+        ## what the outputs compute when the ledger changes (new version, nothing cached)
+        monthly = cube.MonthlyCube(data, convert=hp.eur_amounts)
+        ledger_index = indexes.LedgerIndex(data)
+        measure('server: monthly cube build', n, lambda d: cube.MonthlyCube(d, convert=hp.eur_amounts), setup=fresh)
+        measure('server: ledger index build', n, indexes.LedgerIndex, setup=fresh)
+        running = balances.BalanceIndex(data, hp.RATES.rate)
+        measure('server: balance index build', n, lambda d: balances.BalanceIndex(d, hp.RATES.rate), setup=fresh)
+        measure('server: summary_boxes', n, lambda: hp.index_balances(running))
+        measure('server: select_* choices', n, lambda: (monthly.accounts(), monthly.years(), monthly.years(account), monthly.months(year)))
+
+        def account_plots():
+            months = monthly.account_months(account)
+            months = months[months.year == year]
+            return months.assign(color=np.where(months.in_out <= 0, 'red', 'green'))
+
+        def category_outputs():
+            df = hp.monthly_category(monthly, year)
+            return df[df.month == df.month.max()].sort_values(by='pcg_in_out', ascending=False)
+
+        def data_grid():
+            positions = hp.table_positions(data, ledger_index, account, str(year), 'date', False)
+            return hp.to_file(data.iloc[positions[:100]][hp.TABLE_COLUMNS])
+
+        measure('server: plot_monthly_balance/in_out', n, account_plots)
+        measure('server: pcg_category_plot/category_table', n, category_outputs)
+        measure('server: data_grid (one page)', n, data_grid)
+
+        ## the search box: the index is built once per load, each query is lookups and intersections
+        descriptions = search.DescriptionIndex(data)
+        measure('server: description index build', n, search.DescriptionIndex, setup=fresh)
+        measure('server: description search', n, lambda: hp.table_positions(data, ledger_index, ids=descriptions.ids('transaction 12')))
+
+        ## the projection panel: 10k paths over 10 years, of one account and of the total wealth
+        closing = running.closing()
+        rates = dict(zip(closing.index, hp.RATES.latest(closing.currency.to_numpy())))
+        measure('server: projection (account)', n, lambda: forecast.project(monthly.cells, closing, rates, account, 10, 10_000))
+        measure('server: projection (total wealth)', n, lambda: forecast.project(monthly.cells, closing, rates, None, 10, 10_000))
+
+def compare(baseline, threshold):
+    ## ratio of every measure to the saved baseline, returns the regressions (slower than threshold x)
+    regressions = []
+    for name, runs in RESULTS.items():
+        for n, result in runs.items():
+            base = baseline.get(name, {}).get(n)
+            if base is None:
+                continue
+            ratio = result['seconds'] / base['seconds'] if base['seconds'] else float('inf')
+            flag = ' REGRESSION' if ratio > threshold else ''
+            print(f'{name:<40} {int(n):>9,} rows | x{ratio:5.2f} time | x{result["peak_mb"] / max(base["peak_mb"], 1e-9):5.2f} memory{flag}')
+            if flag:
+                regressions.append((name, n))
+    return regressions
+
+def bench_cold_start(n):
+    ## a fresh interpreter importing app.py: when it can serve, when the ledger is loaded, and the
+    ## breakdown of the startup worker (heavy modules, then the ledger)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / 'data.csv'
+        make_ledger(n).to_csv(path, index=False)
+        script = (
+            'import time; start = time.perf_counter()\n'
+            'import app; ready = time.perf_counter() - start\n'
+            'app.LOADING.result(); loaded = time.perf_counter() - start\n'
+            'import startup; print(f"ready to serve {ready * 1000:8.1f}ms | ledger loaded {loaded * 1000:8.1f}ms")\n'
+            'print(startup.report())\n'
+        )
+        ## app.py reads data.csv next to helpers.py: run a copy of the sources in the temp dir
+        for source in Path(__file__).parent.glob('*.py'):
+            (Path(tmp) / source.name).write_text(source.read_text())
+        ## the first run builds the columnar cache of data.csv, the second one reads it
+        for run in ['cold cache', 'warm cache']:
+            result = subprocess.run([sys.executable, '-c', script], cwd=tmp, capture_output=True, text=True)
+            print(f'cold start {n:>9,} rows, {run} | ' + (result.stdout or result.stderr).strip().replace('\n', '\n    '))
+
+
+BENCHMARKS = {
+    'startup': bench_startup,
+    'category': bench_monthly_category,
+    'memory': bench_memory,
+    'import': bench_import,
+    'backends': bench_backends,
+    'suite': bench_suite,
+    'coldstart': bench_cold_start,
+}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Personal finance benchmarks')
+    ## checked below, not with choices=: on Python 3.11 argparse checks the empty list of a bare
+    ## 'python bench.py' against the choices and rejects it
+    parser.add_argument('benchmarks', nargs='*', metavar='benchmark', help=f'any of {", ".join(BENCHMARKS)} (default: all)')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--no-legacy', action='store_true', help='skip the (slow) pre-optimization implementations')
+    parser.add_argument('--save', type=Path, help='write the measures to this json file')
+    parser.add_argument('--compare', type=Path, help='compare the measures to a json file saved before')
+    parser.add_argument('--threshold', type=float, default=1.25, help='slower than this ratio is a regression')
+    args = parser.parse_args()
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f'unknown benchmark {", ".join(unknown)} (choose from {", ".join(BENCHMARKS)})')
+
+    RUN_LEGACY = not args.no_legacy
+    for name in args.benchmarks or list(BENCHMARKS):
+        for n in args.rows:
+            BENCHMARKS[name](n)
+
+    if args.save:
+        args.save.write_text(json.dumps(RESULTS, indent=2))
+    if args.compare:
+        regressions = compare(json.loads(args.compare.read_text()), args.threshold)
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,98 @@
+import pandas as pd
+
+
+KEYS = ['year', 'month', 'account', 'category', 'currency']
+VALUES = ['in', 'out', 'in_eur', 'out_eur', 'rows']
+
+
+def aggregate(data, convert):
+    ## in/out totals (cents, and converted to EUR at each transaction's rate) and row count
+    ## of every (year, month, account, category, currency) cell
+    ## data are ledger rows, or totals already grouped by day that carry their row count
+    cells = data[KEYS + ['in', 'out']].join(convert(data)).assign(rows=data['rows'] if 'rows' in data else 1)
+    cells = cells.groupby(KEYS, observed=True)[VALUES].sum().reset_index()
+    ## plain keys, so cells of rows with new categories can be merged in
+    cells = cells.astype({'year': 'int64', 'month': 'int64', 'account': 'object', 'category': 'object', 'currency': 'object'})
+    return cells.set_index(KEYS)
+
+
+class MonthlyCube:
+    ## monthly aggregates of the ledger, kept up to date with the deltas of add/edit/delete
+    ## so the charts never go back to the raw transactions
+
+    def __init__(self, data, convert):
+        ## convert(rows) returns the in_eur/out_eur columns of the rows
+        self.convert = convert
+        if data is None or not len(data):
+            self.cells = pd.DataFrame(
+                {col: [] for col in VALUES},
+                index=pd.MultiIndex.from_tuples([], names=KEYS)
+            )
+        else:
+            self.cells = aggregate(data, convert)
+
+    def apply(self, added=None, removed=None):
+        ## added/removed are ledger rows (an edit removes the old row and adds the new one)
+        deltas = []
+        if added is not None and len(added):
+            deltas.append(aggregate(added, self.convert))
+        if removed is not None and len(removed):
+            deltas.append(-aggregate(removed, self.convert))
+        if not deltas:
+            return
+        delta = pd.concat(deltas).groupby(level=KEYS).sum()
+
+        present = delta.index.isin(self.cells.index)
+        touched = delta.index[present]
+        self.cells.loc[touched, VALUES] += delta.loc[touched, VALUES]
+        if not present.all():
+            self.cells = pd.concat([self.cells, delta[~present]]).sort_index()
+
+        ## a cell without transactions disappears (e.g. the last row of a month is deleted)
+        empty = touched[self.cells.loc[touched, 'rows'].to_numpy() <= 0]
+        if len(empty):
+            self.cells = self.cells.drop(empty)
+
+    def account_months(self, account):
+        ## one row per (year, month, currency) of the account, with the closing balance of the month
+        cells = self.cells[self.cells.index.get_level_values('account') == account]
+        data = cells.groupby(['year', 'month', 'account', 'currency'])[['in', 'out']].sum().reset_index()
+        data = data.sort_values(['year', 'month'], kind='stable')
+        ## cents to currency units, the running sum is done in cents so it is exact
+        data['balance'] = (data['in'] - data['out']).cumsum() / 100
+        data['in'] = data['in'] / 100
+        data['out'] = data['out'] / 100
+        data['in_out'] = data['in'] - data['out']
+        return data[['year', 'month', 'account', 'currency', 'in', 'out', 'in_out', 'balance']]
+
+    def categories(self, year, exclude=()):
+        ## in/out of every (year, month, category) of the year, currencies kept apart
+        index = self.cells.index
+        cells = self.cells[(index.get_level_values('year') == int(year)) & ~index.get_level_values('account').isin(exclude)]
+        return cells.groupby(['year', 'month', 'category', 'currency'])[['in', 'out', 'in_eur', 'out_eur']].sum().reset_index()
+
+    def accounts(self):
+        return sorted(set(self.cells.index.get_level_values('account')))
+
+    def category_names(self):
+        return sorted(set(self.cells.index.get_level_values('category')) - {None}, key=str)
+
+    def years(self, account=None):
+        ## most recent first, like the ledger
+        index = self.cells.index
+        if account is not None:
+            index = index[index.get_level_values('account') == account]
+        return sorted(set(index.get_level_values('year').tolist()), reverse=True)
+
+    def months(self, year, account=None):
+        index = self.cells.index
+        mask = index.get_level_values('year') == int(year)
+        if account is not None:
+            mask &= index.get_level_values('account') == account
+        return sorted(set(index[mask].get_level_values('month').tolist()))
+
+def from_cells(cells):
+    ## read-only cube over cells aggregated elsewhere (e.g. a copy sent to the report workers)
+    monthly = MonthlyCube(None, convert=None)
+    monthly.cells = cells
+    return monthly
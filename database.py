@@ -0,0 +1,125 @@
+import sqlite3
+
+import pandas as pd
+
+
+COLUMNS = ['date', 'account', 'category', 'description', 'currency', 'in', 'out']
+
+## one row per transaction, id is the ledger row id, amounts in cents
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS transactions (
+    id INTEGER PRIMARY KEY,
+    date TEXT NOT NULL,
+    account TEXT NOT NULL,
+    category TEXT,
+    description TEXT,
+    currency TEXT NOT NULL,
+    "in" INTEGER NOT NULL DEFAULT 0,
+    "out" INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS transactions_account_date ON transactions (account, date);
+CREATE INDEX IF NOT EXISTS transactions_date_category ON transactions (date, category);
+'''
+
+
+def connect(path):
+    ## the store writes from a worker thread, sqlite serializes the connection itself
+    con = sqlite3.connect(path, check_same_thread=False)
+    con.execute('PRAGMA journal_mode=WAL')
+    con.execute('PRAGMA synchronous=NORMAL')
+    con.executescript(SCHEMA)
+    return con
+
+def _records(rows):
+    ## rows in the data.csv schema (amounts in currency units) indexed by row id
+    rows = rows.assign(
+        date=rows.date.dt.strftime('%Y-%m-%d'),
+        description=rows.description.astype('object').where(rows.description.notna(), None),
+        **{
+            'in': (rows['in'].astype('float64').fillna(0) * 100).round().astype('int64'),
+            'out': (rows['out'].astype('float64').fillna(0) * 100).round().astype('int64'),
+        }
+    )
+    rows = rows[COLUMNS].astype({col: 'object' for col in ['account', 'category', 'currency']})
+    return list(zip(rows.index.astype('int64').tolist(), *(rows[col].tolist() for col in COLUMNS)))
+
+def write_all(con, data):
+    ## replace the whole table in one transaction (the one-shot migration from data.csv)
+    with con:
+        con.execute('DELETE FROM transactions')
+        con.executemany('INSERT INTO transactions VALUES (?, ?, ?, ?, ?, ?, ?, ?)', _records(data))
+
+def apply(con, added=None, edited=None, deleted=None):
+    ## row level changes in one transaction, nothing else is rewritten
+    with con:
+        for rows in (added, edited):
+            if rows is not None and len(rows):
+                con.executemany('INSERT OR REPLACE INTO transactions VALUES (?, ?, ?, ?, ?, ?, ?, ?)', _records(rows))
+        if deleted is not None and len(deleted):
+            con.executemany('DELETE FROM transactions WHERE id = ?', [(int(i),) for i in deleted])
+
+def read_ledger(con):
+    ## the whole table in the data.csv schema, indexed by row id
+    data = pd.read_sql_query(
+        'SELECT id, date, account, category, description, currency, "in", "out" FROM transactions ORDER BY id',
+        con, index_col='id'
+    )
+    data.index.name = None
+    data['date'] = pd.to_datetime(data.date, format='%Y-%m-%d')
+    data['in'] = data['in'] / 100
+    data['out'] = data['out'] / 100
+    return data
+
+def daily_totals(con):
+    ## in/out (cents) and row count of every (day, account, category, currency), with year/month,
+    ## enough for the monthly aggregates and the FX conversion at each day's rate
+    data = pd.read_sql_query(
+        '''
+        SELECT date, account, category, currency, SUM("in") AS "in", SUM("out") AS "out", COUNT(*) AS rows
+        FROM transactions
+        GROUP BY date, account, category, currency
+        ''',
+        con
+    )
+    data['date'] = pd.to_datetime(data.date, format='%Y-%m-%d')
+    data['year'] = data.date.dt.year
+    data['month'] = data.date.dt.month
+    return data
+
+def account_months(con, account):
+    ## in/out of every month of the account and its closing balance, in currency units
+    ## (same columns as MonthlyCube.account_months), served by the (account, date) index
+    data = pd.read_sql_query(
+        '''
+        SELECT CAST(substr(date, 1, 4) AS INTEGER) AS year, CAST(substr(date, 6, 2) AS INTEGER) AS month,
+            account, currency, SUM("in") AS "in", SUM("out") AS "out"
+        FROM transactions
+        WHERE account = ?
+        GROUP BY year, month, currency
+        ORDER BY year, month
+        ''',
+        con, params=(account,)
+    )
+    data['balance'] = (data['in'] - data['out']).cumsum() / 100
+    data['in'] = data['in'] / 100
+    data['out'] = data['out'] / 100
+    data['in_out'] = data['in'] - data['out']
+    return data[['year', 'month', 'account', 'currency', 'in', 'out', 'in_out', 'balance']]
+
+def year_categories(con, year, exclude=()):
+    ## in/out (cents) of every (day, category, currency) of the year, served by the (date, category) index
+    ## the FX conversion needs the day, the caller converts and groups by month
+    placeholders = ', '.join('?' * len(exclude))
+    data = pd.read_sql_query(
+        f'''
+        SELECT date, category, currency, SUM("in") AS "in", SUM("out") AS "out"
+        FROM transactions
+        WHERE date >= ? AND date < ? {f'AND account NOT IN ({placeholders})' if exclude else ''}
+        GROUP BY date, category, currency
+        ''',
+        con, params=(f'{int(year)}-01-01', f'{int(year) + 1}-01-01', *exclude)
+    )
+    data['date'] = pd.to_datetime(data.date, format='%Y-%m-%d')
+    data['year'] = data.date.dt.year
+    data['month'] = data.date.dt.month
+    return data
@@ -0,0 +1,152 @@
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import time
+from collections import deque
+
+import numpy as np
+import pandas as pd
+from shiny.types import SilentCancelOutputException, SilentException
+
+
+## opt-in: FINANCE_DIAGNOSTICS=1 instruments the outputs and effects and shows the Diagnostics tab
+ENABLED = os.environ.get('FINANCE_DIAGNOSTICS') == '1'
+
+## latency histogram buckets (upper bounds in ms), and how many recent latencies the percentiles use
+BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, float('inf')]
+RECENT = 1000
+
+
+class Stats:
+    ## execution count, wall time, rows and payload of one output or effect
+
+    def __init__(self, name, kind):
+        self.name = name
+        self.kind = kind
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = None
+        self.payload = None
+        self.buckets = [0] * len(BUCKETS_MS)
+        self.recent = deque(maxlen=RECENT)
+
+    def record(self, seconds, rows=None, payload=None, error=False):
+        ms = seconds * 1000
+        self.count += 1
+        self.errors += error
+        self.total += ms
+        self.max = max(self.max, ms)
+        self.rows = rows
+        self.payload = payload
+        self.buckets[int(np.searchsorted(BUCKETS_MS, ms))] += 1
+        self.recent.append(ms)
+
+    def summary(self):
+        recent = np.fromiter(self.recent, dtype='float64') if self.recent else np.zeros(1)
+        return {
+            'name': self.name,
+            'kind': self.kind,
+            'count': self.count,
+            'errors': self.errors,
+            'mean_ms': self.total / self.count if self.count else 0.0,
+            'p50_ms': float(np.percentile(recent, 50)),
+            'p95_ms': float(np.percentile(recent, 95)),
+            'max_ms': self.max,
+            'rows': self.rows,
+            'payload_bytes': self.payload,
+            'histogram': {f'<={b:g}ms': c for b, c in zip(BUCKETS_MS, self.buckets) if c},
+        }
+
+
+## name -> Stats, shared by all the sessions of the process
+STATS = {}
+## names whose next run is profiled, and the last profile of every name
+PROFILE_NEXT = set()
+PROFILES = {}
+
+
+def _rows(result):
+    ## rows behind an output: data frames, grids/tables, figures (points of all the traces), lists
+    if isinstance(result, pd.DataFrame):
+        return len(result)
+    data = getattr(result, 'data', None)
+    if isinstance(data, pd.DataFrame):
+        return len(data)
+    if isinstance(data, tuple) and data and hasattr(data[0], 'x'):
+        return sum(len(trace.x) for trace in data if trace.x is not None)
+    if isinstance(result, (list, tuple)):
+        return len(result)
+    return None
+
+def _payload(result):
+    ## size of what is sent to the browser (approximately, for tags and tables)
+    if result is None:
+        return 0
+    if hasattr(result, 'to_json'):
+        try:
+            return len(result.to_json())
+        except TypeError:
+            pass
+    data = getattr(result, 'data', None)
+    if isinstance(data, pd.DataFrame):
+        return len(data.to_json(orient='values'))
+    return len(str(result))
+
+def instrument(name=None, kind='output'):
+    ## decorator for the functions under @render.* / @render_widget / @reactive.effect,
+    ## a no-op unless diagnostics are enabled
+    def decorator(fn):
+        if not ENABLED:
+            return fn
+        key = name or fn.__name__
+        stats = STATS.setdefault(key, Stats(key, kind))
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            profiler = None
+            if key in PROFILE_NEXT:
+                PROFILE_NEXT.discard(key)
+                profiler = cProfile.Profile()
+                profiler.enable()
+            start = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            except (SilentException, SilentCancelOutputException):
+                ## req() short-circuits: not an error, and no work to time
+                raise
+            except Exception:
+                stats.record(time.perf_counter() - start, error=True)
+                raise
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+                    out = io.StringIO()
+                    pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(30)
+                    PROFILES[key] = out.getvalue()
+            seconds = time.perf_counter() - start
+            stats.record(seconds, rows=_rows(result), payload=_payload(result) if kind == 'output' else None)
+            return result
+
+        return wrapper
+    return decorator
+
+def profile_next(name):
+    ## capture a cProfile of the next run of name
+    PROFILE_NEXT.add(name)
+
+def summary():
+    ## one row per instrumented output/effect, slowest (total time) first
+    rows = [stats.summary() for stats in STATS.values()]
+    if not rows:
+        return pd.DataFrame(columns=['name', 'kind', 'count', 'errors', 'mean_ms', 'p50_ms', 'p95_ms', 'max_ms', 'rows', 'payload_bytes'])
+    data = pd.DataFrame(rows)
+    return data.assign(total_ms=data['count'] * data.mean_ms).sort_values('total_ms', ascending=False).drop(columns='total_ms')
+
+def dump():
+    ## everything as json: the stats, their histograms and the captured profiles
+    return json.dumps({'stats': [stats.summary() for stats in STATS.values()], 'profiles': PROFILES}, indent=2, default=str)
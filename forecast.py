@@ -0,0 +1,128 @@
+import numpy as np
+import pandas as pd
+
+
+## the projection is fitted on the last months of history (fewer when the account is younger)
+FIT_MONTHS = 36
+PERCENTILES = [5, 25, 50, 75, 95]
+## draws of the monthly net flow the paths are sampled from
+SAMPLE = 1 << 16
+## random numbers drawn at once (samples x streams), bounds the memory of a simulation
+CHUNK = 2_000_000
+MAX_PATHS = 100_000
+
+
+def _month(year, month):
+    return int(year) * 12 + int(month) - 1
+
+def history(cells, months=FIT_MONTHS, today=None):
+    ## monthly in/out (currency units) of every (account, category) over the fitting window:
+    ## one row per (account, category, direction), one column per month, months without
+    ## transactions are 0. cells are MonthlyCube.cells (amounts in cents)
+    ## the current month is left out, it is not over yet
+    if not len(cells):
+        return pd.DataFrame(), []
+    today = pd.Timestamp.today() if today is None else pd.Timestamp(today)
+    index = cells.index
+    month = index.get_level_values('year').to_numpy() * 12 + index.get_level_values('month').to_numpy() - 1
+    last = month.max()
+    if last == _month(today.year, today.month) and (month < last).any():
+        last -= 1
+    first = last - months + 1
+
+    frame = pd.DataFrame({
+        'account': index.get_level_values('account'),
+        'category': index.get_level_values('category'),
+        'month': month,
+        'in': cells['in'].to_numpy() / 100,
+        'out': cells['out'].to_numpy() / 100,
+    })
+    ## accounts younger than the window are fitted on the months since their first transaction
+    start = frame.groupby('account').month.min().clip(lower=first)
+    frame = frame[(frame.month >= first) & (frame.month <= last)]
+    frame = frame.melt(id_vars=['account', 'category', 'month'], value_vars=['in', 'out'], var_name='direction')
+    frame = frame[frame.value != 0]
+    table = frame.pivot_table(index=['account', 'category', 'direction'], columns='month', values='value', aggfunc='sum', fill_value=0)
+    table = table.reindex(columns=range(first, last + 1), fill_value=0)
+
+    ## months before an account existed are not zeros, they are not part of its history
+    account_start = start.reindex(table.index.get_level_values('account')).to_numpy()
+    table = table.where(table.columns.to_numpy()[None, :] >= account_start[:, None])
+    return table, last
+
+def fit(table):
+    ## every (account, category, direction) stream: a month has a transaction with probability p,
+    ## its total is lognormal(mu, sigma), fitted on the months of history
+    values = table.to_numpy(dtype='float64')
+    observed = ~np.isnan(values)
+    positive = observed & (values > 0)
+    logs = np.where(positive, np.log(np.where(positive, values, 1)), np.nan)
+    count = positive.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mu = np.nansum(logs, axis=1) / count
+        sigma = np.sqrt(np.nansum((logs - mu[:, None]) ** 2, axis=1) / count)
+    streams = table.index.to_frame(index=False)
+    streams['p'] = count / np.maximum(observed.sum(axis=1), 1)
+    streams['mu'] = np.nan_to_num(mu)
+    streams['sigma'] = np.nan_to_num(sigma)
+    streams['sign'] = np.where(streams.direction == 'in', 1.0, -1.0)
+    return streams[streams.p > 0].reset_index(drop=True)
+
+def monthly_flows(streams, weights, size, rng):
+    ## draws of the net flow of one month: every stream drawn for every sample at once (chunks of
+    ## samples), summed by a product with their weights (sign x exchange rate)
+    p = streams.p.to_numpy(dtype='float32')
+    mu = streams.mu.to_numpy(dtype='float32')
+    sigma = streams.sigma.to_numpy(dtype='float32')
+    weights = np.asarray(weights, dtype='float32')
+    flows = np.empty(size, dtype='float32')
+    step = max(1, CHUNK // max(1, len(p)))
+    for lo in range(0, size, step):
+        shape = (min(step, size - lo), len(p))
+        amounts = rng.standard_normal(shape, dtype='float32')
+        amounts *= sigma
+        amounts += mu
+        np.exp(amounts, out=amounts)
+        amounts *= rng.random(shape, dtype='float32') < p
+        flows[lo:lo + shape[0]] = amounts @ weights
+    return flows
+
+def simulate(streams, weights, start, months, paths, seed=0):
+    ## wealth after each month of every path: start + the running sum of the monthly flows
+    ## the months are independent draws of the same net flow: SAMPLE draws of it are made from the
+    ## fitted streams, then every (path, month) picks one of them, so the cost of a path does not
+    ## grow with the number of categories. returns an array (paths, months)
+    rng = np.random.default_rng(seed)
+    sample = monthly_flows(streams, weights, SAMPLE, rng)
+    flows = sample[rng.integers(0, SAMPLE, (paths, months))]
+    ## running sums in float64, the balances can be large next to a month's flows
+    return start + np.cumsum(flows, axis=1, dtype='float64')
+
+def project(cells, balances, rates, account=None, years=10, paths=10_000, seed=0, today=None):
+    ## percentile bands of the wealth of an account (its currency), or of all of them (account
+    ## None, base currency at the latest rates), month by month over the years
+    ## balances: current balance of every account (BalanceIndex.closing), rates: account -> rate
+    ## returns one row per month: date and one column per percentile (p5, p25, ...)
+    table, last = history(cells, today=today)
+    streams = fit(table) if len(table) else pd.DataFrame(columns=['account', 'p', 'mu', 'sigma', 'sign'])
+    if account is None:
+        rate = streams.account.map(rates).astype('float64').fillna(0).to_numpy()
+        start = float(np.nansum(balances.balance.to_numpy() * balances.index.map(rates).to_numpy(dtype='float64')))
+    else:
+        streams = streams[streams.account == account]
+        rate = np.ones(len(streams))
+        start = float(balances.balance.get(account, 0))
+
+    months = int(years) * 12
+    paths = int(min(max(paths, 1), MAX_PATHS))
+    wealth = simulate(streams, streams.sign.to_numpy() * rate, start, months, paths, seed)
+    bands = np.percentile(wealth, PERCENTILES, axis=0)
+
+    ## from the month after the history on
+    first = pd.Timestamp.today().to_period('M') if not len(table) else pd.Period(year=(last + 1) // 12, month=(last + 1) % 12 + 1, freq='M')
+    dates = pd.date_range(first.to_timestamp(), periods=months + 1, freq='MS')
+    ## the first point is today's balance, every path starts there
+    result = pd.DataFrame({'date': dates})
+    for q, band in zip(PERCENTILES, bands):
+        result[f'p{q}'] = np.concatenate([[start], band])
+    return result
@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+
+import storage
+
+
+class RateTable:
+    ## daily FX rates to the base currency (base currency units for one unit of currency)
+    ## loaded from a csv with date,currency,rate columns, one row per currency and day
+    ## currencies missing from the file use the static fallback rate
+
+    def __init__(self, base='EUR', fallback=None):
+        self.base = base
+        self.fallback = fallback or {}
+        self.dates = {}
+        self.rates = {}
+        self.signature = None
+        self.version = 0
+
+    def load(self, path):
+        rates = pd.read_csv(path)
+        rates['date'] = pd.to_datetime(rates.date, dayfirst=True, errors='raise', format='mixed')
+        rates = rates.dropna(subset=['rate']).sort_values(['currency', 'date'], kind='stable')
+
+        self.dates = {}
+        self.rates = {}
+        for currency, group in rates.groupby('currency', sort=False):
+            self.dates[currency] = group.date.to_numpy(dtype='datetime64[ns]')
+            self.rates[currency] = group.rate.to_numpy(dtype='float64')
+        self.version += 1
+
+    def load_if_changed(self, path):
+        ## cached conversions are keyed by version, so only bump it when the file really changed
+        signature = storage.file_signature(path)
+        if signature == self.signature:
+            return
+        if signature == 'none':
+            self.dates, self.rates = {}, {}
+            self.version += 1
+        else:
+            self.load(path)
+        self.signature = signature
+
+    @property
+    def currencies(self):
+        return [self.base] + sorted((set(self.rates) | set(self.fallback)) - {self.base})
+
+    def rate(self, currencies, dates):
+        ## as-of join: the last rate published on or before each date (the first one for older dates)
+        currencies = np.asarray(currencies, dtype=object)
+        dates = np.asarray(dates, dtype='datetime64[ns]')
+        rate = np.full(len(currencies), np.nan)
+
+        codes, uniques = pd.factorize(currencies)
+        for code, currency in enumerate(uniques):
+            rows = np.flatnonzero(codes == code)
+            if currency == self.base:
+                rate[rows] = 1.0
+            elif currency in self.rates:
+                pos = np.searchsorted(self.dates[currency], dates[rows], side='right') - 1
+                rate[rows] = self.rates[currency][np.clip(pos, 0, None)]
+            elif currency in self.fallback:
+                rate[rows] = self.fallback[currency]
+        return rate
+
+    def latest(self, currencies):
+        ## today's value of a balance
+        return self.rate(currencies, np.full(len(currencies), np.datetime64('now', 'ns')))
+
+    def convert(self, data):
+        ## in/out of every transaction converted at the rate of its date
+        rate = self.rate(data.currency.to_numpy(), data.date.to_numpy())
+        return pd.DataFrame(
+            {'in_eur': data['in'].to_numpy() * rate, 'out_eur': data['out'].to_numpy() * rate},
+            index=data.index
+        )
@@ -1,130 +1,525 @@
+import functools
+import weakref
+from collections import OrderedDict
+
+import numpy as np
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
 
-from shiny import ui
 from datetime import datetime, timedelta
 
 from pathlib import Path
 import warnings
 warnings.filterwarnings('ignore')
 
+import database as db
+import fx
+import importer
+import partitions
+import rules
+import storage
+
 
 app_dir = Path(__file__).parent
 DATA_FILE = app_dir / 'data.csv'
 
+## 'journal' appends every change to data.journal and folds it into data.csv in the background
+## 'csv' rewrites the whole data.csv on every change
+## 'sqlite' keeps the ledger in data.db (migrated from data.csv on first use): changes are row level
+## INSERT/UPDATE/DELETE, the monthly balance, net savings and category charts are aggregated by SQLite
+## 'partitioned' keeps one file per year in ledger/ (migrated from data.csv on first use): only the
+## latest year and the day totals of all of them are loaded at startup, older years when they are
+## viewed, and a change rewrites the years it touches
+STORAGE_MODE = 'journal'
+JOURNAL = storage.Journal(DATA_FILE)
+DATABASE_FILE = app_dir / 'data.db'
+_database = None
+PARTITIONS_DIR = app_dir / 'ledger'
+_partitions = None
+## rows of the history kept in memory in partitioned mode, the least recently viewed years are
+## evicted beyond it (None: never evicted)
+PARTITION_BUDGET = 250_000
+
 MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
 
+BASE_CURRENCY = 'EUR'
+## daily rates to EUR (date,currency,rate), every transaction is converted at the rate of its date
+RATES_FILE = app_dir / 'rates.csv'
+## to EUR, used for the currencies without daily rates
+EXCHANGE_RATES = {'EUR': 1, 'GBP': 1.19} #CurrencyRates().get_rate('GBP', 'EUR')
+RATES = fx.RateTable(base=BASE_CURRENCY, fallback=EXCHANGE_RATES)
+
+def load_rates():
+    try:
+        RATES.load_if_changed(RATES_FILE)
+    except Exception as e:
+        print(f'Could not load the exchange rates, using the fixed ones\nException: {e}')
+
+load_rates()
+CURRENCIES = RATES.currencies
+
 ACCOUNTS = ['sella', 'generali', 'generali_SAV', 'revolut_EUR', 'revolut_GBP']
 
 CATEGORY_INCOME = ['salary', 'rent', 'transfer', 'refund', 'interests']
+## savings accounts are left out of the category percentages
+CATEGORY_EXCLUDED_ACCOUNTS = ['generali_SAV']
+
 CATEGORY_EXPENSES = ['wants', 'needs', 'rent', 'bills', 'transfer', 'subscription', 'savings', 'interests']
 
-ADD_TRANSACTION = {
-    'date': ui.input_date(
-        id='add_date',
-        label='Date',
-        format='dd/mm/yyyy',
-        min=datetime.today() - timedelta(weeks=52),
-        max=datetime.today(),
-    ),
-    'account':ui.input_select(
-        id='add_account',
-        label='Account',
-        choices=ACCOUNTS,
-    ),
-   'category': ui.input_select(
-        id='add_category',
-        label='Category',
-        choices=CATEGORY_INCOME + CATEGORY_EXPENSES
-    ),
-    'description': ui.input_text(
-        id='add_description',
-        label='Description',
-        placeholder='e.g., dinner out'
-    ),
-    'currency': ui.input_radio_buttons(
-        id='add_currency',
-        label='',
-        choices=['EUR', 'GBP'],
-        inline=True
-    ),
-    'in': ui.input_numeric(
-        id='add_in',
-        label='Income',
-        value=0.0
-    ),
-    'out': ui.input_numeric(
-        id='add_out',
-        label='Expenses',
-        value=0.0
-    ),
+## categorization rules (see rules.FIELDS), applied to the new rows without a category and to the
+## whole history when they change
+RULES_FILE = app_dir / 'rules.json'
+RULES = rules.RuleSet()
+## category choice of the add form that lets the rules decide
+AUTO_CATEGORY = ''
+
+def load_rules():
+    global RULES
+    try:
+        RULES = rules.load(RULES_FILE)
+    except Exception as e:
+        print(f'Could not load the categorization rules\nException: {e}')
+
+load_rules()
+
+## the in memory ledger keeps these columns as categoricals (unknown values are appended)
+LEDGER_CATEGORIES = {
+    'account': ACCOUNTS,
+    'category': list(dict.fromkeys(CATEGORY_INCOME + CATEGORY_EXPENSES)),
+    'currency': CURRENCIES,
 }
 
+## fields of the add/edit form, input ids are add_<field>
+ADD_TRANSACTION_FIELDS = ['date', 'account', 'category', 'description', 'currency', 'in', 'out']
+
+def add_transaction_inputs():
+    ## built when the form is opened: today's date and the current currencies, not the ones at import
+    ## shiny is only imported by the forms, the report workers use the helpers without it
+    from shiny import ui
+    return {
+        'date': ui.input_date(
+            id='add_date',
+            label='Date',
+            format='dd/mm/yyyy',
+            min=datetime.today() - timedelta(weeks=52),
+            max=datetime.today(),
+        ),
+        'account':ui.input_select(
+            id='add_account',
+            label='Account',
+            choices=ACCOUNTS,
+        ),
+       'category': ui.input_select(
+            id='add_category',
+            label='Category',
+            choices={AUTO_CATEGORY: '(by the rules)', **{c: c for c in CATEGORY_INCOME + CATEGORY_EXPENSES}}
+        ),
+        'description': ui.input_text(
+            id='add_description',
+            label='Description',
+            placeholder='e.g., dinner out'
+        ),
+        'currency': ui.input_radio_buttons(
+            id='add_currency',
+            label='',
+            choices=RATES.currencies,
+            inline=True
+        ),
+        'in': ui.input_numeric(
+            id='add_in',
+            label='Income',
+            value=0.0
+        ),
+        'out': ui.input_numeric(
+            id='add_out',
+            label='Expenses',
+            value=0.0
+        ),
+    }
+
+## fields of the multi-row edit form, input ids are bulk_<field>, empty fields keep every row's value
+BULK_EDIT_FIELDS = ['account', 'category', 'description', 'currency', 'in', 'out']
+
+def bulk_edit_inputs():
+    ## same widgets as the add form, each defaulting to 'unchanged'
+    from shiny import ui
+    keep = {'': '(unchanged)'}
+    return {
+        'date': ui.input_checkbox('bulk_set_date', 'Change the date', value=False),
+        'date_value': ui.input_date(id='bulk_date', label='', format='dd/mm/yyyy', max=datetime.today()),
+        'account': ui.input_select(id='bulk_account', label='Account', choices={**keep, **{a: a for a in ACCOUNTS}}),
+        'category': ui.input_select(
+            id='bulk_category',
+            label='Category',
+            choices={**keep, **{c: c for c in CATEGORY_INCOME + CATEGORY_EXPENSES}}
+        ),
+        'description': ui.input_text(id='bulk_description', label='Description', placeholder='(unchanged)'),
+        'currency': ui.input_select(id='bulk_currency', label='Currency', choices={**keep, **{c: c for c in RATES.currencies}}),
+        'in': ui.input_numeric(id='bulk_in', label='Income', value=None),
+        'out': ui.input_numeric(id='bulk_out', label='Expenses', value=None),
+    }
+
 def import_data():
+    load_rates()
     try:
-        ## import from csv file
-        data = pd.read_csv(DATA_FILE)
-        ## convert dates to datetime
-        data['date'] = pd.to_datetime(data.date, dayfirst=True, errors='raise', format='mixed')#'%d/%m/%Y')
-        data['year'] = data.date.dt.year
-        data['month'] = data.date.dt.month
+        ## import from csv file (and replay the journal on top of it)
+        ## dates are parsed once and kept in the columnar cache until data.csv changes
+        if STORAGE_MODE == 'sqlite':
+            data = db.read_ledger(database())
+        elif STORAGE_MODE == 'partitioned':
+            data = partitions_store().read(partitions_store().years()[:1])
+        elif STORAGE_MODE == 'journal':
+            data = JOURNAL.load()
+        else:
+            data = storage.read_snapshot(DATA_FILE)
+        data = to_ledger(data)
         data = data.sort_values(by='date', ascending=False)
         return data
     except Exception as e:
         print(f'Oops, something went wrong\nException: {e}')
         return None
 
+def database():
+    ## connection to DATABASE_FILE, created on first use
+    global _database
+    if _database is None:
+        fresh = not DATABASE_FILE.exists()
+        _database = db.connect(DATABASE_FILE)
+        if fresh and DATA_FILE.exists():
+            migrate_to_sqlite(_database)
+    return _database
+
+def migrate_to_sqlite(con):
+    ## one-shot copy of data.csv (with the journal replayed, so the row ids stay the same)
+    db.write_all(con, JOURNAL.load())
+    print(f'Migrated {DATA_FILE.name} to {DATABASE_FILE.name}')
+
+def partitions_store():
+    ## the year partitions in PARTITIONS_DIR, created on first use
+    global _partitions
+    if _partitions is None:
+        _partitions = partitions.PartitionStore(PARTITIONS_DIR)
+        if not _partitions.exists() and DATA_FILE.exists():
+            _partitions.write_all(JOURNAL.load())
+            print(f'Migrated {DATA_FILE.name} to {PARTITIONS_DIR.name}/')
+    return _partitions
+
+def load_partitions(years):
+    ## rows of older years for the store, in partitioned mode
+    return partitions_store().read(years)
+
+def daily_totals():
+    ## what the monthly cube and the running balances are built from: pre-aggregated by SQLite in
+    ## sqlite mode, read from the partition totals in partitioned mode, None otherwise (they
+    ## aggregate the ledger itself)
+    if STORAGE_MODE == 'sqlite':
+        return db.daily_totals(database())
+    if STORAGE_MODE == 'partitioned':
+        return partitions_store().read_totals()
+    return None
+
+def to_cents(amounts):
+    return np.round(pd.Series(amounts).fillna(0).to_numpy(dtype='float64') * 100).astype('int64')
+
+def to_ledger(data, like=None):
+    ## compact in memory ledger: categoricals for account/category/currency, amounts in int64 cents
+    ## (sums are exact), year/month packed in small ints. like: ledger whose categories to reuse
+    data = data.copy()
+    for col, vocabulary in LEDGER_CATEGORIES.items():
+        categories = list(like[col].cat.categories) if like is not None else list(vocabulary)
+        values = data[col].astype('object')
+        known = set(categories)
+        categories += [v for v in pd.unique(values.dropna()) if v not in known]
+        data[col] = pd.Categorical(values, categories=categories)
+    if storage.feather is not None:
+        data['description'] = data.description.astype('string[pyarrow]')
+    data['in'] = to_cents(data['in'])
+    data['out'] = to_cents(data['out'])
+    data['year'] = data.date.dt.year.astype('int16')
+    data['month'] = data.date.dt.month.astype('int8')
+    return data
+
+def extend_categories(data, rows):
+    ## add the new accounts/categories/currencies of rows (from to_ledger(rows, like=data)) to the
+    ## ledger, so that concatenating them keeps the categorical dtypes
+    for col in LEDGER_CATEGORIES:
+        extra = rows[col].cat.categories[len(data[col].cat.categories):]
+        if len(extra):
+            data = data.assign(**{col: data[col].cat.add_categories(extra)})
+    return data
+
+def to_file(data):
+    ## back to the data.csv schema
+    data = data.drop(['month', 'year'], axis=1, errors='ignore')
+    return data.assign(**{'in': data['in'] / 100, 'out': data['out'] / 100})
+
 def save_data_to_file(data):
-    if 'month' in data.columns and 'year' in data.columns:
-        data = data.drop(['month', 'year'], axis=1)
-    try:
-        data.to_csv(DATA_FILE, index=False)
-        ui.notification_show('File saved', type='message')
-    except Exception as e:
-        ui.notification_show(f'Error while trying to save to file: {e}', type='error')
+    ## full rewrite, atomic: readers see the old file or the new one, never half of it
+    ## errors are raised to the caller (the store's writer reports them to the session)
+    storage.atomic_write_csv(to_file(data), DATA_FILE)
 
-def calculate_total_wealth(data):
-    wealth = []
-    for account in data.account.unique():
-        account_df = data[data.account == account]
-        account_df = account_df.sort_values(['date'])
-        account_df['in_out'] = account_df['in'] - data['out']
-        account_df['balance'] = round(account_df.in_out.cumsum(),2)
+## columns of the Data tab and how many rows the grid gets at once
+TABLE_COLUMNS = ['date', 'account', 'category', 'description', 'currency', 'in', 'out']
+TABLE_PAGE_SIZES = [50, 100, 250, 1000]
+
+def table_positions(data, index, account='All', year='All', sort='date', ascending=False,
+                    category='All', amount=(None, None), ids=None):
+    ## row positions of the filtered and sorted ledger: the Data tab view, pages are slices of it
+    ## the filters go through the account/year index, so only the matching rows are touched
+    ## ids: rows matched by the description search (None: no search), amount: (min, max) of the
+    ## transaction amount (in or out) in currency units, None for no bound
+    if account == 'All' and year == 'All':
+        positions = np.arange(len(data))
+    else:
+        group_ids = index.ids(None if account == 'All' else account, None if year == 'All' else int(year))
+        positions = np.sort(data.index.get_indexer(group_ids))
+
+    if ids is not None:
+        found = data.index.get_indexer(ids)
+        positions = np.intersect1d(positions, found[found >= 0], assume_unique=True)
+    if category != 'All':
+        codes = data.category.cat.codes.to_numpy()
+        code = data.category.cat.categories.get_indexer([category])[0]
+        positions = positions[codes[positions] == code]
+    low, high = amount
+    if low is not None or high is not None:
+        cents = data['in'].to_numpy()[positions] + data['out'].to_numpy()[positions]
+        keep = np.ones(len(positions), dtype=bool)
+        if low is not None:
+            keep &= cents >= round(low * 100)
+        if high is not None:
+            keep &= cents <= round(high * 100)
+        positions = positions[keep]
+
+    if sort == 'date' and not ascending:
+        ## the ledger is already kept newest first
+        return positions
+    values = data[sort].iloc[positions].reset_index(drop=True)
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        ## alphabetical, not in vocabulary order
+        values = values.cat.reorder_categories(sorted(values.cat.categories))
+    return positions[values.sort_values(ascending=ascending, kind='stable').index.to_numpy()]
 
-        wealth.append((account_df.currency.iloc[-1], account_df.balance.iloc[-1]))
-    
-    total_eur = sum([item[1] for item in wealth if item[0]=='EUR'])
-    total_gbp = sum(item[1] for item in wealth if item[0]=='GBP') * 1.19 #CurrencyRates().get_rate('GBP', 'EUR')
+def next_id(data):
+    ## in partitioned mode the years not loaded may hold higher ids
+    start = int(data.index.max()) + 1 if len(data) else 0
+    if STORAGE_MODE == 'partitioned':
+        start = max(start, partitions_store().next_id)
+    return start
+
+## up to this many rows are inserted slice by slice, larger batches with one gather
+MERGE_SLICES = 8
+
+def _date_keys(dates):
+    ## the ledger is sorted newest first: negated dates are an ascending key for binary searches
+    return -dates.to_numpy(dtype='datetime64[ns]').view('int64')
+
+def merge_rows(data, rows):
+    ## insert rows (same columns and categories as data) at their sorted position: one binary
+    ## search per row and one pass laying the columns out, the ledger is not sorted again
+    ## rows go after the ones of the same date already in the ledger (like a stable sort)
+    if rows is None or not len(rows):
+        return data
+    rows = rows.sort_values(by='date', ascending=False, kind='stable')
+    pos = np.searchsorted(_date_keys(data.date), _date_keys(rows.date), side='right')
+    if len(rows) <= MERGE_SLICES:
+        ## a few rows: the untouched runs of the ledger are copied as whole slices
+        bounds = np.concatenate([[0], pos, [len(data)]])
+        pieces = []
+        for i in range(len(rows)):
+            pieces += [data.iloc[bounds[i]:bounds[i + 1]], rows.iloc[i:i + 1]]
+        return pd.concat(pieces + [data.iloc[bounds[-2]:]])
+    order = np.insert(np.arange(len(data)), pos, np.arange(len(data), len(data) + len(rows)))
+    return pd.concat([data, rows]).take(order)
 
-    return(total_eur + total_gbp)
+def apply_changes(data, added=None, edited=None, deleted=None):
+    ## one batch of changes, rows from a single to_ledger(rows, like=data):
+    ## added get the next free row ids, edited are indexed by the ids of the rows they replace,
+    ## deleted are row ids (the ones already gone are ignored, a deleted row is not edited)
+    ## only the touched rows are converted and placed, the others are kept as they are
+    ## returns the updated ledger, the rows as added/edited and the rows removed/replaced
+    deleted = data.index.intersection(pd.Index([] if deleted is None else deleted))
+    if edited is not None:
+        edited = edited[~edited.index.isin(deleted)]
+        missing = edited.index.difference(data.index)
+        if len(missing):
+            raise KeyError(f'Row(s) {list(missing)} no longer exist')
+    if added is not None:
+        start = next_id(data)
+        added = added.set_axis(pd.RangeIndex(start, start + len(added)))
+
+    parts = [rows.reindex(columns=data.columns) for rows in (added, edited) if rows is not None and len(rows)]
+    rows = pd.concat(parts) if parts else None
+    replaced = deleted if edited is None else deleted.union(edited.index)
+
+    if rows is not None:
+        data = extend_categories(data, rows)
+    removed = data.loc[replaced] if len(replaced) else None
+    kept = data[~data.index.isin(replaced)] if len(replaced) else data
+    return merge_rows(kept, rows), rows, removed
+
+def unchanged(data, rows):
+    ## whether the rows (read from the ledger when a form was opened) are still there, as they were
+    ## the rows of the ledger may have been edited or deleted by another session meanwhile
+    if not rows.index.isin(data.index).all():
+        return False
+    current = data.loc[rows.index, ADD_TRANSACTION_FIELDS].astype(object)
+    return current.equals(rows[ADD_TRANSACTION_FIELDS].astype(object))
+
+def bulk_edit_rows(data, ids, values):
+    ## the rows ids in the data.csv schema with the given fields replaced, ready for LedgerStore.edit
+    ## values: field -> new value, None/'' keeps the value of every row
+    rows = to_file(data.loc[ids, ADD_TRANSACTION_FIELDS])
+    for field, value in values.items():
+        if value is not None and value != '':
+            rows[field] = pd.Timestamp(value) if field == 'date' else value
+    return rows
+
+def add_rows(data, rows):
+    ## rows: ledger rows from to_ledger(rows, like=data), given the next free row ids and
+    ## inserted at their sorted position whatever the size of the batch
+    ## returns the updated ledger and the rows as added
+    updated, rows, _ = apply_changes(data, added=rows)
+    return updated, rows
+
+def save_changes(data, added=None, edited=None, deleted=None):
+    ## persist only the touched rows, data is the updated ledger (indexed by row id)
+    if STORAGE_MODE == 'csv':
+        save_data_to_file(data)
+        return
+
+    def strip(df):
+        return None if df is None else to_file(df)
+
+    if STORAGE_MODE == 'sqlite':
+        db.apply(database(), added=strip(added), edited=strip(edited), deleted=deleted)
+    elif STORAGE_MODE == 'partitioned':
+        partitions_store().apply(added=strip(added), edited=strip(edited), deleted=deleted)
+    else:
+        JOURNAL.append(added=strip(added), edited=strip(edited), deleted=deleted)
+
+def compact_storage(data):
+    ## fold the journal into a new snapshot once it is long enough, data is the ledger with
+    ## everything in the journal applied. the row ids are kept
+    if STORAGE_MODE == 'journal' and JOURNAL.needs_compaction():
+        JOURNAL.compact(to_file(data))
+
+class LRU:
+    ## bounded cache of past results, the least recently used entry is dropped first
+    ## keys must include everything the result depends on (e.g. data version and filters)
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def get(self, key, compute):
+        if key in self.items:
+            self.items.move_to_end(key)
+            return self.items[key]
+        value = compute()
+        self.items[key] = value
+        if len(self.items) > self.maxsize:
+            self.items.popitem(last=False)
+        return value
+
+def data_cached(fn):
+    ## reuse the result while the same ledger frame (and the same FX rates) is passed in,
+    ## every finance.set is a new frame
+    cache = {}
+
+    @functools.wraps(fn)
+    def wrapper(data, *args):
+        key = (id(data), RATES.version) + args
+        hit = cache.get(key)
+        if hit is not None and hit[0]() is data:
+            return hit[1]
+        result = fn(data, *args)
+        for k in [k for k, (ref, _) in cache.items() if ref() is None]:
+            del cache[k]
+        cache[key] = (weakref.ref(data), result)
+        return result
+
+    return wrapper
+
+@data_cached
+def account_balances(data):
+    ## one sort by (account, date) and a grouped cumulative sum for all the accounts at once
+    df = data[['account', 'date', 'currency', 'in', 'out']].sort_values(['account', 'date'], kind='stable')
+    df['balance'] = (df['in'] - df['out']).groupby(df.account, sort=False, observed=True).cumsum()
+
+    ## last row of every account: its closing balance (cents, exact) and currency
+    balances = df.drop_duplicates('account', keep='last')
+    balances = pd.DataFrame(
+        {'currency': balances.currency.astype('object').to_numpy(), 'balance': balances.balance.to_numpy() / 100},
+        index=balances.account.astype('object').to_numpy()
+    )
+    balances = balances.reindex(list(data.account.unique()))
+
+    ## balances are valued at today's rate, currencies without any rate are left out
+    total = (balances.balance * RATES.latest(balances.currency.to_numpy())).sum()
+    return balances, total
+
+def index_balances(index):
+    ## same as account_balances, read from the store's running balances (no pass over the ledger)
+    balances = index.closing()
+    total = (balances.balance * RATES.latest(balances.currency.to_numpy())).sum()
+    return balances, total
+
+def daily_balance_range(index, days=365):
+    ## default range of the daily balance chart: the last year, not before the first transaction
+    end = datetime.today().date()
+    first = index.first_day()
+    start = end - timedelta(days=days)
+    if first is not None:
+        start = min(max(start, pd.Timestamp(first).date()), end)
+    return start, end
+
+def calculate_total_wealth(data):
+    return account_balances(data)[1]
 
 def calculate_account_balance(data):
-    balance = []
-    for account in data.account.unique():
-        account_df = data[data.account == account]
-        account_df = account_df.sort_values(['date'])
-        account_df['in_out'] = account_df['in'] - account_df['out']
-        account_df['balance'] = round(account_df.in_out.cumsum(),2)
+    balances, _ = account_balances(data)
+    return [(currency, balance, account) for account, currency, balance in balances.itertuples()]
 
-        balance.append((account_df.currency.iloc[-1], account_df.balance.iloc[-1], account))
-    return balance
+@data_cached
+def eur_amounts(data):
+    ## in_eur/out_eur of every transaction, converted once per ledger frame and rate table
+    ## (the ledger amounts are in cents)
+    return RATES.convert(data) / 100
 
 def calculate_monthly_category(data, year):
-    def exchange_in_out(df):
-        if df.currency == 'GBP':
-            rate = 1.19
-        else:
-            rate = 1
-        
-        df['in'] = df['in'] * rate
-        df['out'] = df['out'] * rate
-
-        return df
-    
     ## need to exchange everything to EUR and then do the calculations
-    cat_df = data[(data.apply(exchange_in_out, axis=1).year==int(year)) & (data.apply(exchange_in_out, axis=1).account != 'generali_SAV')].groupby(['year','month','category']).agg({'in':'sum', 'out':'sum'}).reset_index()
+    mask = ((data.year == int(year)) & ~data.account.isin(CATEGORY_EXCLUDED_ACCOUNTS)).to_numpy()
+    eur = eur_amounts(data)[mask]
+    cat_df = data.loc[mask, ['year', 'month', 'category']].assign(**{'in': eur.in_eur, 'out': eur.out_eur})
+    cat_df = cat_df.groupby(['year','month','category'], observed=True).agg({'in':'sum', 'out':'sum'}).reset_index()
+
+    return category_shares(cat_df)
+
+def monthly_category(cube, year):
+    ## same as calculate_monthly_category, read from the monthly aggregates
+    cat_df = cube.categories(year, exclude=CATEGORY_EXCLUDED_ACCOUNTS)
+    cat_df = cat_df.groupby(['year','month','category'], observed=True).agg(**{'in': ('in_eur', 'sum'), 'out': ('out_eur', 'sum')}).reset_index()
+
+    return category_shares(cat_df)
 
+def sqlite_account_months(account):
+    ## cube.account_months pushed down to SQLite, from the (account, date) index
+    return db.account_months(database(), account)
+
+def sqlite_monthly_category(year):
+    ## calculate_monthly_category pushed down to SQLite: only the day totals of the year are read
+    cat_df = db.year_categories(database(), year, exclude=CATEGORY_EXCLUDED_ACCOUNTS)
+    eur = RATES.convert(cat_df) / 100
+    cat_df = cat_df[['year', 'month', 'category']].assign(**{'in': eur.in_eur, 'out': eur.out_eur})
+    cat_df = cat_df.groupby(['year','month','category']).agg({'in':'sum', 'out':'sum'}).reset_index()
+
+    return category_shares(cat_df)
+
+def category_shares(cat_df):
+    ## share of the month total income for every category
     tmp = cat_df.groupby(['year','month'])['in'].sum().reset_index()
     tmp = tmp.rename(columns={'in':'total_income'})
 
@@ -135,3 +530,53 @@ def calculate_monthly_category(data, year):
     merged['pcg_out'] = -merged['out']/merged.total_income
 
     return merged
+
+@data_cached
+def ledger_keys(data):
+    return importer.key_counts(data)
+
+def auto_categorize(rows):
+    ## rows in the data.csv schema: the ones without a category get the category of the first rule
+    ## that applies to them, the others keep theirs
+    category = rows.category.astype('object')
+    todo = (category.isna() | (category == AUTO_CATEGORY) | (category == importer.IMPORT_CATEGORY)).to_numpy()
+    if not todo.any():
+        return rows
+    found, _ = RULES.categorize(rows[todo])
+    category = category.to_numpy().copy()
+    category[todo] = np.where(pd.isna(found), importer.IMPORT_CATEGORY, found)
+    return rows.assign(category=category)
+
+def recategorize(data, rules=None):
+    ## the rows of the ledger whose category the rules (the current ones by default) change, in the
+    ## data.csv schema (ready for LedgerStore.edit), and the hits of every rule. rows no rule applies
+    ## to keep their category
+    rules = RULES if rules is None else rules
+    found, rule = rules.categorize(data)
+    current = data.category.astype('object').to_numpy()
+    changed = ~pd.isna(found) & (found != current)
+    rows = to_file(data[changed][ADD_TRANSACTION_FIELDS]).assign(category=found[changed])
+    return rows, rules.hits(rule)
+
+def rule_hits(data):
+    return RULES.hits(RULES.categorize(data)[1])
+
+def read_statement_rows(source, account, currency=BASE_CURRENCY, name=None):
+    ## bank statement (csv, ofx/qfx or qif) in the data.csv schema, None if it has no rows
+    chunks = list(importer.read_statement(source, account=account, currency=currency, name=name))
+    return pd.concat(chunks, ignore_index=True) if chunks else None
+
+def import_statement(data, source, account, currency=BASE_CURRENCY, name=None, rows=None):
+    ## bank statement (csv, ofx/qfx or qif) -> (updated ledger, new rows, rows read)
+    ## rows already in the ledger are skipped, so importing overlapping statements is safe
+    ## rows: the statement already read by read_statement_rows
+    if rows is None:
+        rows = read_statement_rows(source, account, currency, name)
+    if rows is None:
+        return data, None, 0
+    rows = to_ledger(auto_categorize(rows), like=data)
+    new = importer.new_rows(rows, ledger_keys(data))
+    if not len(new):
+        return data, None, len(rows)
+    data, new = add_rows(data, new)
+    return data, new, len(rows)
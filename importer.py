@@ -0,0 +1,204 @@
+import re
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+CHUNK_SIZE = 50_000
+## category of the imported rows when the statement has none
+IMPORT_CATEGORY = 'uncategorized'
+
+## usual column names of bank csv exports, first match wins
+CSV_COLUMNS = {
+    'date': ['date', 'booking date', 'transaction date', 'completed date', 'value date', 'started date'],
+    'description': ['description', 'details', 'payee', 'name', 'memo', 'reference', 'narrative'],
+    'amount': ['amount', 'value', 'transaction amount'],
+    'in': ['in', 'credit', 'paid in', 'money in', 'deposit'],
+    'out': ['out', 'debit', 'paid out', 'money out', 'withdrawal'],
+    'category': ['category'],
+}
+## the account and currency are the ones chosen for the import, never read from the file: a
+## bank's 'Account' column (an IBAN, a card number) is not an account of the ledger
+
+## candidate formats of the statement dates, in this order: a file is read with the first one that
+## reads all its dates (day first before month first when both do, e.g. no day above 12)
+DATE_FORMATS = [
+    '%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M', '%Y%m%d', '%Y/%m/%d',
+    '%d/%m/%Y', '%m/%d/%Y', '%d/%m/%y', '%m/%d/%y', '%d.%m.%Y', '%d.%m.%y', '%d-%m-%Y', '%m-%d-%Y',
+    '%d %b %Y', '%d %B %Y', '%b %d, %Y', '%B %d, %Y',
+]
+
+
+def _match_columns(columns, mapping=None):
+    ## source column of every target column, explicit mapping first, then the usual names
+    found = dict(mapping or {})
+    lower = {str(col).strip().lower(): col for col in columns}
+    for target, names in CSV_COLUMNS.items():
+        if target in found:
+            continue
+        for name in names:
+            if name in lower:
+                found[target] = lower[name]
+                break
+    if 'date' not in found or not ({'amount', 'in', 'out'} & set(found)):
+        raise ValueError(f'Cannot find the date and amount columns in {list(columns)}')
+    return found
+
+def _amounts(values):
+    ## '1.234,56', '-12.50', '(12.50)' ... to float
+    if pd.api.types.is_numeric_dtype(values):
+        return values.astype('float64')
+    values = values.astype('string').str.strip().str.replace(r'^\((.*)\)$', r'-\1', regex=True)
+    comma_decimal = values.str.contains(r',\d{1,2}$', regex=True).fillna(False)
+    values = values.where(~comma_decimal, values.str.replace('.', '', regex=False).str.replace(',', '.', regex=False))
+    values = values.str.replace(r'[^\d.\-]', '', regex=True)
+    return pd.to_numeric(values, errors='coerce')
+
+def _clean_dates(dates):
+    return dates.astype('string').str.strip().str.replace(r'\s+', ' ', regex=True)
+
+def infer_date_format(dates):
+    ## the one format every date of the statement is read with (not guessed row by row: 02/03
+    ## must not be March in one row and February in the next)
+    dates = _clean_dates(pd.Series(dates)).dropna()
+    for fmt in DATE_FORMATS:
+        if pd.to_datetime(dates, format=fmt, errors='coerce').notna().all():
+            return fmt
+    raise ValueError(f'Cannot find one date format for the dates of the statement, e.g. {list(dates[:3])}')
+
+def parse_dates(dates, fmt):
+    dates = _clean_dates(dates)
+    parsed = pd.to_datetime(dates, format=fmt, errors='coerce')
+    wrong = parsed.isna() & dates.notna()
+    if wrong.any():
+        raise ValueError(f'The date {dates[wrong].iloc[0]!r} does not have the format of the statement ({fmt})')
+    return parsed
+
+def _to_schema(chunk, account, currency, fmt):
+    ## chunk with the matched columns -> data.csv schema (dates parsed with the statement's format)
+    rows = pd.DataFrame(index=chunk.index)
+    rows['date'] = parse_dates(chunk['date'], fmt)
+    rows['account'] = account
+    rows['category'] = chunk['category'].fillna(IMPORT_CATEGORY) if 'category' in chunk else IMPORT_CATEGORY
+    rows['description'] = chunk['description'] if 'description' in chunk else ''
+    rows['currency'] = currency
+    if 'amount' in chunk:
+        amount = _amounts(chunk['amount']).fillna(0)
+        rows['in'] = amount.clip(lower=0)
+        rows['out'] = (-amount).clip(lower=0)
+    else:
+        rows['in'] = _amounts(chunk['in']).fillna(0).abs() if 'in' in chunk else 0.0
+        rows['out'] = _amounts(chunk['out']).fillna(0).abs() if 'out' in chunk else 0.0
+    return rows.reset_index(drop=True)
+
+def read_csv_statement(source, account, currency, mapping=None, chunksize=CHUNK_SIZE, fmt=None):
+    ## fmt: format of the dates, found from the first chunk by default
+    reader = pd.read_csv(source, chunksize=chunksize, dtype=str, skipinitialspace=True)
+    for chunk in reader:
+        columns = _match_columns(chunk.columns, mapping)
+        chunk = chunk[list(columns.values())].set_axis(list(columns.keys()), axis=1)
+        fmt = fmt or infer_date_format(chunk['date'])
+        yield _to_schema(chunk, account, currency, fmt)
+
+def _records_to_chunks(records, chunksize):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= chunksize:
+            yield pd.DataFrame(batch)
+            batch = []
+    if batch:
+        yield pd.DataFrame(batch)
+
+def _ofx_record(record):
+    return {
+        'date': record.get('DTPOSTED', '')[:8],
+        'amount': record.get('TRNAMT'),
+        'description': ' '.join(v for v in (record.get('NAME'), record.get('MEMO')) if v),
+    }
+
+def _ofx_records(lines):
+    ## SGML or XML OFX: one record per <STMTTRN>, leaf tags may or may not be closed
+    ## the records are split on the tags, not on the lines: an SGML export is often one line
+    record = None
+    for line in lines:
+        for closing, tag, value in re.findall(r'<(/?)(\w+)>([^<\r\n]*)', line):
+            tag = tag.upper()
+            if tag == 'STMTTRN':
+                if record is not None:
+                    ## closing tag, or a new record while the last one was left open
+                    yield _ofx_record(record)
+                record = None if closing else {}
+            elif record is not None and not closing and tag in ('DTPOSTED', 'TRNAMT', 'NAME', 'MEMO'):
+                record[tag] = value.strip()
+    if record is not None:
+        yield _ofx_record(record)
+
+def read_ofx_statement(source, account, currency, chunksize=CHUNK_SIZE):
+    with open(source, errors='replace') as f:
+        for chunk in _records_to_chunks(_ofx_records(f), chunksize):
+            yield _to_schema(chunk, account, currency, '%Y%m%d')
+
+def _qif_records(lines):
+    ## one record per '^' terminated block: D date, T/U amount, P payee, M memo
+    record = {}
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if not line or line.startswith('!'):
+            continue
+        code, value = line[0], line[1:].strip()
+        if code == '^':
+            if record:
+                yield {
+                    'date': record.get('D', '').replace("'", '/'),
+                    'amount': record.get('T', record.get('U')),
+                    'description': ' '.join(v for v in (record.get('P'), record.get('M')) if v),
+                }
+            record = {}
+        elif code in 'DTUPM':
+            record.setdefault(code, value)
+
+def read_qif_statement(source, account, currency, chunksize=CHUNK_SIZE, fmt=None):
+    with open(source, errors='replace') as f:
+        for chunk in _records_to_chunks(_qif_records(f), chunksize):
+            fmt = fmt or infer_date_format(chunk['date'])
+            yield _to_schema(chunk, account, currency, fmt)
+
+def read_statement(source, account, currency='EUR', mapping=None, name=None, chunksize=CHUNK_SIZE, date_format=None):
+    ## chunks of statement rows in the data.csv schema, the format comes from the file extension
+    ## every row gets the account and currency given here. date_format: strftime format of the
+    ## dates of a csv or qif file, by default the one format of DATE_FORMATS that reads them all
+    suffix = Path(name or source).suffix.lower()
+    if suffix in ('.ofx', '.qfx'):
+        return read_ofx_statement(source, account, currency, chunksize)
+    if suffix == '.qif':
+        return read_qif_statement(source, account, currency, chunksize, date_format)
+    return read_csv_statement(source, account, currency, mapping, chunksize, date_format)
+
+def row_keys(data):
+    ## dedup key of every ledger row: hash of (date, account, signed amount in cents, description)
+    description = data.description.astype('string').fillna('').str.strip().str.lower()
+    keys = pd.DataFrame({
+        'date': data.date.dt.normalize().to_numpy(),
+        'account': data.account.astype('string').to_numpy(),
+        'amount': data['in'].to_numpy(dtype='int64') - data['out'].to_numpy(dtype='int64'),
+        'description': description.to_numpy(),
+    })
+    return pd.util.hash_pandas_object(keys, index=False).to_numpy()
+
+def key_counts(data):
+    ## sorted distinct keys of the ledger and how many rows share each one
+    return np.unique(row_keys(data), return_counts=True)
+
+def new_rows(rows, ledger_keys):
+    ## drop the rows already in the ledger, counting repeats: a statement with the same
+    ## transaction 3 times against a ledger that has it twice imports it once
+    keys = row_keys(rows)
+    existing, counts = ledger_keys
+    occurrence = pd.Series(keys).groupby(keys).cumcount().to_numpy()
+    if not len(existing):
+        return rows
+    pos = np.clip(np.searchsorted(existing, keys), 0, len(existing) - 1)
+    in_ledger = np.where(existing[pos] == keys, counts[pos], 0)
+    return rows[occurrence >= in_ledger]
@@ -0,0 +1,45 @@
+import numpy as np
+
+
+def _groups(data):
+    ## (account, year) -> sorted row ids
+    groups = {}
+    if data is None or not len(data):
+        return groups
+    ids = data.index.to_numpy()
+    for (account, year), positions in data.groupby(['account', 'year'], sort=False, observed=True).indices.items():
+        groups[(account, int(year))] = np.sort(ids[positions])
+    return groups
+
+
+class LedgerIndex:
+    ## row ids of the ledger grouped by (account, year)
+    ## lookups by account, by year or both only touch the matching groups
+
+    def __init__(self, data):
+        self.rebuild(data)
+
+    def rebuild(self, data):
+        self.groups = _groups(data)
+
+    def apply(self, added=None, removed=None):
+        ## only the groups of the added/removed rows are rewritten
+        for key, ids in _groups(removed).items():
+            self.groups[key] = np.setdiff1d(self.groups.get(key, ids), ids, assume_unique=True)
+            if not len(self.groups[key]):
+                del self.groups[key]
+
+        for key, ids in _groups(added).items():
+            self.groups[key] = np.union1d(self.groups.get(key, ids[:0]), ids)
+
+    def _keys(self, account=None, year=None):
+        return [
+            key for key in self.groups
+            if (account is None or key[0] == account) and (year is None or key[1] == int(year))
+        ]
+
+    def ids(self, account=None, year=None):
+        keys = self._keys(account, year)
+        if not keys:
+            return np.array([], dtype='int64')
+        return np.concatenate([self.groups[key] for key in keys])
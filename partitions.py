@@ -0,0 +1,216 @@
+import json
+import os
+import threading
+from pathlib import Path
+
+import pandas as pd
+
+import storage
+
+
+COLUMNS = ['date', 'account', 'category', 'description', 'currency', 'in', 'out']
+TOTALS_KEYS = ['date', 'account', 'category', 'currency']
+MANIFEST_VERSION = 1
+
+
+def _cents(amounts):
+    return (amounts.astype('float64').fillna(0) * 100).round().astype('int64')
+
+def empty():
+    ## no rows, with the dtypes of a partition
+    dtypes = {'date': 'datetime64[ns]', 'in': 'float64', 'out': 'float64'}
+    return pd.DataFrame({col: pd.Series(dtype=dtypes.get(col, 'object')) for col in COLUMNS}, index=pd.Index([], dtype='int64'))
+
+def day_totals(rows):
+    ## in/out (cents) and row count of every (day, account, category, currency) of the rows,
+    ## same columns as database.daily_totals
+    rows = rows.assign(**{'in': _cents(rows['in']), 'out': _cents(rows['out']), 'rows': 1})
+    rows = rows.astype({col: 'object' for col in ['account', 'category', 'currency']})
+    totals = rows.groupby(TOTALS_KEYS, dropna=False)[['in', 'out', 'rows']].sum().reset_index()
+    totals['year'] = totals.date.dt.year
+    totals['month'] = totals.date.dt.month
+    return totals
+
+def summary(rows):
+    ## manifest entry of a partition: row count and date range
+    return {
+        'rows': int(len(rows)),
+        'first': rows.date.min().strftime('%Y-%m-%d'),
+        'last': rows.date.max().strftime('%Y-%m-%d'),
+    }
+
+
+class PartitionStore:
+    ## the ledger as one file per year (data.csv schema plus the row id) next to the day totals of
+    ## the year, and a small manifest with the summary of every partition
+    ## the manifest is written last and records the signature of the two files of every year: a
+    ## crash between the renames leaves files it does not know, their totals are rebuilt on load
+    ## the totals are enough for the aggregates, the rows of a year are only read when needed and
+    ## a change rewrites the partitions of the years it touches, nothing else
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.suffix = '.feather' if storage.feather is not None else '.csv'
+        self.lock = threading.Lock()
+        ## row id -> year of the rows read or written, to find the partition of an edit/delete
+        self.where = {}
+        self.manifest = self._read_manifest()
+        if self.exists():
+            self._check()
+
+    def exists(self):
+        return (self.path / 'manifest.json').exists()
+
+    def _read_manifest(self):
+        try:
+            with open(self.path / 'manifest.json') as f:
+                manifest = json.load(f)
+            if manifest.get('version') == MANIFEST_VERSION:
+                return manifest
+        except FileNotFoundError:
+            pass
+        return {'version': MANIFEST_VERSION, 'next_id': 0, 'partitions': {}}
+
+    def _write_manifest(self):
+        path = self.path / 'manifest.json'
+        tmp = path.with_name(f'.{path.name}.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.manifest, f, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def _check(self):
+        ## the files of every year must be the ones the manifest was written with, otherwise the
+        ## year file is the truth: its totals and its entry are rebuilt from it
+        changed = False
+        files = {int(path.stem) for path in self.path.glob(f'[0-9]*{self.suffix}') if path.stem.isdigit()}
+        for year in sorted(files | set(self.years())):
+            entry = self.manifest['partitions'].get(str(year), {})
+            if (entry.get('file') == storage.file_signature(self._file(year))
+                    and entry.get('totals') == storage.file_signature(self._file(year, '.totals'))):
+                continue
+            print(f'Partition {year} does not match the manifest, rebuilding its totals')
+            rows = empty()
+            if year in files:
+                rows = self._read_file(self._file(year)).set_index('id')
+                rows.index.name = None
+            if len(rows):
+                self.manifest['next_id'] = max(self.manifest['next_id'], int(rows.index.max()) + 1)
+            self.manifest['partitions'][str(year)] = {}
+            self._write_year(year, rows, totals_only=True)
+            changed = True
+        if changed:
+            self._write_manifest()
+
+    @property
+    def next_id(self):
+        return self.manifest['next_id']
+
+    def years(self):
+        ## most recent first, like the ledger
+        return sorted((int(year) for year in self.manifest['partitions']), reverse=True)
+
+    def _file(self, year, kind=''):
+        return self.path / f'{year}{kind}{self.suffix}'
+
+    def _read_file(self, path):
+        if self.suffix == '.feather':
+            return storage.feather.read_feather(path)
+        data = pd.read_csv(path)
+        data['date'] = pd.to_datetime(data.date, format='%Y-%m-%d')
+        return data
+
+    def _write_file(self, data, path):
+        ## next to the target and renamed over it, like every other write of the ledger
+        if self.suffix == '.feather':
+            tmp = path.with_name(f'.{path.name}.tmp')
+            storage.feather.write_feather(data.reset_index(drop=True), tmp, compression='uncompressed')
+            os.replace(tmp, path)
+        else:
+            storage.atomic_write_csv(data.assign(date=data.date.dt.strftime('%Y-%m-%d')), path)
+
+    def _read_year(self, year):
+        if str(year) not in self.manifest['partitions']:
+            return empty()
+        data = self._read_file(self._file(year)).set_index('id')
+        data.index.name = None
+        self.where.update(dict.fromkeys(data.index.tolist(), int(year)))
+        return data
+
+    def read(self, years):
+        ## rows of the years in the data.csv schema, indexed by row id
+        with self.lock:
+            parts = [self._read_year(year) for year in years]
+        parts = [part for part in parts if len(part)]
+        if not parts:
+            return empty()
+        return pd.concat(parts)
+
+    def read_totals(self):
+        ## day totals of every partition: what the aggregates are built from without the rows
+        with self.lock:
+            parts = [self._read_file(self._file(year, '.totals')) for year in self.years()]
+        if not parts:
+            return day_totals(empty())
+        return pd.concat(parts, ignore_index=True)
+
+    def _write_year(self, year, rows, totals_only=False):
+        ## the manifest entry is updated in memory, the caller writes the manifest after the files
+        if not len(rows):
+            for path in (self._file(year), self._file(year, '.totals')):
+                path.unlink(missing_ok=True)
+            self.manifest['partitions'].pop(str(year), None)
+            return
+        rows = rows.sort_values(by='date', ascending=False, kind='stable')
+        rows = rows.astype({col: 'object' for col in ['account', 'category', 'currency']})
+        if not totals_only:
+            self._write_file(rows[COLUMNS].rename_axis('id').reset_index(), self._file(year))
+        self._write_file(day_totals(rows[COLUMNS]), self._file(year, '.totals'))
+        self.manifest['partitions'][str(year)] = {
+            **summary(rows),
+            'file': storage.file_signature(self._file(year)),
+            'totals': storage.file_signature(self._file(year, '.totals')),
+        }
+        self.where.update(dict.fromkeys(rows.index.tolist(), int(year)))
+
+    def write_all(self, data):
+        ## the whole ledger (data.csv schema, indexed by row id), e.g. the one-shot migration
+        self.path.mkdir(parents=True, exist_ok=True)
+        with self.lock:
+            for year in self.years():
+                self._write_year(year, data.iloc[:0])
+            for year, rows in data.groupby(data.date.dt.year):
+                self._write_year(int(year), rows)
+            self.manifest['next_id'] = int(data.index.max()) + 1 if len(data) else 0
+            self._write_manifest()
+
+    def apply(self, added=None, edited=None, deleted=None):
+        ## row level changes (data.csv schema, indexed by row id): only the partitions of the years
+        ## the rows come from or go to are read and rewritten
+        rows = [part for part in (added, edited) if part is not None and len(part)]
+        rows = pd.concat(rows) if rows else None
+        self.path.mkdir(parents=True, exist_ok=True)
+        with self.lock:
+            gone = set(deleted or []) | (set() if edited is None else set(edited.index.tolist()))
+            unknown = [i for i in gone if i not in self.where]
+            if unknown:
+                ## rows never read by this process: look for them in every partition
+                for year in self.years():
+                    self._read_year(year)
+
+            years = {self.where[i] for i in gone if i in self.where}
+            if rows is not None:
+                years |= set(rows.date.dt.year.astype(int).tolist())
+            for year in sorted(years):
+                current = self._read_year(year)
+                current = current[~current.index.isin(gone)]
+                if rows is not None:
+                    current = pd.concat([current, rows[rows.date.dt.year == year][COLUMNS]])
+                self._write_year(year, current)
+            for i in deleted or []:
+                self.where.pop(i, None)
+
+            if rows is not None:
+                self.manifest['next_id'] = max(self.manifest['next_id'], int(rows.index.max()) + 1)
+            self._write_manifest()
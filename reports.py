@@ -0,0 +1,203 @@
+import argparse
+import html
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import cube
+import helpers as hp
+
+
+## standalone reports of every (account, year) and (year, month): the charts and tables of the Plots
+## tab, written as html (plotly.js is written once next to them) and csv
+## python reports.py [--output reports] [--workers 4]
+OUTPUT_DIR = Path(__file__).parent / 'reports'
+## None: one worker per cpu
+WORKERS = None
+
+## set in every worker by _init: the monthly aggregates the reports are built from, read only
+_cube = None
+_output = None
+_account_months = {}
+_category_months = {}
+_figures = {}
+
+
+def jobs(monthly):
+    ## one job per report: ('account', account, year) and ('month', year, month)
+    account_jobs = [('account', account, year) for account in monthly.accounts() for year in monthly.years(account)]
+    month_jobs = [('month', year, month) for year in monthly.years() for month in monthly.months(year)]
+    return account_jobs + month_jobs
+
+def _safe(name):
+    return re.sub(r'[^\w.-]', '_', str(name))
+
+def path(job):
+    ## where the report of the job is written, relative to the output folder (without suffix)
+    kind, a, b = job
+    if kind == 'account':
+        return Path('accounts') / _safe(a) / str(b)
+    return Path('months') / f'{a}-{int(b):02d}'
+
+def _page(title, figures, table, depth):
+    ## plotly.js is loaded from the output folder, the reports work offline and stay small
+    script = '../' * depth + 'plotly.min.js'
+    charts = ''.join(
+        fig.to_html(full_html=False, include_plotlyjs=script if i == 0 else False)
+        for i, fig in enumerate(figures)
+    )
+    return (
+        f'<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>{html.escape(title)}</title></head>'
+        f'<body><h1>{html.escape(title)}</h1>{charts}{table.to_html(index=False)}</body></html>\n'
+    )
+
+def _figure(name, build):
+    ## px styles every new figure through the plotly validators (most of the time of a report):
+    ## like the app, each chart is built once per worker and only its data and title are patched
+    if name not in _figures:
+        _figures[name] = build()
+    return _figures[name]
+
+def monthly_figure(y, y_title):
+    ## same chart as plot_monthly_balance / plot_monthly_in_out
+    import plotly.express as px
+
+    fig = px.bar(data_frame=pd.DataFrame({'month': [1], y: [0.0]}), x='month', y=y)
+    fig.update_xaxes(title=None, labelalias=dict(zip(range(1, 13), hp.MONTHS)))
+    fig.update_yaxes(title=y_title)
+    fig.update_layout(showlegend=False)
+    return fig
+
+def category_figure():
+    ## same chart as pcg_category_plot
+    import plotly.express as px
+
+    placeholder = pd.DataFrame({'category': [''], 'pcg_in': [0.0], 'pcg_out': [0.0]})
+    fig = px.bar(data_frame=placeholder, x=['pcg_in', 'pcg_out'], y='category', text_auto='.2%')
+    fig.update_layout(xaxis_tickformat='.0%', xaxis_title='', yaxis_title='', showlegend=False)
+    return fig
+
+def account_report(monthly, account, year):
+    ## monthly balance and net savings of the account in the year (cube.account_months, like the plots)
+    if account not in _account_months:
+        _account_months[account] = monthly.account_months(account)
+    df = _account_months[account]
+    df = df[df.year == int(year)]
+    label = f'{account.upper()} | {year}'
+
+    balance = _figure('balance', lambda: monthly_figure('balance', 'Balance'))
+    balance.data[0].x = df.month.to_numpy()
+    balance.data[0].y = df.balance.to_numpy()
+    balance.layout.title.text = f'Monthly balance | {label}'
+
+    net = _figure('in_out', lambda: monthly_figure('in_out', 'Net Savings'))
+    net.data[0].x = df.month.to_numpy()
+    net.data[0].y = df.in_out.to_numpy()
+    net.data[0].marker.color = np.where(df.in_out <= 0, 'red', 'green')
+    net.layout.title.text = f'Net Savings | {label}'
+    return f'Monthly balance | {label}', [balance, net], df
+
+def month_report(monthly, year, month):
+    ## category percentages of the month (helpers.monthly_category, like the plot and category_table)
+    if year not in _category_months:
+        _category_months[year] = hp.monthly_category(monthly, year)
+    df = _category_months[year]
+    df = df[df.month == int(month)]
+    title = f'Percentage of total in/out by category | {hp.MONTHS[int(month) - 1]}, {year}'
+
+    chart = df[df.pcg_in_out != 0].sort_values(by='pcg_in_out', ascending=False)
+    fig = _figure('category', category_figure)
+    for trace, col in zip(fig.data, ['pcg_in', 'pcg_out']):
+        trace.x = chart[col].to_numpy()
+        trace.y = chart.category.astype('object').to_numpy()
+    fig.layout.title.text = title
+
+    table = df.drop(['year', 'month'], axis=1).sort_values(by='pcg_in_out', ascending=False)
+    for col in ['pcg_in_out', 'pcg_in', 'pcg_out']:
+        table[col] = round(table[col] * 100, 2)
+    return title, [fig], table
+
+def _init(cells, output):
+    global _cube, _output
+    _cube = cube.from_cells(cells)
+    _output = Path(output)
+
+def build(job):
+    ## runs in a worker: writes the html and csv of one report, returns its path
+    kind, a, b = job
+    title, figures, table = account_report(_cube, a, b) if kind == 'account' else month_report(_cube, a, b)
+    target = _output / path(job)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    table.to_csv(target.with_suffix('.csv'), index=False)
+    target.with_suffix('.html').write_text(_page(title, figures, table, len(path(job).parts) - 1), encoding='utf-8')
+    return job
+
+def _index(output, done):
+    ## links to every report, by account and by month
+    rows = []
+    for job in sorted(done, key=lambda job: (job[0], str(job[1]), job[2])):
+        link = path(job).as_posix()
+        label = f'{job[1]} {job[2]}' if job[0] == 'account' else f'{job[1]} {hp.MONTHS[int(job[2]) - 1]}'
+        rows.append(f'<li><a href="{link}.html">{html.escape(label)}</a> (<a href="{link}.csv">csv</a>)</li>')
+    (output / 'index.html').write_text(
+        f'<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>Reports</title></head>'
+        f'<body><h1>Reports</h1><ul>{"".join(rows)}</ul></body></html>\n',
+        encoding='utf-8'
+    )
+
+def generate(cells, output=OUTPUT_DIR, workers=WORKERS, progress=None):
+    ## every report of the monthly aggregates (MonthlyCube.cells), built by a pool of processes
+    ## the cells are sent once to every worker, the jobs only carry their keys
+    ## progress(done, total) is called in this thread after every report
+    ## returns (reports written, failed jobs)
+    import plotly.offline
+
+    output = Path(output)
+    output.mkdir(parents=True, exist_ok=True)
+    (output / 'plotly.min.js').write_text(plotly.offline.get_plotlyjs(), encoding='utf-8')
+    todo = jobs(cube.from_cells(cells))
+    workers = min(workers or os.cpu_count() or 1, max(len(todo), 1))
+
+    done, failed = [], []
+    ## spawned, not forked: the server process runs threads and an event loop
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init, initargs=(cells, output)) as pool:
+        futures = {pool.submit(build, job): job for job in todo}
+        for future in as_completed(futures):
+            try:
+                done.append(future.result())
+            except Exception as e:
+                print(f'Could not write the report {futures[future]}\nException: {e}')
+                failed.append(futures[future])
+            if progress is not None:
+                progress(len(done) + len(failed), len(todo))
+    _index(output, done)
+    return done, failed
+
+def ledger_cells():
+    ## monthly aggregates of the ledger on disk, the way the store builds them
+    hp.load_rates()
+    totals = hp.daily_totals()
+    return cube.MonthlyCube(hp.import_data() if totals is None else totals, hp.eur_amounts).cells
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Personal finance reports')
+    parser.add_argument('--output', type=Path, default=OUTPUT_DIR, help='folder the reports are written to')
+    parser.add_argument('--workers', type=int, default=WORKERS, help='processes (default: one per cpu)')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    done, failed = generate(
+        ledger_cells(),
+        args.output,
+        args.workers,
+        progress=lambda n, total: print(f'\r{n}/{total} reports', end='', flush=True)
+    )
+    print(f'\n{len(done)} reports written to {args.output} in {time.perf_counter() - start:.1f}s' + (f', {len(failed)} failed' if failed else ''))
@@ -0,0 +1,192 @@
+import json
+import os
+import re
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+## fields of a rule, only pattern and category are required:
+## pattern: regular expression (plain words work) searched in the description, case insensitive
+## account: only rows of this account; sign: 'in' or 'out', only income or expenses
+## min/max: bounds of the amount (in or out, currency units)
+FIELDS = ['name', 'pattern', 'category', 'account', 'sign', 'min', 'max']
+FLAGS = re.IGNORECASE | re.DOTALL
+
+
+def _rule(rule, position):
+    rule = {field: rule.get(field) for field in FIELDS}
+    if not rule['category']:
+        raise ValueError(f'Rule {position + 1} has no category')
+    if rule['sign'] not in (None, '', 'in', 'out'):
+        raise ValueError(f"Rule {position + 1}: sign must be 'in' or 'out'")
+    try:
+        re.compile(rule['pattern'] or '', FLAGS)
+    except re.error as e:
+        raise ValueError(f'Rule {position + 1}: invalid pattern ({e})')
+    rule['name'] = rule['name'] or f'rule {position + 1}'
+    return rule
+
+def _combinable(pattern):
+    ## whether the pattern can go in the combined regex: global inline flags (?i) would apply to all the
+    ## rules (or not compile there), and group references or names would point at the wrong groups.
+    ## a false negative only costs speed, the pattern is then searched on its own
+    if re.search(r'\\\d|\\g<|\(\?P[=<]|\(\?<[^=!]|\(\?\(|\(\?[aiLmsux]+\)', pattern):
+        return False
+    try:
+        re.compile(f'(?:{pattern})', FLAGS)
+    except re.error:
+        return False
+    return True
+
+
+class RuleSet:
+    ## ordered categorization rules, the first rule whose conditions all hold gives the category
+    ## consecutive description patterns are compiled into one regex: at the start of the description it
+    ## tries one lookahead per rule, in order, so the first alternative that matches is the first
+    ## rule whose pattern is found anywhere. a pattern that cannot share it (see _combinable) is
+    ## searched on its own between two such runs. it runs once per distinct description, the other
+    ## conditions are checked with array operations over the rows
+
+    def __init__(self, rules=()):
+        self.rules = [_rule(rule, i) for i, rule in enumerate(rules)]
+        self.categories = np.array([rule['category'] for rule in self.rules] + [None], dtype=object)
+        self.accounts = [rule['account'] or None for rule in self.rules]
+        ## 0: any sign, 1: income, 2: expense
+        self.signs = np.array([{'in': 1, 'out': 2}.get(rule['sign'], 0) for rule in self.rules] + [0], dtype='int8')
+        ## bounds in cents, open bounds are -1 / int64 max
+        self.low = np.array([-1 if rule['min'] is None else round(rule['min'] * 100) for rule in self.rules] + [-1], dtype='int64')
+        self.high = np.array(
+            [np.iinfo('int64').max if rule['max'] is None else round(rule['max'] * 100) for rule in self.rules] + [0],
+            dtype='int64'
+        )
+        self.patterns = [re.compile(rule['pattern'] or '', FLAGS) for rule in self.rules]
+        self.combinable = [_combinable(rule['pattern'] or '') for rule in self.rules]
+        ## the combined regex of every run of combinable rules, compiled now so that a rule set that
+        ## cannot be matched is rejected before it is used (or saved)
+        self._matchers = {}
+        for start in range(len(self.rules)):
+            if self.combinable[start] and (start == 0 or not self.combinable[start - 1]):
+                try:
+                    self._matcher(start)
+                except re.error as e:
+                    raise ValueError(f'Rules {start + 1}-{self._end(start)}: the patterns cannot be combined ({e})')
+
+    def __len__(self):
+        return len(self.rules)
+
+    def _end(self, start):
+        ## end of the run of combinable rules starting at start
+        end = start
+        while end < len(self.rules) and self.combinable[end]:
+            end += 1
+        return end
+
+    def _matcher(self, start):
+        ## combined regex of the rules from start to the end of their run (from a rule after one whose
+        ## other conditions failed)
+        if start not in self._matchers:
+            alternatives = [f'(?=.*?(?P<r{i}>{self.rules[i]["pattern"] or ""}))' for i in range(start, self._end(start))]
+            self._matchers[start] = re.compile('^(?:' + '|'.join(alternatives) + ')', FLAGS)
+        return self._matchers[start]
+
+    def _first(self, descriptions, start):
+        ## first rule (from start) whose pattern matches each description, len(rules) for none
+        none = len(self.rules)
+        result = np.full(len(descriptions), none, dtype='int64')
+        todo = np.arange(len(descriptions))
+        while len(todo) and start < none:
+            if self.combinable[start]:
+                matcher, end = self._matcher(start), self._end(start)
+                found = [matcher.match(descriptions[i]) for i in todo]
+                rule = np.array([int(m.lastgroup[1:]) if m else none for m in found], dtype='int64')
+            else:
+                pattern, end = self.patterns[start], start + 1
+                rule = np.array([start if pattern.search(descriptions[i]) else none for i in todo], dtype='int64')
+            hit = rule < none
+            result[todo[hit]] = rule[hit]
+            todo, start = todo[~hit], end
+        return result
+
+    def match(self, descriptions, accounts, amounts_in, amounts_out):
+        ## rule of every row (len(rules) when none applies), amounts in cents
+        n = len(descriptions)
+        codes, uniques = pd.factorize(pd.Series(descriptions).reset_index(drop=True).fillna(''))
+        uniques = [str(description) for description in uniques]
+        ## accounts as codes: -1 for the rules of any account, -2 for an account not in the rows
+        account_codes, account_names = pd.factorize(pd.Series(accounts).reset_index(drop=True))
+        rule_accounts = np.array(
+            [-1 if a is None else (account_names.get_loc(a) if a in account_names else -2) for a in self.accounts] + [-1],
+            dtype='int64'
+        )
+        amounts_in = np.asarray(amounts_in, dtype='int64')
+        amounts_out = np.asarray(amounts_out, dtype='int64')
+        amounts = amounts_in + amounts_out
+        none = len(self.rules)
+
+        result = np.full(n, none, dtype='int64')
+        rows = np.arange(n)
+        start = np.zeros(n, dtype='int64')
+        while len(rows):
+            if len(rows) == n:
+                ## first pass: every distinct description once
+                rule = self._first(uniques, 0)[codes]
+            else:
+                rule = np.empty(len(rows), dtype='int64')
+                for first in np.unique(start):
+                    at = np.flatnonzero(start == first)
+                    needed, inverse = np.unique(codes[rows[at]], return_inverse=True)
+                    rule[at] = self._first([uniques[code] for code in needed], first)[inverse]
+
+            ## the other conditions of the matched rule, for all the rows at once
+            account, sign = rule_accounts[rule], self.signs[rule]
+            ok = (
+                ((account == -1) | (account == account_codes[rows]))
+                & ((sign == 0) | ((sign == 1) & (amounts_in[rows] > 0)) | ((sign == 2) & (amounts_out[rows] > 0)))
+                & (amounts[rows] >= self.low[rule]) & (amounts[rows] <= self.high[rule])
+            )
+            matched = ok & (rule < none)
+            result[rows[matched]] = rule[matched]
+            ## the others try again with the rules after the one that failed
+            retry = ~ok & (rule < none)
+            rows, start = rows[retry], rule[retry] + 1
+        return result
+
+    def categorize(self, data):
+        ## category given by the rules to every row (None where no rule applies) and the rule of
+        ## every row. data: rows of the ledger (amounts in cents) or of data.csv (currency units)
+        amounts_in, amounts_out = data['in'], data['out']
+        if not pd.api.types.is_integer_dtype(amounts_in):
+            amounts_in = (amounts_in.astype('float64').fillna(0) * 100).round().astype('int64')
+            amounts_out = (amounts_out.astype('float64').fillna(0) * 100).round().astype('int64')
+        rule = self.match(data.description, data.account, amounts_in.to_numpy(), amounts_out.to_numpy())
+        return self.categories[rule], rule
+
+    def hits(self, rule):
+        ## rows matched by every rule, in rule order
+        counts = np.bincount(rule, minlength=len(self.rules) + 1)
+        return pd.DataFrame({
+            'rule': [r['name'] for r in self.rules],
+            'pattern': [r['pattern'] for r in self.rules],
+            'category': [r['category'] for r in self.rules],
+            'hits': counts[:len(self.rules)],
+        })
+
+
+def load(path):
+    ## rules.json: a list of rules (see FIELDS), no file is no rules
+    try:
+        with open(path) as f:
+            return RuleSet(json.load(f))
+    except FileNotFoundError:
+        return RuleSet()
+
+def save(rules, path):
+    path = Path(path)
+    tmp = path.with_name(f'.{path.name}.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(rules.rules, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
@@ -0,0 +1,94 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+
+TOKEN = re.compile(r'\w+')
+
+
+def tokens(text):
+    return TOKEN.findall(str(text).lower())
+
+def _postings(data):
+    ## token -> sorted ids of the rows whose description has it
+    ## descriptions repeat a lot (same shop, same transfer): only the distinct ones are tokenized,
+    ## the rows are then expanded with array operations
+    if data is None or not len(data):
+        return {}
+    codes, descriptions = pd.factorize(data.description.fillna(''))
+    words = [tokens(description) for description in descriptions]
+    pair_desc = np.repeat(np.arange(len(words)), [len(w) for w in words])
+    if not len(pair_desc):
+        return {}
+    token_codes, vocab = pd.factorize(np.array([t for w in words for t in w], dtype=object))
+
+    ## rows grouped by description, then every (token, description) pair takes the rows of its description
+    order = np.argsort(codes, kind='stable')
+    ids = data.index.to_numpy()[order]
+    counts = np.bincount(codes, minlength=len(words))
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    lengths = counts[pair_desc]
+    offsets = np.repeat(starts[pair_desc] - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+    row_ids = ids[offsets + np.arange(lengths.sum())]
+    row_tokens = np.repeat(token_codes, lengths)
+
+    ## sorted by (token, id) as one int64 key, a token twice in the same description is kept once
+    low = int(ids.min())
+    span = int(ids.max()) - low + 1
+    keys = np.sort(row_tokens.astype('int64') * span + (row_ids - low))
+    keys = keys[np.concatenate([[True], np.diff(keys) != 0])]
+    row_tokens, row_ids = keys // span, keys % span + low
+    bounds = np.flatnonzero(np.diff(row_tokens)) + 1
+    return dict(zip(vocab[row_tokens[np.concatenate([[0], bounds])]], np.split(row_ids, bounds)))
+
+
+class DescriptionIndex:
+    ## inverted index of the descriptions: token -> sorted row ids, and the sorted vocabulary
+    ## a query is a binary search per word (every word of the query is a prefix, so it works while
+    ## typing) and an intersection of sorted id arrays, the descriptions are never scanned
+
+    def __init__(self, data):
+        self.rebuild(data)
+
+    def rebuild(self, data):
+        self.postings = _postings(data)
+        self.vocab = np.array(sorted(self.postings), dtype=object)
+
+    def apply(self, added=None, removed=None):
+        ## only the tokens of the added/removed rows are touched
+        vocab_changed = False
+        for token, ids in _postings(removed).items():
+            left = np.setdiff1d(self.postings.get(token, ids[:0]), ids, assume_unique=True)
+            if len(left):
+                self.postings[token] = left
+            else:
+                vocab_changed |= self.postings.pop(token, None) is not None
+        for token, ids in _postings(added).items():
+            vocab_changed |= token not in self.postings
+            self.postings[token] = np.union1d(self.postings.get(token, ids[:0]), ids)
+        if vocab_changed:
+            self.vocab = np.array(sorted(self.postings), dtype=object)
+
+    def _prefix(self, word):
+        lo = np.searchsorted(self.vocab, word, side='left')
+        hi = np.searchsorted(self.vocab, word + '￿', side='right')
+        if hi - lo == 1:
+            return self.postings[self.vocab[lo]]
+        if hi == lo:
+            return np.array([], dtype='int64')
+        return np.unique(np.concatenate([self.postings[token] for token in self.vocab[lo:hi]]))
+
+    def ids(self, query):
+        ## sorted ids of the rows whose description has a word starting with every word of the query,
+        ## None for an empty query (no filter)
+        words = sorted(set(tokens(query)), key=len, reverse=True)
+        if not words:
+            return None
+        found = None
+        for word in words:
+            ids = self._prefix(word)
+            found = ids if found is None else np.intersect1d(found, ids, assume_unique=True)
+            if not len(found):
+                break
+        return found
@@ -0,0 +1,50 @@
+import importlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+## 'background': app.py only needs shiny to start serving, the heavy modules and then the ledger are
+## loaded by a worker thread while the first page is requested (the UI shows a loading state)
+## 'eager': both are loaded before app.py finishes importing
+STARTUP_MODE = 'background'
+
+## imported in this order by the worker, the first page waits for them
+HEAVY_MODULES = ['numpy', 'pandas', 'pyarrow', 'plotly.express', 'shinywidgets', 'helpers', 'rules', 'store', 'forecast', 'diagnostics']
+
+## import time breakdown: step -> seconds (modules, then the ledger)
+TIMINGS = {}
+
+_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix='startup')
+
+
+def _import_modules():
+    for name in HEAVY_MODULES:
+        start = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            ## optional dependency (pyarrow), the modules that use it handle its absence
+            pass
+        TIMINGS[f'import {name}'] = time.perf_counter() - start
+
+def run(name, fn):
+    ## fn runs on the worker after the modules (one worker: everything runs in order)
+    def timed():
+        start = time.perf_counter()
+        result = fn()
+        TIMINGS[name] = time.perf_counter() - start
+        return result
+
+    future = _worker.submit(timed)
+    if STARTUP_MODE == 'eager':
+        future.result()
+    return future
+
+MODULES = run('modules', _import_modules)
+
+def wait_modules():
+    ## the modules are imported by the worker only, never by two threads at once
+    MODULES.result()
+
+def report():
+    return '\n'.join(f'{name:<30} {seconds * 1000:8.1f}ms' for name, seconds in TIMINGS.items())
@@ -0,0 +1,263 @@
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:
+    feather = None
+
+
+COMPACT_THRESHOLD = 500
+CACHE_VERSION = '1'
+
+
+def _fsync_dir(path):
+    ## make a rename durable (not supported on every platform)
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def atomic_write_csv(data, path):
+    ## write next to the target and rename over it, so a crash never leaves a half written file
+    path = Path(path)
+    tmp = path.with_name(f'.{path.name}.tmp')
+    with open(tmp, 'w', newline='') as f:
+        data.to_csv(f, index=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    _fsync_dir(path.parent)
+
+def file_signature(path):
+    ## identifies one physical version of a file, os.replace always changes it
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return 'none'
+    return f'{st.st_ino}-{st.st_mtime_ns}-{st.st_size}'
+
+def file_hash(path):
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def parse_dates(dates):
+    return pd.to_datetime(dates, dayfirst=True, errors='raise', format='mixed')
+
+def read_csv(path):
+    data = pd.read_csv(path)
+    if 'id' in data.columns:
+        ## a snapshot written by the journal compaction keeps the row ids
+        data = data.set_index('id')
+        data.index.name = None
+    data['date'] = parse_dates(data.date)
+    return data
+
+def cache_path(path):
+    return Path(path).with_suffix('.feather')
+
+def _cache_key(path, st, digest):
+    return {
+        b'version': CACHE_VERSION.encode(),
+        b'size': str(st.st_size).encode(),
+        b'mtime': str(st.st_mtime_ns).encode(),
+        b'hash': digest.encode(),
+    }
+
+def read_snapshot(path):
+    ## parsed csv, served from a memory mapped feather copy while the csv is unchanged:
+    ## same size and mtime is a hit, a different mtime is still a hit if the content hash matches
+    path = Path(path)
+    if feather is None:
+        return read_csv(path)
+
+    cache = cache_path(path)
+    st = os.stat(path)
+    digest = None
+    try:
+        table = feather.read_table(cache, memory_map=True)
+        key = table.schema.metadata or {}
+        if key.get(b'version') == CACHE_VERSION.encode() and key.get(b'size') == str(st.st_size).encode():
+            if key.get(b'mtime') == str(st.st_mtime_ns).encode():
+                return table.to_pandas()
+            digest = file_hash(path)
+            if key.get(b'hash') == digest.encode():
+                data = table.to_pandas()
+                write_cache(data, cache, _cache_key(path, st, digest))
+                return data
+    except (OSError, pa.ArrowInvalid):
+        pass
+
+    ## hash before parsing, a write landing in between only makes the next start miss
+    digest = digest or file_hash(path)
+    data = read_csv(path)
+    try:
+        write_cache(data, cache, _cache_key(path, st, digest))
+    except Exception as e:
+        print(f'Could not write the data cache\nException: {e}')
+    return data
+
+def write_cache(data, cache, key):
+    table = pa.Table.from_pandas(data, preserve_index=True)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), **key})
+    tmp = cache.with_name(f'.{cache.name}.tmp')
+    feather.write_feather(table, tmp, compression='uncompressed')
+    os.replace(tmp, cache)
+
+def _row_lines(op, rows):
+    ## one json line per row, the rows are serialized column-wise by pandas
+    if rows is None or not len(rows):
+        return []
+    rows = rows.assign(date=rows.date.dt.strftime('%Y-%m-%d'))
+    body = rows.to_json(orient='records', lines=True).rstrip('\n').split('\n')
+    return [f'{{"op": "{op}", "id": {int(i)}, "row": {row}}}\n' for i, row in zip(rows.index, body)]
+
+def read_journal(path):
+    ## the records, and the size of the file up to the end of the last complete one
+    records = []
+    end = 0
+    try:
+        with open(path, 'rb') as f:
+            for line in f:
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError('no end of line')
+                    records.append(json.loads(line))
+                except ValueError:
+                    ## torn last line from a crash mid-append, the change was never acknowledged
+                    break
+                end += len(line)
+    except FileNotFoundError:
+        pass
+    return records, end
+
+def truncate(path, size):
+    ## cut a torn last line, the next append must start on a line of its own
+    try:
+        with open(path, 'r+b') as f:
+            if os.fstat(f.fileno()).st_size > size:
+                f.truncate(size)
+                f.flush()
+                os.fsync(f.fileno())
+    except FileNotFoundError:
+        pass
+
+def replay(data, records):
+    ## fold the records into the last state of every touched row, then apply them all at once
+    final = {}
+    for record in records:
+        final[record['id']] = record['row'] if record['op'] in ('add', 'edit') else None
+    if not final:
+        return data
+
+    data = data.drop(index=[i for i in final if i in data.index])
+    rows = {i: row for i, row in final.items() if row is not None}
+    if rows:
+        new_rows = pd.DataFrame.from_dict(rows, orient='index').reindex(columns=data.columns)
+        new_rows['date'] = parse_dates(new_rows.date)
+        data = pd.concat([data, new_rows]) if len(data) else new_rows
+    return data
+
+
+class Journal:
+    ## data.csv stays the snapshot, every change is appended to data.journal as one json line
+    ## row ids are the id column of the snapshot (its positions for a data.csv without one), rows
+    ## added later get max id + 1. they never change while the app runs
+    ## compaction renames the journal to data.journal.<snapshot signature>, writes the new
+    ## snapshot in the background and then removes the renamed journal: on load a leftover
+    ## renamed journal is replayed only if the snapshot it was written against is still there
+
+    def __init__(self, snapshot, compact_threshold=COMPACT_THRESHOLD):
+        self.snapshot = Path(snapshot)
+        self.journal = self.snapshot.with_suffix('.journal')
+        self.compact_threshold = compact_threshold
+        self.lock = threading.RLock()
+        self.records = 0
+        self._compactor = None
+
+    def _pending(self):
+        return sorted(self.snapshot.parent.glob(f'{self.journal.name}.*'))
+
+    def load(self):
+        with self.lock:
+            self.wait()
+            data = read_snapshot(self.snapshot)
+            for pending in self._pending():
+                if pending.name.split('.')[-1] != file_signature(self.snapshot):
+                    ## the snapshot already contains these changes
+                    pending.unlink()
+                    continue
+                data = replay(data, read_journal(pending)[0])
+                self._start_compaction(data.sort_index(), pending)
+
+            records, end = read_journal(self.journal)
+            truncate(self.journal, end)
+            self.records = len(records)
+            return replay(data, records)
+
+    def append(self, added=None, edited=None, deleted=None):
+        records = _row_lines('add', added) + _row_lines('edit', edited)
+        if deleted is not None:
+            records += [json.dumps({'op': 'delete', 'id': int(i)}) + '\n' for i in deleted]
+        if not records:
+            return
+
+        ## a batch is one write and one fsync
+        with self.lock:
+            with open(self.journal, 'a') as f:
+                f.write(''.join(records))
+                f.flush()
+                os.fsync(f.fileno())
+            self.records += len(records)
+
+    def needs_compaction(self):
+        return self.records >= self.compact_threshold and not self.compacting()
+
+    def compacting(self):
+        return self._compactor is not None and self._compactor.is_alive()
+
+    def compact(self, data):
+        ## data is the full ledger in the data.csv schema with everything in the journal applied,
+        ## indexed by row id: the snapshot keeps the ids, the ledger in memory is not touched
+        with self.lock:
+            if self.compacting() or self._pending():
+                ## a failed compaction is retried from load, never stack a second renamed journal
+                return
+            snapshot = data.sort_index()
+            pending = self.journal.with_name(f'{self.journal.name}.{file_signature(self.snapshot)}')
+            if self.journal.exists():
+                os.replace(self.journal, pending)
+                _fsync_dir(self.journal.parent)
+            self.records = 0
+            self._start_compaction(snapshot, pending)
+
+    def _start_compaction(self, snapshot, pending):
+        def run():
+            try:
+                atomic_write_csv(snapshot.rename_axis('id').reset_index(), self.snapshot)
+                pending.unlink(missing_ok=True)
+            except Exception as e:
+                ## the renamed journal is kept and replayed on the next load
+                print(f'Journal compaction failed\nException: {e}')
+
+        self._compactor = threading.Thread(target=run, name='journal-compaction', daemon=True)
+        self._compactor.start()
+
+    def wait(self):
+        if self._compactor is not None:
+            self._compactor.join()
@@ -0,0 +1,298 @@
+import asyncio
+import contextlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+import balances
+import cube
+import helpers as hp
+import indexes
+import search
+
+
+## the writer waits for this many seconds without new changes, so a burst of edits is written as
+## one batch, but never holds changes back for longer than WRITE_MAX_DELAY
+WRITE_DELAY = 0.2
+WRITE_MAX_DELAY = 2.0
+
+
+def _no_lock():
+    return contextlib.nullcontext()
+
+
+class LedgerStore:
+    ## the ledger shared by every session of the process, with its monthly cube, row index, running
+    ## balances and description search index
+    ## changes are applied one at a time against the latest version (never against a copy a
+    ## session read earlier), the version is bumped and every subscriber is told about it
+    ## a single background writer persists the changes (write-behind), the sessions never wait on disk
+
+    def __init__(self, data, convert, save, compact=None, lock=None, flush=None, totals=None, load=None, budget=None):
+        ## save(data, added, edited, deleted) persists the touched rows, it runs in a worker thread.
+        ## compact(data) folds what is on disk into a new snapshot, in the worker thread after a save
+        ## (the row ids never change).
+        ## lock/flush: async lock held while the writer reports back, and how to push the
+        ## reports to the sessions (the reactive lock and flush)
+        ## totals: day totals the cube and balances are built from instead of the ledger (pre-aggregated
+        ## by the storage), they cover the whole history even when data does not
+        ## load(years): rows of those years (data.csv schema), when data holds only some years and
+        ## the others are loaded on demand; budget: rows kept in memory, the least recently
+        ## loaded years are evicted beyond it
+        self.data = data
+        self.cube = cube.MonthlyCube(data if totals is None else totals, convert)
+        self.index = indexes.LedgerIndex(data)
+        self.search = search.DescriptionIndex(data)
+        self.balances = balances.BalanceIndex(data if totals is None else totals, hp.RATES.rate)
+        self.load = load
+        self.budget = budget
+        ## years in memory, least recently used first (None: the whole history is)
+        self.loaded = None if load is None else OrderedDict.fromkeys(sorted(set([] if data is None else data.year.tolist())))
+        ## rows deleted but not on disk yet, a year loaded meanwhile must not bring them back
+        self.unsaved_deleted = set()
+        self.saving = False
+        self.version = 0
+        self.save = save
+        self.compact = compact
+        self.lock = threading.RLock()
+        self.writer_lock = lock or _no_lock
+        self.flush = flush
+        self.listeners = []
+        self.save_listeners = []
+        self.pending = []
+        self.last_commit = 0
+        self.writer = None
+        ## the batch being written by the writer thread and its future, close() waits for it
+        self.in_flight = None
+        self._saver = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ledger-writer')
+
+    def subscribe(self, listener):
+        ## listener(version) is called after every change
+        self.listeners.append(listener)
+
+    def subscribe_saved(self, listener):
+        ## listener() is called after every batch written: the storage has all the changes up to it
+        self.save_listeners.append(listener)
+
+    def _notify(self):
+        for listener in self.listeners:
+            listener(self.version)
+
+    def commit(self, change, on_saved=None):
+        ## change(data) -> (updated data, added rows, removed rows), an edit removes the old row
+        ## and adds the new one. returns the added and removed rows
+        ## on_saved(error) is called once the change is on disk (error is None) or could not be written
+        with self.lock:
+            updated, added, removed = change(self.data)
+            self.cube.apply(added=added, removed=removed)
+            self.index.apply(added=added, removed=removed)
+            self.search.apply(added=added, removed=removed)
+            self.balances.apply(added=added, removed=removed)
+            self.data = updated
+            self.version += 1
+            if removed is not None:
+                self.unsaved_deleted |= set(removed.index.difference(pd.Index([]) if added is None else added.index).tolist())
+            self.pending.append((
+                pd.Index([]) if added is None else added.index,
+                pd.Index([]) if removed is None else removed.index,
+                on_saved,
+            ))
+            self.last_commit = time.monotonic()
+        self._notify()
+        self._schedule_write()
+        return added, removed
+
+    def apply(self, added=None, edited=None, deleted=None, on_saved=None):
+        ## one batch of changes, one version: added rows in the data.csv schema (dates parsed) get
+        ## the next free row ids, edited rows are indexed by the ids of the rows they replace,
+        ## deleted are row ids (rows already deleted by another session are ignored)
+        ## returns the rows as added/edited and the rows removed/replaced
+        def change(data):
+            parts = [rows for rows in (added, edited) if rows is not None and len(rows)]
+            rows = hp.to_ledger(pd.concat(parts), like=data) if parts else None
+            new = 0 if added is None else len(added)
+            return hp.apply_changes(
+                data,
+                added=rows.iloc[:new] if new else None,
+                edited=rows.iloc[new:] if rows is not None and len(rows) > new else None,
+                deleted=deleted,
+            )
+        return self.commit(change, on_saved)
+
+    def add(self, rows, on_saved=None):
+        return self.apply(added=rows, on_saved=on_saved)[0]
+
+    def edit(self, rows, on_saved=None):
+        return self.apply(edited=rows, on_saved=on_saved)[0]
+
+    def delete(self, ids, on_saved=None):
+        return self.apply(deleted=ids, on_saved=on_saved)[1]
+
+    def import_statement(self, source, account, currency, name=None, on_saved=None):
+        ## returns the imported rows (None if all of them were already in the ledger) and the rows read
+        ## the years of the statement are loaded first, the duplicates are looked for in them
+        rows = hp.read_statement_rows(source, account, currency, name=name)
+        if rows is not None and self.loaded is not None:
+            self.load_years(sorted(set(rows.date.dt.year.tolist())))
+        read = []
+        def change(data):
+            updated, new, count = hp.import_statement(data, source, account, currency, name=name, rows=rows)
+            read.append(count)
+            return updated, new, None
+        return self.commit(change, on_saved)[0], read[0]
+
+    def load_years(self, years):
+        ## make sure the rows of these years are in memory, then evict the least recently used years
+        ## beyond the budget. returns whether data changed (a new version)
+        if self.loaded is None:
+            return False
+        years = [int(year) for year in years]
+        with self.lock:
+            missing = [year for year in years if year not in self.loaded]
+            if missing:
+                rows = self.load(missing)
+                ## rows changed or deleted since they were written are newer in memory
+                rows = rows[~rows.index.isin(self.data.index) & ~rows.index.isin(list(self.unsaved_deleted))]
+                if len(rows):
+                    rows = hp.to_ledger(rows, like=self.data).reindex(columns=self.data.columns)
+                    self.data = hp.merge_rows(hp.extend_categories(self.data, rows), rows)
+                    self.index.apply(added=rows)
+                    self.search.apply(added=rows)
+            for year in years:
+                self.loaded[year] = None
+                self.loaded.move_to_end(year)
+            evicted = self._evict(keep=years)
+            changed = bool(missing) or evicted
+            if changed:
+                self.version += 1
+        if changed:
+            self._notify()
+        return changed
+
+    def _evict(self, keep=()):
+        ## only when everything is on disk: the pending changes and a batch being written refer to
+        ## the rows in memory. the latest year is never evicted
+        if self.budget is None or self.pending or self.saving:
+            return False
+        latest = max(self.loaded, default=None)
+        evicted = False
+        while len(self.data) > self.budget:
+            candidates = [year for year in self.loaded if year not in keep and year != latest]
+            if not candidates:
+                break
+            year = candidates[0]
+            mask = (self.data.year == year).to_numpy()
+            rows = self.data[mask]
+            self.index.apply(removed=rows)
+            self.search.apply(removed=rows)
+            self.data = self.data[~mask]
+            del self.loaded[year]
+            evicted = True
+        return evicted
+
+    def _schedule_write(self):
+        if self.writer is not None and not self.writer.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            ## no event loop (scripts, benchmarks): write right away
+            self.write()
+            return
+        self.writer = loop.create_task(self._write_later())
+
+    async def _write_later(self):
+        started = time.monotonic()
+        while self.pending:
+            wait = min(self.last_commit + WRITE_DELAY, started + WRITE_MAX_DELAY) - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            batch = self._take()
+            future = self._saver.submit(self._save, batch)
+            self.in_flight = (batch, future)
+            error = await asyncio.wrap_future(future)
+            async with self.writer_lock():
+                if self.in_flight is None:
+                    ## close() has waited for this batch and reported it
+                    return
+                self.in_flight = None
+                self._done(batch, error)
+                if self.flush is not None:
+                    await self.flush()
+            if error is not None:
+                ## retried with the next change (or at shutdown), not in a loop
+                break
+            started = time.monotonic()
+
+    def _take(self):
+        ## net effect of the pending changes: a row added then edited is just added,
+        ## a row added then deleted is not written at all
+        with self.lock:
+            pending, self.pending = self.pending, []
+            data = self.data
+            self.saving = True
+        seen, existed = set(), set()
+        for added, removed, _ in pending:
+            removed = set(removed.tolist())
+            existed |= removed - seen
+            seen |= removed | set(added.tolist())
+        present = set(data.index.intersection(list(seen)).tolist())
+        added, edited, deleted = sorted(present - existed), sorted(present & existed), sorted(existed - present)
+        return {
+            'pending': pending,
+            'data': data,
+            'added': data.loc[added] if added else None,
+            'edited': data.loc[edited] if edited else None,
+            'deleted': deleted or None,
+        }
+
+    def _save(self, batch):
+        try:
+            self.save(batch['data'], added=batch['added'], edited=batch['edited'], deleted=batch['deleted'])
+        except Exception as e:
+            print(f'Oops, something went wrong while saving\nException: {e}')
+            return e
+        if self.compact is not None:
+            ## batch['data'] is what is on disk now: the batches are written one at a time
+            try:
+                self.compact(batch['data'])
+            except Exception as e:
+                print(f'Oops, something went wrong while compacting\nException: {e}')
+        return None
+
+    def _done(self, batch, error):
+        with self.lock:
+            self.saving = False
+            if error is None:
+                self.unsaved_deleted -= set(batch['deleted'] or [])
+            else:
+                ## keep the changes, they are written with the next batch
+                self.pending = batch['pending'] + self.pending
+        if error is None:
+            for listener in self.save_listeners:
+                listener()
+        for _, _, on_saved in batch['pending']:
+            if on_saved is not None:
+                on_saved(error)
+
+    def write(self):
+        ## write the pending changes now, in the calling thread
+        if self.pending:
+            batch = self._take()
+            self._done(batch, self._save(batch))
+
+    def close(self):
+        ## nothing acknowledged is lost: called at shutdown, writes whatever is still pending
+        ## a batch already handed to the writer thread is not pending any more: it is waited for
+        ## (never cancelled, nor written a second time alongside it), a failed one is pending again
+        if self.in_flight is not None:
+            batch, future = self.in_flight
+            self.in_flight = None
+            self._done(batch, future.result())
+        if self.writer is not None and not self.writer.done():
+            self.writer.cancel()
+        self.write()
@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+
+import cube
+import database as db
+import helpers as hp
+
+
+def _rows(n, seed=0):
+    ## rows in the data.csv schema over two years, several accounts and currencies
+    rng = np.random.default_rng(seed)
+    accounts = np.array(['sella', 'revolut_GBP', 'generali_SAV'])
+    account = accounts[rng.integers(0, 3, n)]
+    income = rng.random(n) < 0.3
+    amounts = rng.integers(1, 100_000, n) / 100
+    return pd.DataFrame({
+        'date': pd.Timestamp('2023-01-01') + pd.to_timedelta(rng.integers(0, 730, n), unit='D'),
+        'account': account,
+        'category': np.where(income, 'salary', np.array(['wants', 'rent', 'bills'])[rng.integers(0, 3, n)]),
+        'description': [f'transaction {i}' for i in range(n)],
+        'currency': np.where(account == 'revolut_GBP', 'GBP', 'EUR'),
+        'in': np.where(income, amounts, 0.0),
+        'out': np.where(income, 0.0, amounts),
+    })
+
+def _same(sql, pandas):
+    pd.testing.assert_frame_equal(
+        sql.reset_index(drop=True).astype({'account': object, 'currency': object}, errors='ignore'),
+        pandas.reset_index(drop=True).astype({'account': object, 'currency': object}, errors='ignore'),
+        check_dtype=False,
+    )
+
+def test_sql_aggregates_match_the_cube(tmp_path, monkeypatch):
+    con = db.connect(tmp_path / 'data.db')
+    monkeypatch.setattr(hp, '_database', con)
+    rows = _rows(2000)
+    db.write_all(con, rows)
+
+    ## a few row level changes, like the store's writer makes them
+    edited = rows.loc[[3, 4]].assign(out=12.5, category='rent')
+    added = _rows(5, seed=1).set_axis(range(2000, 2005))
+    db.apply(con, added=added, edited=edited, deleted=[7, 8])
+    rows = pd.concat([rows.drop(index=[3, 4, 7, 8]), edited, added])
+
+    monthly = cube.MonthlyCube(hp.to_ledger(rows), convert=hp.eur_amounts)
+    for account in ['sella', 'revolut_GBP', 'generali_SAV']:
+        _same(hp.sqlite_account_months(account), monthly.account_months(account))
+    for year in [2023, 2024]:
+        sql = hp.sqlite_monthly_category(year)
+        expected = hp.monthly_category(monthly, year).astype({'category': object})
+        pd.testing.assert_frame_equal(sql, expected[sql.columns], check_dtype=False)
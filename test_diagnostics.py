@@ -0,0 +1,27 @@
+import pytest
+from shiny import req
+from shiny.types import SilentException
+
+import diagnostics
+
+
+def test_req_short_circuit_is_not_an_error(monkeypatch):
+    monkeypatch.setattr(diagnostics, 'ENABLED', True)
+    monkeypatch.setattr(diagnostics, 'STATS', {})
+
+    @diagnostics.instrument('waiting', kind='calc')
+    def waiting(ready):
+        req(ready)
+        if ready == 'fail':
+            raise ValueError('broken')
+        return ready
+
+    with pytest.raises(SilentException):
+        waiting(None)
+    stats = diagnostics.STATS['waiting']
+    assert stats.count == 0 and stats.errors == 0
+
+    waiting('ok')
+    with pytest.raises(ValueError):
+        waiting('fail')
+    assert stats.count == 2 and stats.errors == 1
@@ -0,0 +1,128 @@
+import numpy as np
+import pandas as pd
+
+import helpers as hp
+import indexes
+
+
+def _ledger(n, day='2024-01-01'):
+    ## ledger rows (amounts in cents, categoricals), ids 0..n-1, dates one day apart, latest first
+    rows = pd.DataFrame({
+        'date': pd.Timestamp(day) + pd.to_timedelta(range(n), unit='D'),
+        'account': ['sella' if i % 2 else 'revolut_GBP' for i in range(n)],
+        'category': 'wants',
+        'description': [f'transaction {i}' for i in range(n)],
+        'currency': ['EUR' if i % 2 else 'GBP' for i in range(n)],
+        'in': 0.0,
+        'out': [1.0 + i for i in range(n)],
+    })
+    return hp.to_ledger(rows).sort_values(by='date', ascending=False)
+
+def test_unchanged_rows_of_an_open_form():
+    data = _ledger(5)
+    opened = data.loc[[3]]
+    assert hp.unchanged(data, opened)
+
+    ## new categories do not count as a change of the row
+    other = hp.to_ledger(pd.DataFrame([{
+        'date': pd.Timestamp('2024-02-01'), 'account': 'sella', 'category': 'new', 'description': 'x',
+        'currency': 'EUR', 'in': 0.0, 'out': 1.0,
+    }]), like=data)
+    assert hp.unchanged(hp.apply_changes(data, added=other)[0], opened)
+
+    edited = hp.to_ledger(hp.to_file(opened).assign(description='edited'), like=data)
+    assert not hp.unchanged(hp.apply_changes(data, edited=edited)[0], opened)
+    assert not hp.unchanged(hp.apply_changes(data, deleted=[3])[0], opened)
+
+def _random_rows(rng, n, like):
+    ## new rows in the data.csv schema, with dates that already are in the ledger
+    days = pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 30, n), unit='D')
+    rows = pd.DataFrame({
+        'date': days,
+        'account': rng.choice(['sella', 'revolut_GBP'], n),
+        'category': rng.choice(['wants', 'rent', 'salary'], n),
+        'description': [f'new {i}' for i in rng.integers(0, 10**6, n)],
+        'currency': 'EUR',
+        'in': 0.0,
+        'out': rng.integers(1, 1000, n) / 4,
+    })
+    return hp.to_ledger(rows, like=like)
+
+def _expected(data, added=None, edited=None, deleted=()):
+    ## reference: drop the replaced rows, append the new ones and sort by date again (stable)
+    replaced = list(deleted) + ([] if edited is None else list(edited.index))
+    kept = data.drop(index=[i for i in replaced if i in data.index])
+    rows = [r for r in (added, edited) if r is not None]
+    merged = pd.concat([kept] + rows) if rows else kept
+    return merged.sort_values(by='date', ascending=False, kind='stable')
+
+def test_apply_changes_keeps_the_ledger_sorted_like_a_stable_sort():
+    rng = np.random.default_rng(0)
+    data = hp.to_ledger(hp.to_file(_random_rows(rng, 200, None))).sort_values(by='date', ascending=False, kind='stable')
+    for size in [1, 3, 8, 9, 40]:
+        ids = rng.choice(data.index.to_numpy(), 2 * size, replace=False)
+        edited = hp.to_ledger(hp.to_file(data.loc[ids[:size]]).assign(
+            date=lambda d: d.date + pd.to_timedelta(rng.integers(-3, 4, len(d)), unit='D'), description='edited'
+        ), like=data)
+        added = _random_rows(rng, size, data)
+        new = pd.concat([added, edited])
+        updated, rows, removed = hp.apply_changes(data, added=new.iloc[:size], edited=new.iloc[size:], deleted=ids[size:])
+
+        start = hp.next_id(data)
+        assert rows.index[:size].tolist() == list(range(start, start + size))
+        assert sorted(removed.index.tolist()) == sorted(ids.tolist())
+        expected = _expected(data, added=rows.iloc[:size], edited=rows.iloc[size:], deleted=ids[size:])
+        assert updated.index.tolist() == expected.index.tolist()
+        pd.testing.assert_frame_equal(updated, expected)
+        data = updated
+
+def test_same_date_rows_go_after_the_ones_already_there():
+    data = _ledger(3)
+    day = data.date.iloc[1]
+    rows = hp.to_ledger(pd.DataFrame([{
+        'date': day, 'account': 'sella', 'category': 'wants', 'description': f'same day {i}', 'currency': 'EUR',
+        'in': 0.0, 'out': 1.0,
+    } for i in range(2)]), like=data)
+    updated, _, _ = hp.apply_changes(data, added=rows)
+    assert updated.description.tolist() == ['transaction 2', 'transaction 1', 'same day 0', 'same day 1', 'transaction 0']
+    assert updated.index.tolist() == [2, 1, 3, 4, 0]
+
+def test_table_positions_after_changes():
+    rng = np.random.default_rng(1)
+    data = hp.to_ledger(hp.to_file(_random_rows(rng, 300, None))).sort_values(by='date', ascending=False, kind='stable')
+    index = indexes.LedgerIndex(data)
+    for _ in range(5):
+        ids = rng.choice(data.index.to_numpy(), 10, replace=False)
+        edited = hp.to_ledger(hp.to_file(data.loc[ids[:5]]).assign(category='rent'), like=data)
+        data, rows, removed = hp.apply_changes(data, added=_random_rows(rng, 5, data), deleted=ids[5:])
+        index.apply(added=rows, removed=removed)
+        data, rows, removed = hp.apply_changes(data, edited=edited)
+        index.apply(added=rows, removed=removed)
+
+    cents = (data['in'] + data['out']).to_numpy()
+    for account, year, category, amount, sort, ascending in [
+        ('All', 'All', 'All', (None, None), 'date', False),
+        ('sella', '2024', 'All', (None, None), 'date', False),
+        ('All', '2024', 'rent', (1, 100), 'date', True),
+        ('revolut_GBP', 'All', 'All', (None, 50), 'category', False),
+        ('All', 'All', 'wants', (2, None), 'out', True),
+    ]:
+        mask = np.ones(len(data), dtype=bool)
+        if account != 'All':
+            mask &= (data.account == account).to_numpy()
+        if year != 'All':
+            mask &= (data.year == int(year)).to_numpy()
+        if category != 'All':
+            mask &= (data.category == category).to_numpy()
+        if amount[0] is not None:
+            mask &= cents >= amount[0] * 100
+        if amount[1] is not None:
+            mask &= cents <= amount[1] * 100
+        expected = np.flatnonzero(mask)
+        ## categories alphabetically, ties in ledger order
+        values = data[sort].iloc[expected].reset_index(drop=True)
+        if sort == 'category':
+            values = values.astype(object)
+        expected = expected[values.sort_values(ascending=ascending, kind='stable').index.to_numpy()]
+        positions = hp.table_positions(data, index, account, year, sort, ascending, category, amount)
+        assert positions.tolist() == expected.tolist()
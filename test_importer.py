@@ -0,0 +1,67 @@
+import pandas as pd
+import pytest
+
+import importer
+
+
+def _read(tmp_path, name, text, **kwargs):
+    path = tmp_path / name
+    path.write_text(text)
+    return pd.concat(list(importer.read_statement(path, 'sella', 'EUR', **kwargs)), ignore_index=True)
+
+def _ledger(rows):
+    ## (date, description, signed cents) -> ledger rows, amounts in cents like the in memory ledger
+    return pd.DataFrame({
+        'date': pd.to_datetime([date for date, _, _ in rows]),
+        'account': 'sella',
+        'description': [description for _, description, _ in rows],
+        'in': [max(amount, 0) for _, _, amount in rows],
+        'out': [max(-amount, 0) for _, _, amount in rows],
+    })
+
+def test_ofx_on_one_line_keeps_every_record(tmp_path):
+    ofx = (
+        'OFXHEADER:100<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS><CURDEF>GBP<BANKTRANLIST>'
+        '<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20240115<TRNAMT>-12.50<NAME>Coffee</STMTTRN>'
+        '<STMTTRN><TRNTYPE>CREDIT<DTPOSTED>20240116120000<TRNAMT>100<NAME>Salary<MEMO>January</STMTTRN>'
+        '<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20240117<TRNAMT>-3<NAME>Bus</STMTTRN>'
+        '</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>'
+    )
+    rows = _read(tmp_path, 'statement.ofx', ofx)
+    assert rows.description.tolist() == ['Coffee', 'Salary January', 'Bus']
+    assert rows.date.dt.strftime('%Y-%m-%d').tolist() == ['2024-01-15', '2024-01-16', '2024-01-17']
+    assert rows['in'].tolist() == [0, 100, 0]
+    assert rows['out'].tolist() == [12.5, 0, 3]
+    assert set(rows.currency) == {'EUR'}
+
+def test_qif_dates_use_one_format_for_the_file(tmp_path):
+    qif = '!Type:Bank\nD01/15/2024\nT-10.00\nPShop\n^\nD02/03/2024\nT-5.00\nPBakery\n^\n'
+    rows = _read(tmp_path, 'statement.qif', qif)
+    assert rows.date.dt.strftime('%Y-%m-%d').tolist() == ['2024-01-15', '2024-02-03']
+
+def test_csv_dates_and_explicit_format(tmp_path):
+    csv = 'Date,Amount,Description\n02/03/2024,-5,a\n13/03/2024,7,b\n'
+    assert _read(tmp_path, 'a.csv', csv).date.dt.strftime('%Y-%m-%d').tolist() == ['2024-03-02', '2024-03-13']
+    csv = 'Date,Amount,Description\n02/03/2024,-5,a\n'
+    assert _read(tmp_path, 'b.csv', csv, date_format='%m/%d/%Y').date.dt.strftime('%Y-%m-%d').tolist() == ['2024-02-03']
+    with pytest.raises(ValueError):
+        _read(tmp_path, 'c.csv', 'Date,Amount\n01/15/2024,1\n15/01/2024,2\n')
+
+def test_csv_account_and_currency_columns_are_ignored(tmp_path):
+    csv = 'Date,Account,Currency,Amount,Description\n2024-01-02,IT60X0542811101000000123456,USD,-5,Shop\n'
+    rows = _read(tmp_path, 'statement.csv', csv)
+    assert rows.account.tolist() == ['sella']
+    assert rows.currency.tolist() == ['EUR']
+
+def test_new_rows_counts_repeated_identical_rows():
+    ledger = _ledger([('2024-01-02', 'Coffee', -250), ('2024-01-02', 'Coffee', -250), ('2024-01-03', 'Rent', -90000)])
+    statement = _ledger([
+        ('2024-01-02', 'Coffee', -250), ('2024-01-02', 'coffee ', -250), ('2024-01-02', 'Coffee', -250),
+        ('2024-01-03', 'Rent', -90000), ('2024-01-04', 'Bus', -300),
+    ])
+    new = importer.new_rows(statement, importer.key_counts(ledger))
+    ## the ledger has the coffee twice: the third one of the statement is new
+    assert new.index.tolist() == [2, 4]
+
+    ## a fresh ledger imports the repeats, they are separate transactions
+    assert len(importer.new_rows(statement, importer.key_counts(ledger.iloc[:0]))) == len(statement)
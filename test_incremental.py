@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+
+import balances
+import cube
+import helpers as hp
+import indexes
+
+## one currency per account, like the app's accounts
+ACCOUNTS = {'sella': 'EUR', 'revolut_GBP': 'GBP', 'generali_SAV': 'EUR'}
+
+
+def _rows(rng, n):
+    ## new rows in the data.csv schema: two years, a few days, so days and months are shared
+    account = rng.choice(list(ACCOUNTS), n)
+    income = rng.random(n) < 0.3
+    amounts = rng.integers(1, 50_000, n) / 100
+    return pd.DataFrame({
+        'date': pd.Timestamp('2023-11-01') + pd.to_timedelta(rng.integers(0, 90, n), unit='D'),
+        'account': account,
+        'category': np.where(income, 'salary', rng.choice(['wants', 'rent', 'bills'], n)),
+        'description': [f'transaction {i}' for i in rng.integers(0, 10**6, n)],
+        'currency': [ACCOUNTS[a] for a in account],
+        'in': np.where(income, amounts, 0.0),
+        'out': np.where(income, 0.0, amounts),
+    })
+
+def _batches(seed, steps=30):
+    ## (ledger after the batch, rows added, rows removed) of random add/edit/delete batches,
+    ## an edit moves rows to another day, account, category or amount
+    rng = np.random.default_rng(seed)
+    data = hp.to_ledger(_rows(rng, 300)).sort_values(by='date', ascending=False, kind='stable')
+    yield data, None, None
+    for step in range(steps):
+        ids = rng.choice(data.index.to_numpy(), min(len(data), rng.integers(0, 40)), replace=False)
+        half = len(ids) // 2
+        edited = hp.to_file(data.loc[ids[:half], hp.ADD_TRANSACTION_FIELDS])
+        moved = _rows(rng, len(edited)).set_axis(edited.index)
+        for field in rng.choice(['date', 'account', 'category', 'out'], 2, replace=False):
+            edited[field] = moved[field]
+        edited['currency'] = [ACCOUNTS[a] for a in edited.account]
+        if step == steps // 2:
+            ## every row of an account goes
+            deleted = data.index[data.account == 'generali_SAV'].difference(edited.index)
+        else:
+            deleted = ids[half:]
+        new = pd.concat([rows for rows in (_rows(rng, rng.integers(0, 20)), edited) if len(rows)] or [edited])
+        rows = hp.to_ledger(new, like=data)
+        added = len(new) - len(edited)
+        data, rows, removed = hp.apply_changes(
+            data,
+            added=rows.iloc[:added] if added else None,
+            edited=rows.iloc[added:] if len(edited) else None,
+            deleted=deleted,
+        )
+        yield data, rows, removed
+
+def test_monthly_cube_matches_a_rebuild():
+    monthly = None
+    for data, added, removed in _batches(0):
+        if monthly is None:
+            monthly = cube.MonthlyCube(data, convert=hp.eur_amounts)
+            continue
+        monthly.apply(added=added, removed=removed)
+        expected = cube.MonthlyCube(data, convert=hp.eur_amounts).cells
+        pd.testing.assert_frame_equal(monthly.cells.sort_index(), expected.sort_index(), check_dtype=False)
+
+def test_ledger_index_matches_a_rebuild():
+    index = None
+    for data, added, removed in _batches(1):
+        if index is None:
+            index = indexes.LedgerIndex(data)
+            continue
+        index.apply(added=added, removed=removed)
+        expected = indexes.LedgerIndex(data).groups
+        assert sorted(index.groups) == sorted(expected)
+        for key, ids in expected.items():
+            assert index.groups[key].tolist() == ids.tolist()
+
+def test_balance_index_matches_a_rebuild():
+    running = None
+    for data, added, removed in _batches(2):
+        if running is None:
+            running = balances.BalanceIndex(data, hp.RATES.rate)
+            continue
+        running.apply(added=added, removed=removed)
+        expected = balances.BalanceIndex(data, hp.RATES.rate)
+        assert running.currencies == expected.currencies
+        for attr in ('days', 'cum', 'rows'):
+            got, want = getattr(running, attr), getattr(expected, attr)
+            assert sorted(got) == sorted(want)
+            for account in want:
+                assert got[account].tolist() == want[account].tolist(), (attr, account)
+        pd.testing.assert_frame_equal(running.closing(), expected.closing())
+        assert running.first_day() == expected.first_day()
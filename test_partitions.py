@@ -0,0 +1,110 @@
+import pandas as pd
+
+import helpers as hp
+import partitions
+import store
+
+
+def _rows(days, account='sella'):
+    ## rows in the data.csv schema, one per day
+    return pd.DataFrame({
+        'date': pd.to_datetime(days),
+        'account': account,
+        'category': 'wants',
+        'description': [f'row {day}' for day in days],
+        'currency': 'EUR',
+        'in': 0.0,
+        'out': [1.25 + i for i in range(len(days))],
+    })
+
+def _ledger():
+    ## two rows in each of 2022, 2023 and 2024, ids 0-5
+    return _rows(['2024-03-01', '2024-01-01', '2023-06-01', '2023-02-01', '2022-05-01', '2022-01-01'])
+
+def _same(got, expected):
+    got = got.sort_index()[partitions.COLUMNS]
+    expected = expected.sort_index()[partitions.COLUMNS]
+    pd.testing.assert_frame_equal(got.astype({'account': object, 'category': object, 'currency': object}), expected, check_index_type=False)
+
+def _totals(parts):
+    return parts.read_totals().sort_values(partitions.TOTALS_KEYS).reset_index(drop=True)
+
+def test_apply_rewrites_only_the_touched_years(tmp_path):
+    parts = partitions.PartitionStore(tmp_path)
+    data = _ledger()
+    parts.write_all(data)
+    assert parts.years() == [2024, 2023, 2022]
+    untouched = parts._file(2022).stat().st_mtime_ns
+
+    ## a new row, a row moved from 2023 to 2024 and a delete in 2024, from a fresh process
+    parts = partitions.PartitionStore(tmp_path)
+    added = _rows(['2024-05-01']).set_axis([6])
+    edited = _rows(['2024-02-01']).set_axis([2])
+    parts.apply(added=added, edited=edited, deleted=[0])
+    expected = pd.concat([data.drop(index=[0, 2]), added, edited])
+
+    parts = partitions.PartitionStore(tmp_path)
+    assert parts.next_id == 7
+    _same(parts.read(parts.years()), expected)
+    assert parts._file(2022).stat().st_mtime_ns == untouched
+    pd.testing.assert_frame_equal(_totals(parts), partitions.day_totals(expected).sort_values(partitions.TOTALS_KEYS).reset_index(drop=True), check_dtype=False)
+
+    ## the last rows of a year go with its partition
+    parts.apply(deleted=[4, 5])
+    assert parts.years() == [2024, 2023]
+    assert not parts._file(2022).exists()
+
+def test_totals_rebuilt_when_a_year_file_is_newer_than_the_manifest(tmp_path):
+    parts = partitions.PartitionStore(tmp_path)
+    data = _ledger()
+    parts.write_all(data)
+
+    ## a crash after the rename of the year files, before the totals and the manifest
+    changed = pd.concat([data[data.date.dt.year == 2023], _rows(['2023-12-01']).set_axis([6])])
+    parts._write_file(changed.rename_axis('id').reset_index(), parts._file(2023))
+    parts._write_file(_rows(['2025-01-01']).set_axis([7]).rename_axis('id').reset_index(), parts._file(2025))
+
+    parts = partitions.PartitionStore(tmp_path)
+    expected = pd.concat([data[data.date.dt.year != 2023], changed, _rows(['2025-01-01']).set_axis([7])])
+    assert parts.years() == [2025, 2024, 2023, 2022]
+    assert parts.next_id == 8
+    _same(parts.read(parts.years()), expected)
+    pd.testing.assert_frame_equal(_totals(parts), partitions.day_totals(expected).sort_values(partitions.TOTALS_KEYS).reset_index(drop=True), check_dtype=False)
+
+    ## the manifest now knows the files, nothing is rebuilt again
+    entry = dict(parts.manifest['partitions']['2023'])
+    assert partitions.PartitionStore(tmp_path).manifest['partitions']['2023'] == entry
+
+def test_load_years_and_eviction(tmp_path):
+    parts = partitions.PartitionStore(tmp_path)
+    data = _ledger()
+    parts.write_all(data)
+
+    ledger = store.LedgerStore(
+        hp.to_ledger(parts.read([2024])).sort_values(by='date', ascending=False),
+        convert=hp.eur_amounts,
+        save=lambda *args, **kwargs: None,
+        totals=parts.read_totals(),
+        load=parts.read,
+        budget=4,
+    )
+    assert sorted(ledger.data.index) == [0, 1]
+    ## the totals (cents) cover the years not loaded
+    assert ledger.cube.cells['out'].sum() == 2250
+
+    assert ledger.load_years([2023])
+    assert sorted(ledger.data.index) == [0, 1, 2, 3]
+    assert sorted(ledger.search.ids('row')) == [0, 1, 2, 3]
+    assert not ledger.load_years([2023])
+
+    ## over budget: 2023 is the least recently used, the latest year always stays
+    assert ledger.load_years([2022])
+    assert list(ledger.loaded) == [2024, 2022]
+    assert sorted(ledger.data.index) == [0, 1, 4, 5]
+    assert sorted(ledger.index.ids(year=2023)) == []
+    assert sorted(ledger.index.ids(year=2022)) == [4, 5]
+
+    ## a year is not evicted while changes to it are not on disk
+    ledger.pending.append((pd.Index([]), pd.Index([]), None))
+    assert ledger.load_years([2023])
+    assert sorted(ledger.data.index) == list(range(6))
@@ -0,0 +1,60 @@
+import pandas as pd
+import pytest
+
+import rules
+
+
+def _rows(descriptions, out=1000, account='sella'):
+    ## rows of the ledger, amounts in cents
+    return pd.DataFrame({
+        'description': descriptions,
+        'account': account,
+        'in': 0,
+        'out': out,
+    })
+
+def _categories(rule_set, descriptions, **kwargs):
+    return rule_set.categorize(_rows(descriptions, **kwargs))[0].tolist()
+
+def test_inline_flags_apply_to_their_rule_only():
+    rule_set = rules.RuleSet([
+        {'pattern': '(?i)netflix', 'category': 'subscription'},
+        {'pattern': '(?x) rent \\s+ (?:march|april)', 'category': 'rent'},
+        {'pattern': 'shop', 'category': 'wants'},
+    ])
+    assert _categories(rule_set, ['NETFLIX.COM', 'Rent  April', 'rent march # april', 'Shop', 'bus']) == [
+        'subscription', 'rent', 'rent', 'wants', None
+    ]
+
+def test_backreferences_and_named_groups():
+    rule_set = rules.RuleSet([
+        {'pattern': 'rent', 'category': 'wants'},
+        {'pattern': r'(\d)-\1', 'category': 'bills'},
+        {'pattern': '(?P<word>coffee) (?P=word)', 'category': 'needs'},
+        {'pattern': '(?P<r0>bus)', 'category': 'transfer'},
+    ])
+    assert _categories(rule_set, ['ref 7-7', 'ref 7-8', 'coffee coffee', 'coffee tea', 'bus', 'rent']) == [
+        'bills', None, 'needs', None, 'transfer', 'wants'
+    ]
+
+def test_rule_after_a_separate_pattern_is_retried():
+    ## the first match fails on the amount, the rows try the rules after it
+    rule_set = rules.RuleSet([
+        {'pattern': r'(\w+) \1', 'category': 'bills', 'max': 5},
+        {'pattern': 'tax', 'category': 'needs'},
+        {'pattern': 'tax tax', 'category': 'wants'},
+    ])
+    assert _categories(rule_set, ['tax tax', 'other'], out=1000) == ['needs', None]
+    assert _categories(rule_set, ['tax tax', 'other'], out=100) == ['bills', None]
+
+def test_invalid_rules_are_not_saved(tmp_path):
+    path = tmp_path / 'rules.json'
+    rules.save(rules.RuleSet([{'pattern': 'netflix', 'category': 'subscription'}]), path)
+    for invalid in [
+        [{'pattern': 'shop(', 'category': 'wants'}],
+        [{'pattern': 'shop', 'category': ''}],
+        [{'pattern': 'shop', 'category': 'wants', 'sign': 'both'}],
+    ]:
+        with pytest.raises(ValueError):
+            rules.save(rules.RuleSet(invalid), path)
+    assert rules.load(path).rules[0]['pattern'] == 'netflix'
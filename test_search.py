@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+
+import search
+
+WORDS = ['amazon', 'amazon.it', 'coop', 'conad', 'rent', 'salary', 'bonifico', 'bonus', 'café', 'tfl', 'uber', 'eats']
+QUERIES = ['', 'a', 'am', 'amazon it', 'co', 'bon', 'café', 'uber eats', 'e', 'nothing', 'rent 2024']
+
+
+def _descriptions(rng, n):
+    ## a few words out of a small vocabulary, so the rows share tokens, some with a year
+    return [
+        ' '.join(rng.choice(WORDS, rng.integers(0, 4))) + (' 2024' if rng.random() < 0.2 else '')
+        for _ in range(n)
+    ]
+
+def _same(index, expected):
+    assert sorted(index.postings) == sorted(expected.postings)
+    for token, ids in expected.postings.items():
+        assert index.postings[token].tolist() == ids.tolist(), token
+    assert index.vocab.tolist() == expected.vocab.tolist()
+    for query in QUERIES:
+        got, want = index.ids(query), expected.ids(query)
+        assert (got is None and want is None) or got.tolist() == want.tolist(), query
+
+def test_incremental_index_matches_a_rebuild():
+    rng = np.random.default_rng(0)
+    data = pd.DataFrame({'description': _descriptions(rng, 200)})
+    index = search.DescriptionIndex(data)
+    next_id = len(data)
+    for step in range(40):
+        ids = rng.choice(data.index.to_numpy(), min(len(data), rng.integers(0, 30)), replace=False)
+        half = len(ids) // 2
+        ## an edit removes the old row and adds the new one under the same id
+        edited = pd.DataFrame({'description': _descriptions(rng, half)}, index=ids[:half])
+        new = rng.integers(0, 10)
+        added = pd.DataFrame({'description': _descriptions(rng, new)}, index=range(next_id, next_id + new))
+        next_id += new
+        removed = data.loc[ids]
+        if step == 20:
+            ## every row with a word goes, and its token with it
+            gone = data.description.str.contains('salary')
+            removed = data[gone | data.index.isin(ids[:half])]
+            edited = edited[~edited.index.isin(data.index[gone]) & ~edited.description.str.contains('salary')]
+            added = added[~added.description.str.contains('salary')]
+        data = pd.concat([data.drop(index=removed.index), edited, added])
+        index.apply(added=pd.concat([edited, added]), removed=removed)
+        _same(index, search.DescriptionIndex(data))
+        if step == 20:
+            assert 'salary' not in index.postings
+
+def test_apply_with_nothing_to_add_or_remove():
+    data = pd.DataFrame({'description': ['Amazon Prime', 'COOP 12', None]})
+    index = search.DescriptionIndex(data)
+    index.apply(added=data.iloc[:0], removed=None)
+    _same(index, search.DescriptionIndex(data))
+    index.apply(removed=data)
+    _same(index, search.DescriptionIndex(data.iloc[:0]))
+    assert index.ids('amazon').tolist() == []
@@ -0,0 +1,98 @@
+import asyncio
+import threading
+
+import pandas as pd
+
+import helpers as hp
+import store
+
+
+def _rows(n, day='2024-01-01'):
+    ## new rows in the data.csv schema, dates parsed
+    return pd.DataFrame({
+        'date': pd.to_datetime([day] * n),
+        'account': 'sella',
+        'category': 'wants',
+        'description': [f'row {i}' for i in range(n)],
+        'currency': 'EUR',
+        'in': 0.0,
+        'out': [1.5 + i for i in range(n)],
+    })
+
+class SlowSave:
+    ## save function of the store: blocks until released, fails the first `failures` calls
+    def __init__(self, failures=0):
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.failures = failures
+        self.calls = []
+
+    def __call__(self, data, added=None, edited=None, deleted=None):
+        self.calls.append(None if added is None else sorted(added.index.tolist()))
+        self.started.set()
+        self.release.wait(5)
+        if len(self.calls) <= self.failures:
+            raise OSError('disk full')
+
+def _close_during_save(save):
+    ledger = store.LedgerStore(hp.to_ledger(_rows(3)).sort_values(by='date', ascending=False), convert=hp.eur_amounts, save=save)
+    reports = []
+
+    async def run():
+        ledger.add(_rows(2, day='2024-02-01'), on_saved=reports.append)
+        ## the writer takes the batch after WRITE_DELAY and hands it to its thread
+        while not save.started.is_set():
+            await asyncio.sleep(0.01)
+        assert not ledger.pending
+        threading.Timer(0.2, save.release.set).start()
+        ledger.close()
+
+    asyncio.run(run())
+    return ledger, reports
+
+def test_close_waits_for_the_batch_being_written():
+    save = SlowSave()
+    ledger, reports = _close_during_save(save)
+    ## written once, by the writer thread, and reported to the session
+    assert save.calls == [[3, 4]]
+    assert reports == [None]
+    assert not ledger.saving and not ledger.pending and ledger.in_flight is None
+
+def test_close_writes_again_a_batch_that_failed_in_flight():
+    save = SlowSave(failures=1)
+    ledger, reports = _close_during_save(save)
+    assert save.calls == [[3, 4], [3, 4]]
+    assert len(reports) == 2 and isinstance(reports[0], OSError) and reports[1] is None
+    assert not ledger.saving and not ledger.pending
+
+def test_compaction_runs_in_the_writer_thread_and_keeps_the_ledger():
+    threads = []
+    ledger = store.LedgerStore(
+        hp.to_ledger(_rows(3)).sort_values(by='date', ascending=False), convert=hp.eur_amounts,
+        save=lambda data, **changes: None, compact=lambda data: threads.append(threading.current_thread().name),
+    )
+    reports = []
+
+    async def run():
+        ledger.add(_rows(2, day='2024-02-01'), on_saved=reports.append)
+        version, data = ledger.version, ledger.data
+        await ledger.writer
+        return version, data
+
+    version, data = asyncio.run(run())
+    assert reports == [None]
+    assert threads and all(name.startswith('ledger-writer') for name in threads)
+    ## nothing renumbered: same frame, same version, no session refreshed
+    assert ledger.version == version and ledger.data is data
+
+def test_saved_listeners_once_the_batch_is_written():
+    save = SlowSave(failures=1)
+    save.release.set()
+    ledger = store.LedgerStore(hp.to_ledger(_rows(3)), convert=hp.eur_amounts, save=save)
+    written = []
+    ledger.subscribe_saved(lambda: written.append(len(save.calls)))
+    ledger.add(_rows(1))
+    ## no event loop: written right away, the failed write is not reported as saved
+    assert written == []
+    ledger.write()
+    assert written == [2]